@@ -0,0 +1,156 @@
+"""
+Load-test the recommendation service and report the latency percentiles and throughput.
+
+Starts a local service on the saved model, or targets a running one with --url,
+then sends /recommend requests for random users from concurrent keep-alive connections:
+
+    python benchmarks/load_test.py MODEL_PATH --requests 5000 --concurrency 32
+    python benchmarks/load_test.py MODEL_PATH --url http://127.0.0.1:8000 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(ROOT, 'py'))
+
+import numpy as np
+
+from persistence import load_arrays
+
+
+async def request(reader, writer, host, target):
+    """
+    Send one GET request on a keep-alive connection
+    :return: (status code, JSON payload)
+    """
+    writer.write('GET {0} HTTP/1.1\r\nHost: {1}\r\n\r\n'.format(target, host).encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads((await reader.readexactly(length)).decode('utf-8'))
+
+
+async def run_load(host, port, user_ids, n_requests, concurrency, n, random_state=0):
+    """
+    Send n_requests /recommend requests from concurrency connections
+    :return: (an array of request latencies in seconds, the wall time in seconds, the number of errors)
+    """
+    random = np.random.RandomState(random_state)
+    targets = ['/recommend?user={0}&n={1}'.format(quote(str(user_id)), n)
+               for user_id in user_ids[random.randint(0, len(user_ids), size=n_requests)]]
+    latencies = []
+    errors = [0]
+
+    async def client(targets):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for target in targets:
+                start = time.perf_counter()
+                status, _ = await request(reader, writer, host, target)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors[0] += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(targets[worker::concurrency]) for worker in range(concurrency)])
+    return np.asarray(latencies), time.perf_counter() - start, errors[0]
+
+
+async def get_health(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return (await request(reader, writer, host, '/health'))[1]
+    finally:
+        writer.close()
+
+
+def start_service(model_path, options, timeout=60.):
+    """
+    Start the service on a free local port and wait until it answers
+    :return: (the process, the port)
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    command = [sys.executable, os.path.join(ROOT, 'py', 'service.py'), model_path, '--port', str(port)]
+    for option in options:
+        command += ['--option', option]
+    process = subprocess.Popen(command)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            asyncio.run(get_health('127.0.0.1', port))
+            return process, port
+        except OSError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                raise RuntimeError('The service did not start.')
+            time.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='the directory of the saved model, its user ids are requested')
+    parser.add_argument('--url', help='a running service, by default one is started on the model')
+    parser.add_argument('--option', action='append', default=[], help='a prediction option for a started service')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent connections')
+    parser.add_argument('--n', type=int, default=10, help='recommendations per request')
+    parser.add_argument('--warmup', type=int, default=200, help='untimed requests sent first')
+    parser.add_argument('--output', help='the JSON file to write the results to')
+    args = parser.parse_args(argv)
+
+    user_ids = load_arrays(os.path.join(args.model, 'ratings'))[0]['user_ids']
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        process, port = start_service(args.model, args.option)
+        host = '127.0.0.1'
+    try:
+        if args.warmup:
+            asyncio.run(run_load(host, port, user_ids, args.warmup, args.concurrency, args.n, random_state=1))
+        before = asyncio.run(get_health(host, port))
+        latencies, seconds, errors = asyncio.run(run_load(host, port, user_ids, args.requests, args.concurrency,
+                                                          args.n))
+        after = asyncio.run(get_health(host, port))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    batches = after['batches'] - before['batches']
+    report = {'requests': len(latencies), 'concurrency': args.concurrency, 'errors': errors, 'seconds': seconds,
+              'qps': len(latencies) / seconds, 'p50_ms': 1000. * np.percentile(latencies, 50),
+              'p99_ms': 1000. * np.percentile(latencies, 99), 'mean_ms': 1000. * latencies.mean(),
+              'cache_hits': after['cache_hits'] - before['cache_hits'], 'batches': batches,
+              'mean_batch_size': (after['scored'] - before['scored']) / float(max(batches, 1))}
+    print('{0} requests from {1} connections in {2:.2f}s: {3:.0f} QPS, p50 {4:.2f}ms, p99 {5:.2f}ms, '
+          '{6} errors, {7} cache hits, {8:.1f} requests per batch'.format(
+              report['requests'], args.concurrency, seconds, report['qps'], report['p50_ms'], report['p99_ms'],
+              errors, report['cache_hits'], report['mean_batch_size']))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(dict(report, model=after['model'], arguments=vars(args)), output_file, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
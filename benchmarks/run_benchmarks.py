@@ -0,0 +1,211 @@
+"""
+Time and memory-profile the predictors on ML-1M and on synthetic ratings.
+
+Results are written as JSON so two runs can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(ROOT, 'py'))
+
+import numpy as np
+import pandas as pd
+import scipy
+
+from baseline_predictors import BaselinePredictor
+from batch_scoring import recommend_batches
+from collaborative_filtering import CollaborativeFiltering
+from extras import read_ratings, split_train_test
+from matrix_factorisation import MatrixFactorisation
+
+ML_1M_RATINGS = os.path.join(ROOT, 'datasets', 'ml-1m', 'ratings.dat')
+
+
+def measure(function, repeat=3):
+    """
+    Time a function and measure its peak traced memory.
+    The time is the best of repeat untraced runs, the memory is taken from one extra run under tracemalloc.
+    :param function: The function to call without arguments
+    :param repeat: The number of timed runs
+    :return: (seconds, peak bytes, the result of the last call)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    del result
+
+    tracemalloc.start()
+    try:
+        result = function()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak_bytes, result
+
+
+def write_synthetic_ratings(file_path, n_users, n_items, density, rank=10, random_state=0):
+    """
+    Write low rank ratings on the 1-5 scale in the ML-1M ratings.dat format
+    :param file_path: The file to write
+    :param n_users: The number of users
+    :param n_items: The number of items
+    :param density: The fraction of known ratings
+    :param rank: The rank of the underlying preferences
+    :param random_state: Seed for the ratings
+    """
+    random = np.random.RandomState(random_state)
+    n_ratings = int(n_users * n_items * density)
+    keys = np.unique(random.randint(0, n_users * n_items, size=n_ratings, dtype=np.int64))
+    users, items = keys // n_items, keys % n_items
+    user_factors = random.normal(size=(n_users, rank)) / np.sqrt(rank)
+    item_factors = random.normal(size=(n_items, rank))
+    preferences = np.einsum('ij,ij->i', user_factors[users], item_factors[items])
+    values = np.clip(np.round(3 + preferences + random.normal(scale=0.5, size=len(keys))), 1, 5).astype(int)
+    timestamps = 978300000 + random.randint(0, 10 ** 7, size=len(keys))
+    np.savetxt(file_path, np.column_stack((users + 1, items + 1, values, timestamps)), fmt='%d::%d::%d::%d')
+
+
+def run_dataset(name, file_path, args):
+    """
+    Run every benchmark on one ratings file
+    :return: A list of result dicts
+    """
+    results = []
+
+    def record(benchmark, function, **params):
+        seconds, peak_bytes, result = measure(function, repeat=args.repeat)
+        results.append({'dataset': name, 'benchmark': benchmark, 'params': params,
+                        'seconds': seconds, 'peak_bytes': peak_bytes})
+        print('{0:24} {1:42} {2:36} {3:9.3f}s {4:9.1f}MB'.format(
+            name, benchmark, json.dumps(params, sort_keys=True), seconds, peak_bytes / 2. ** 20))
+        return result
+
+    ratings = record('read_ratings', lambda: read_ratings(file_path, cache=False))
+    read_ratings(file_path, cache=True)
+    record('read_ratings_cached', lambda: read_ratings(file_path, cache=True))
+    train, _ = record('split_train_test', lambda: split_train_test(ratings, random_state=0))
+    print('{0:24} {1} users x {2} items, {3} ratings'.format(name, ratings.shape[0], ratings.shape[1], ratings.nnz))
+
+    baseline = BaselinePredictor(train, dtype=args.dtype)
+    for method in ('predict_user_based', 'predict_item_based', 'predict_item_user_based'):
+        record('BaselinePredictor.' + method, getattr(baseline, method))
+
+    for similarity in args.similarities:
+        for k in args.ks:
+            record('CollaborativeFiltering.predict_user_user',
+                   lambda: CollaborativeFiltering(train, dtype=args.dtype, weight_dtype=args.weight_dtype,
+                                                  n_jobs=args.n_jobs).predict_user_user(similarity=similarity, k=k),
+                   similarity=similarity, k=k)
+            record('CollaborativeFiltering.recommend_batches',
+                   lambda: sum(len(batch[0]) for batch in recommend_batches(
+                       CollaborativeFiltering(train, dtype=args.dtype, weight_dtype=args.weight_dtype,
+                                              n_jobs=args.n_jobs),
+                       n=args.n, n_jobs=args.n_jobs, similarity=similarity, k=k)),
+                   similarity=similarity, k=k, n=args.n)
+
+    for rank in args.ranks:
+        mf = record('MatrixFactorisation.fit',
+                    lambda: MatrixFactorisation(train, rank=rank, random_state=0, dtype=args.dtype), rank=rank)
+        record('MatrixFactorisation.predict', mf.predict, rank=rank)
+        record('MatrixFactorisation.recommend_batches',
+               lambda: sum(len(batch[0]) for batch in recommend_batches(mf, n=args.n, n_jobs=args.n_jobs)),
+               rank=rank, n=args.n)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_results):
+    """
+    Print the ratio of each benchmark's time and peak memory to a previous run
+    """
+    def key(result):
+        return result['dataset'], result['benchmark'], json.dumps(result['params'], sort_keys=True)
+
+    previous = dict((key(result), result) for result in baseline_results['results'])
+    print('\ncompared with {0}'.format(baseline_results['commit']))
+    for result in results:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        print('{0:24} {1:42} {2:36} time x{3:6.2f} memory x{4:6.2f}'.format(
+            result['dataset'], result['benchmark'], json.dumps(result['params'], sort_keys=True),
+            result['seconds'] / max(before['seconds'], 1e-9),
+            result['peak_bytes'] / float(max(before['peak_bytes'], 1))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', nargs='+', default=['ml-1m', 'synthetic'], choices=['ml-1m', 'synthetic'])
+    parser.add_argument('--users', type=int, default=2000, help='synthetic users')
+    parser.add_argument('--items', type=int, default=1000, help='synthetic items')
+    parser.add_argument('--density', type=float, default=0.05, help='synthetic fraction of known ratings')
+    parser.add_argument('--ks', type=int, nargs='+', default=[-1, 50])
+    parser.add_argument('--similarities', nargs='+', default=['cosine', 'pearson'])
+    parser.add_argument('--ranks', type=int, nargs='+', default=[20])
+    parser.add_argument('--n', type=int, default=10, help='recommendations per user for batch scoring')
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+                        help='the float type of the models')
+    parser.add_argument('--weight-dtype', choices=['float64', 'float32', 'float16'],
+                        help='the float type of the neighbour weights, defaults to --dtype')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='worker processes for neighbour selection and batch scoring, 0 for one per CPU')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, the best is kept')
+    parser.add_argument('--output', help='the JSON file to write the results to')
+    parser.add_argument('--compare', help='a previous JSON results file to compare with')
+    args = parser.parse_args(argv)
+    args.n_jobs = args.n_jobs or None
+
+    results = []
+    work_path = tempfile.mkdtemp(prefix='benchmarks')
+    try:
+        for dataset in args.datasets:
+            if dataset == 'ml-1m':
+                if not os.path.exists(ML_1M_RATINGS):
+                    print('skipping ml-1m, {0} not found'.format(ML_1M_RATINGS))
+                    continue
+                file_path = os.path.join(work_path, 'ml-1m.dat')
+                shutil.copy(ML_1M_RATINGS, file_path)
+                results.extend(run_dataset('ml-1m', file_path, args))
+            else:
+                file_path = os.path.join(work_path, 'synthetic.dat')
+                write_synthetic_ratings(file_path, args.users, args.items, args.density)
+                name = 'synthetic-{0}x{1}-{2}'.format(args.users, args.items, args.density)
+                results.extend(run_dataset(name, file_path, args))
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    report = {'commit': git_commit(), 'date': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+              'pandas': pd.__version__, 'machine': platform.machine(), 'arguments': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        with open(args.compare) as compare_file:
+            compare(results, json.load(compare_file))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import numpy as np
+
+from persistence import load_arrays, save_arrays
+from recommender import top_n
+
+ANN_ARRAYS = ('vectors', 'centroids', 'list_indptr', 'list_items')
+
+
+class InvertedFileIndex(object):
+    """
+    An approximate maximum inner product index over item vectors.
+    The item vectors are extended with one extra dimension so that all of them have the same norm,
+    which turns the largest inner product with a query into the smallest angle.
+    The extended vectors are clustered with spherical k-means into inverted lists, and a query only
+    scores the items in the n_probe lists whose centroids are closest in angle.
+    More lists probed means higher recall and higher latency, probing every list is an exact search.
+    """
+
+    def __init__(self, vectors, centroids, list_indptr, list_items, n_probe=1):
+        """
+        :param vectors: n_items x d item vectors, in list order
+        :param centroids: n_lists x (d + 1) unit centroids of the extended vectors
+        :param list_indptr: The start of each list in list_items, n_lists + 1 entries
+        :param list_items: The item position of each row of vectors
+        :param n_probe: The default number of lists to probe per query
+        """
+        self.vectors = vectors
+        self.centroids = centroids
+        self.list_indptr = list_indptr
+        self.list_items = list_items
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=None, n_iter=10, random_state=None, chunk_size=4096):
+        """
+        Cluster item vectors into an index
+        :param vectors: n_items x d item vectors
+        :param n_lists: The number of inverted lists, defaults to the square root of the number of items
+        :param n_probe: The default number of lists to probe per query, defaults to a tenth of the lists
+        :param n_iter: The number of k-means iterations
+        :param random_state: Seed for the initial centroids
+        :param chunk_size: The number of items assigned to centroids at a time
+        :return: The InvertedFileIndex
+        """
+        vectors = np.asarray(vectors, dtype=np.float64)
+        n_items = vectors.shape[0]
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_items))
+        n_lists = max(1, min(n_lists, n_items))
+        if n_probe is None:
+            n_probe = max(1, n_lists // 10)
+
+        extended = _extend(vectors)
+        random = np.random.RandomState(random_state)
+        centroids = extended[random.choice(n_items, n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignments = _assign(extended, centroids, chunk_size)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, extended)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            sums[empty] = extended[random.choice(n_items, empty.sum(), replace=False)]
+            norms[empty] = 1.
+            centroids = sums / norms[:, np.newaxis]
+        assignments = _assign(extended, centroids, chunk_size)
+
+        list_items = np.argsort(assignments, kind='stable').astype(np.int32)
+        list_indptr = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists))))
+        return cls(vectors[list_items], centroids, list_indptr, list_items, n_probe=n_probe)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def n_items(self):
+        return len(self.list_items)
+
+    def search(self, query, n, n_probe=None, exclude=None):
+        """
+        Find the items with the largest inner product with a query among the probed lists.
+        The candidates are scored exactly, only items in lists that are not probed can be missed.
+        :param query: A d vector
+        :param n: The number of items to return
+        :param n_probe: The number of lists to probe, defaults to the index's n_probe
+        :param exclude: Optional item positions that may not be returned
+        :return: (item positions, inner products), largest first
+        """
+        if n_probe is None:
+            n_probe = self.n_probe
+        query = np.asarray(query, dtype=np.float64)
+        lists = top_n(self.centroids[:, :-1].dot(query), n_probe)
+        starts = np.asarray(self.list_indptr[lists])
+        lengths = np.asarray(self.list_indptr[lists + 1]) - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        rows = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        items = np.asarray(self.list_items[rows])
+        scores = np.asarray(self.vectors[rows]).dot(query)
+        if exclude is not None and len(exclude):
+            scores[np.isin(items, exclude)] = -np.inf
+        best = top_n(scores, n)
+        return items[best], scores[best]
+
+    def save(self, path):
+        """
+        Save the index as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        save_arrays(path, dict((name, getattr(self, name)) for name in ANN_ARRAYS),
+                    {'n_items': self.n_items, 'n_lists': self.n_lists, 'n_probe': self.n_probe})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load an index saved with save, memory-mapping the item vectors by default
+        :param path: The directory the index was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The InvertedFileIndex
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        return cls(*[arrays[name] for name in ANN_ARRAYS], n_probe=manifest['n_probe'])
+
+
+def _extend(vectors):
+    """
+    Scale the vectors into the unit ball and add the dimension that brings each of them to unit norm
+    """
+    norms = np.linalg.norm(vectors, axis=1)
+    max_norm = norms.max() if len(norms) and norms.max() > 0 else 1.
+    scaled = vectors / max_norm
+    extra = np.sqrt(np.maximum(1 - (norms / max_norm) ** 2, 0))
+    return np.hstack((scaled, extra[:, np.newaxis]))
+
+
+def _assign(extended, centroids, chunk_size):
+    assignments = np.empty(len(extended), dtype=np.int64)
+    for start in range(0, len(extended), chunk_size):
+        assignments[start:start + chunk_size] = extended[start:start + chunk_size].dot(centroids.T).argmax(axis=1)
+    return assignments
@@ -1,84 +1,186 @@
+import os
+
 import numpy as np
 import pandas as pd
 
 from extras import clamp
+from persistence import read_manifest, save_arrays
+from profiling import profiled
+from rating_statistics import ITEM_BIAS_REG, USER_BIAS_REG, get_biases
+from ratings import RatingsMatrix, as_ratings_matrix
+from recommender import Recommender
 
-class BaselinePredictor(object):
-
-    def __init__(self, ratings):
-        """
-        :param ratings: The ratings DataFrame
-        :type ratings: DataFrame
-        """
-        self.ratings = ratings
-
-    @staticmethod
-    def calculate_user_means(ratings):
-        """
-        Calculate the user means of the ratings matrix
-        :param ratings: The ratings DataFrame
-        :type ratings: DataFrame
-        :return: A DataFrame indexed on user_id with one column mean with the user means
-        """
-        ratings = ratings.replace(0, np.nan)
-        means = pd.DataFrame(ratings.mean(axis=1), index=ratings.index, columns=['mean']).fillna(value=0)
-        return means
+class BaselinePredictor(Recommender):
 
-    @staticmethod
-    def calculate_user_std_devs(ratings):
+    def __init__(self, ratings, dtype=np.float64, reg_users=USER_BIAS_REG, reg_items=ITEM_BIAS_REG):
         """
-        Calculate the user standard deviations in the user x item DataFrame
-        :param ratings: the ratings DataFrame
-        :type ratings: DataFrame
-        :return: A DataFrame indexed on user_id with one column std with the user standard deviations
+        :param ratings: The user x item ratings. Ratings on 1 to 5 scale. 0 represents unknown in a DataFrame.
+        :type ratings: RatingsMatrix or DataFrame
+        :param dtype: The float type of the predictions
+        :param reg_users: The regularisation of the user biases of the bias baseline
+        :param reg_items: The regularisation of the item biases of the bias baseline
         """
-        ratings = ratings.replace(0, np.nan)
-        std_devs = pd.DataFrame(ratings.std(axis=1, ddof=0), index=ratings.index, columns=['std']).fillna(value=0)
-        return std_devs
+        self.ratings = as_ratings_matrix(ratings)
+        self.dtype = np.dtype(dtype)
+        self.reg_users = reg_users
+        self.reg_items = reg_items
 
-    @staticmethod
-    def calculate_item_means(ratings):
+    @property
+    def biases(self):
         """
-        Calculate the item means
-        :param ratings: ratings DataFrame
-        :type ratings: DataFrame
-        :return: The item means
+        The global mean, user biases and item biases of the bias baseline, fit by regularised least squares
         """
-        ratings = ratings.replace(0, np.nan)
-        means = pd.DataFrame(ratings.mean(axis=0), index=ratings.columns, columns=['mean']).fillna(value=0)
-        return means
+        return get_biases(self.ratings, reg_users=self.reg_users, reg_items=self.reg_items)
 
+    @profiled('BaselinePredictor.predict_user_based')
     def predict_user_based(self):
         """
         Calculate a baseline prediction based on user means
         :return: A prediction DataFrame same shape as ratings
         """
-        user_means = self.calculate_user_means(self.ratings)
-        predicted = pd.DataFrame(np.ones(self.ratings.shape) * user_means.values,
-                                 index=self.ratings.index, columns=self.ratings.columns)
-        predicted = predicted.applymap(clamp)
+        user_means = self.calculate_user_means(self.ratings).astype(self.dtype)
+        predicted = pd.DataFrame(np.ones(self.ratings.shape, dtype=self.dtype) * user_means.values,
+                                 index=self.ratings.user_ids, columns=self.ratings.item_ids)
+        predicted = clamp(predicted, *self.rating_scale)
         return predicted
 
+    @profiled('BaselinePredictor.predict_item_based')
     def predict_item_based(self):
         """
         Calculate a baseline prediction based on item means
         :return: A DataFrame in the same shape as ratings with predictions as values
         """
-        movie_means = self.calculate_item_means(self.ratings)
-        predicted = pd.DataFrame((np.ones(self.ratings.shape).transpose() * movie_means.values).transpose(),
-                                 index=self.ratings.index, columns=self.ratings.columns)
-        predicted = predicted.applymap(clamp)
+        movie_means = self.calculate_item_means(self.ratings).astype(self.dtype)
+        predicted = pd.DataFrame((np.ones(self.ratings.shape, dtype=self.dtype).transpose() *
+                                  movie_means.values).transpose(),
+                                 index=self.ratings.user_ids, columns=self.ratings.item_ids)
+        predicted = clamp(predicted, *self.rating_scale)
         return predicted
 
+    @profiled('BaselinePredictor.predict_item_user_based')
     def predict_item_user_based(self):
         """
         Calculate a baseline prediction based on item means and user average offsets
         :return: The prediction DataFrame
         """
-        movie_means = self.calculate_item_means(self.ratings)
-        user_std_devs = self.calculate_user_std_devs(self.ratings)
-        predicted_values = (np.ones(self.ratings.shape).transpose() * movie_means.values).transpose()
+        movie_means = self.calculate_item_means(self.ratings).astype(self.dtype)
+        user_std_devs = self.calculate_user_std_devs(self.ratings).astype(self.dtype)
+        predicted_values = (np.ones(self.ratings.shape, dtype=self.dtype).transpose() * movie_means.values).transpose()
         predicted_values = predicted_values + user_std_devs.values
-        predicted = pd.DataFrame(predicted_values, index=self.ratings.index, columns=self.ratings.columns)
-        predicted = predicted.applymap(clamp)
+        predicted = pd.DataFrame(predicted_values, index=self.ratings.user_ids, columns=self.ratings.item_ids)
+        predicted = clamp(predicted, *self.rating_scale)
         return predicted
+
+    @profiled('BaselinePredictor.predict_bias_based')
+    def predict_bias_based(self):
+        """
+        Calculate the bias baseline prediction, global mean + user bias + item bias
+        :return: The prediction DataFrame
+        """
+        global_mean, user_biases, item_biases = self.biases
+        predicted_values = ((global_mean + user_biases[:, np.newaxis]).astype(self.dtype) +
+                            item_biases.astype(self.dtype))
+        return pd.DataFrame(clamp(predicted_values, *self.rating_scale, copy=False),
+                            index=self.ratings.user_ids, columns=self.ratings.item_ids)
+
+    def score_pairs(self, users, items):
+        """
+        Calculate the bias baseline prediction of (user, item) pairs, without scoring any other item
+        :param users: The row position of the user of each pair
+        :param items: The column position of the item of each pair
+        :return: An array of predicted ratings, one per pair
+        """
+        global_mean, user_biases, item_biases = self.biases
+        predicted_values = (global_mean + user_biases[users] + item_biases[items]).astype(self.dtype)
+        return clamp(predicted_values, *self.rating_scale, copy=False)
+
+    def score(self, user_id, item_ids, based='item_user'):
+        """
+        Predict the ratings of one user for some items. The bias baseline only looks up the items asked for.
+        :param user_id: The user id
+        :param item_ids: The item ids to score
+        :param based: <'user', 'item', 'item_user', 'bias'> The baseline, as for score_user
+        :return: A Series of predicted ratings indexed on item_id
+        """
+        if based != 'bias':
+            return super(BaselinePredictor, self).score(user_id, item_ids, based=based)
+        items = self.ratings.item_index(item_ids)
+        scores = self.score_pairs(np.full(len(items), self.ratings.user_index(user_id)), items)
+        return pd.Series(scores, index=self.ratings.item_ids[items], name='score')
+
+    @profiled('BaselinePredictor.score_user')
+    def score_user(self, user, based='item_user'):
+        """
+        Calculate the baseline prediction of one user for every item
+        :param user: The row position of the user
+        :param based: <'user', 'item', 'item_user', 'bias'> The baseline, as for predict_user_based,
+            predict_item_based, predict_item_user_based and predict_bias_based
+        :return: An array of predicted ratings, one per item
+        """
+        if based == 'bias':
+            return self.score_pairs(user, slice(None))
+        statistics = self.statistics
+        if based == 'user':
+            predicted_values = np.full(self.ratings.shape[1], statistics.user_means[user], dtype=self.dtype)
+        elif based in ('item', 'item_user'):
+            predicted_values = statistics.item_means.astype(self.dtype)
+            if based == 'item_user':
+                predicted_values = predicted_values + self.dtype.type(statistics.user_std_devs[user])
+        else:
+            raise KeyError(based+' is not an implemented baseline.')
+        return clamp(predicted_values, *self.rating_scale, copy=False)
+
+    @profiled('BaselinePredictor.score_users')
+    def score_users(self, users, based='item_user'):
+        """
+        Calculate the baseline prediction of a chunk of users for every item
+        :param users: The row positions of the users
+        :param based: <'user', 'item', 'item_user', 'bias'> The baseline, as for score_user
+        :return: A len(users) x n_items array of predicted ratings
+        """
+        users = np.asarray(users)
+        if based == 'bias':
+            return self.score_pairs(users[:, np.newaxis], np.arange(self.ratings.shape[1]))
+        statistics = self.statistics
+        if based == 'user':
+            predicted_values = np.repeat(statistics.user_means[users, np.newaxis].astype(self.dtype),
+                                         self.ratings.shape[1], axis=1)
+        elif based in ('item', 'item_user'):
+            predicted_values = np.tile(statistics.item_means.astype(self.dtype), (len(users), 1))
+            if based == 'item_user':
+                predicted_values += statistics.user_std_devs[users, np.newaxis].astype(self.dtype)
+        else:
+            raise KeyError(based+' is not an implemented baseline.')
+        return clamp(predicted_values, *self.rating_scale, copy=False)
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None):
+        """
+        Add a batch of new or changed ratings. The mean baselines only depend on the shared statistics,
+        which are updated from the batch. The bias baseline is refit on its next use.
+        :param user_ids: The user id of each rating, new users are added
+        :param item_ids: The item id of each rating, new items are added
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        """
+        self.ratings.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+
+    def save(self, path):
+        """
+        Save the model as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        self.ratings.save(os.path.join(path, 'ratings'))
+        save_arrays(path, {}, {'model': type(self).__name__, 'dtype': self.dtype.name, 'reg_users': self.reg_users,
+                               'reg_items': self.reg_items})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a model saved with save, memory-mapping the ratings by default
+        :param path: The directory the model was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The BaselinePredictor
+        """
+        manifest = read_manifest(path)
+        return cls(RatingsMatrix.load(os.path.join(path, 'ratings'), mmap_mode=mmap_mode), dtype=manifest['dtype'],
+                   reg_users=manifest['reg_users'], reg_items=manifest['reg_items'])
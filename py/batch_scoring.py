@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from parallel import WorkerPool
+from persistence import load_arrays, save_array, write_manifest
+
+DEFAULT_CHUNK_SIZE = 1024
+
+
+def top_n_rows(scores, n, exclude=None):
+    """
+    Find the n highest scores of every row with a partial sort
+    :param scores: A rows x items array of scores
+    :param n: The number of positions to return per row
+    :param exclude: Optional rows x items sparse matrix, the stored positions of each row may not be returned
+    :return: (positions, scores) both rows x min(n, items), highest first.
+        Rows with fewer than n candidates are padded with position -1 and score NaN
+    """
+    scores = np.array(scores, dtype=np.result_type(scores, np.float32))
+    if exclude is not None:
+        exclude = exclude.tocsr()
+        scores[np.repeat(np.arange(exclude.shape[0]), np.diff(exclude.indptr)), exclude.indices] = -np.inf
+    n_rows, n_items = scores.shape
+    n = min(n, n_items)
+    if n <= 0:
+        return np.zeros((n_rows, 0), dtype=np.int32), np.zeros((n_rows, 0), dtype=scores.dtype)
+    if n < n_items:
+        positions = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    else:
+        positions = np.tile(np.arange(n_items), (n_rows, 1))
+    top_scores = np.take_along_axis(scores, positions, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    positions = np.take_along_axis(positions, order, axis=1).astype(np.int32)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    missing = ~np.isfinite(top_scores)
+    positions[missing] = -1
+    top_scores[missing] = np.nan
+    return positions, top_scores
+
+
+def recommend_batches(model, n=10, users=None, chunk_size=DEFAULT_CHUNK_SIZE, exclude_rated=True, n_jobs=1,
+                      **options):
+    """
+    Recommend the top n items for many users, a chunk of users at a time.
+    Only one chunk of scores is held at once, so the peak memory is proportional to chunk_size x n_items
+    rather than to a full users x items prediction matrix.
+    With n_jobs other than 1 the model is shared with a WorkerPool and the chunks are scored in parallel.
+    Chunks are still yielded in order, with at most two per worker in flight.
+    Build the user neighbours or item index before scoring in parallel, otherwise every worker builds its own.
+    :param model: The fitted Recommender
+    :param n: The number of items to recommend per user
+    :param users: The row positions of the users to score, defaults to every user
+    :param chunk_size: The number of users scored together
+    :param exclude_rated: Whether to leave out the items each user has already rated
+    :param n_jobs: The number of worker processes, None for one per CPU and 1 to score in this process
+    :param options: Model specific prediction options, as for score_user
+    :return: A generator of (user_ids, items, scores) per chunk. items are len(chunk) x n item positions,
+        model.ratings.item_ids[items] gives the ids, padded with -1 where a user has fewer than n unrated items
+    """
+    if users is None:
+        users = np.arange(model.ratings.shape[0])
+    users = np.asarray(users)
+    chunks = [users[start:start + chunk_size] for start in range(0, len(users), chunk_size)]
+
+    with WorkerPool(n_jobs, {'model': model}) as pool:
+        results = pool.map(_recommend_chunk, ((chunk, n, exclude_rated, options) for chunk in chunks))
+        for chunk, (items, scores) in zip(chunks, results):
+            yield model.ratings.user_ids[chunk], items, scores
+
+
+def write_recommendations(path, model, n=10, users=None, chunk_size=DEFAULT_CHUNK_SIZE, exclude_rated=True,
+                          n_jobs=1, **options):
+    """
+    Stream the recommendations of recommend_batches into a directory of raw NumPy arrays and a manifest:
+    user_ids, item_ids, items (users x n int32 positions into item_ids, -1 for none) and scores (users x n float32).
+    The items and scores files are written a chunk at a time through memory maps,
+    and can be read back memory-mapped with load_arrays or as a table with read_recommendations.
+    :param path: The directory to write to, created if missing
+    :param model: The fitted Recommender
+    :param n: The number of items to recommend per user
+    :param users: The row positions of the users to score, defaults to every user
+    :param chunk_size: The number of users scored together
+    :param exclude_rated: Whether to leave out the items each user has already rated
+    :param n_jobs: The number of worker processes, as for recommend_batches
+    :param options: Model specific prediction options, as for score_user
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    if users is None:
+        users = np.arange(model.ratings.shape[0])
+    users = np.asarray(users)
+    shape = (len(users), min(n, model.ratings.shape[1]))
+    user_ids = model.ratings.user_ids[users]
+    item_ids = np.asarray(model.ratings.item_ids)
+    object_arrays = [name for name, ids in (('user_ids', user_ids), ('item_ids', item_ids))
+                     if save_array(path, name, ids)]
+    items_file = np.lib.format.open_memmap(os.path.join(path, 'items.npy'), mode='w+', dtype=np.int32, shape=shape)
+    scores_file = np.lib.format.open_memmap(os.path.join(path, 'scores.npy'), mode='w+', dtype=np.float32,
+                                            shape=shape)
+    start = 0
+    for chunk_user_ids, items, scores in recommend_batches(model, n=n, users=users, chunk_size=chunk_size,
+                                                           exclude_rated=exclude_rated, n_jobs=n_jobs, **options):
+        end = start + len(chunk_user_ids)
+        items_file[start:end] = items
+        scores_file[start:end] = scores
+        start = end
+    items_file.flush()
+    scores_file.flush()
+    del items_file, scores_file
+    write_manifest(path, ['user_ids', 'item_ids', 'items', 'scores'],
+                   {'scored_by': type(model).__name__, 'n': shape[1], 'exclude_rated': exclude_rated,
+                    'options': options, 'object_arrays': object_arrays})
+
+
+def read_recommendations(path, mmap_mode='r'):
+    """
+    Read recommendations written with write_recommendations as a table
+    :param path: The directory the recommendations were written to
+    :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+    :return: A DataFrame with columns user_id, rank, item_id and score, one row per recommendation
+    """
+    arrays, _ = load_arrays(path, mmap_mode=mmap_mode)
+    items = np.asarray(arrays['items'])
+    rows, ranks = np.nonzero(items >= 0)
+    return pd.DataFrame({'user_id': arrays['user_ids'][rows], 'rank': ranks,
+                         'item_id': arrays['item_ids'][items[rows, ranks]],
+                         'score': np.asarray(arrays['scores'])[rows, ranks]})
+
+
+def _recommend_chunk(shared, users, n, exclude_rated, options):
+    model = shared['model']
+    scores = model.score_users(users, **options)
+    exclude = model.ratings.csr[users] if exclude_rated else None
+    return top_n_rows(scores, n, exclude=exclude)
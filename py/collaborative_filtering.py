@@ -1,145 +1,525 @@
+import os
+
 import numpy as np
 import pandas as pd
 
 from extras import clamp
+from item_index import ItemNeighbourIndex
+from neighbours import NeighbourGraph, select_top_k, top_k_neighbours
+from persistence import read_manifest, save_arrays
+from parallel import n_workers
+from profiling import profiled, stage
+from rating_statistics import get_biases
+from recommender import Recommender
+from similarity import DEFAULT_MEMORY_BUDGET, SimilarityEngine, top_k_similarity, update_top_k
+from ratings import RatingsMatrix, as_ratings_matrix
+
+ADJUSTMENTS = ('mean', 'full', 'baseline')
+# The memory budget and number of workers of kept neighbours saved without them
+DEFAULT_RESOURCES = {'memory_budget': DEFAULT_MEMORY_BUDGET, 'n_jobs': 1}
+
 
-class CollaborativeFiltering(object):
+class CollaborativeFiltering(Recommender):
 
-    def __init__(self, ratings):
+    def __init__(self, ratings, dtype=np.float64, weight_dtype=None, n_jobs=1, shrinkage=None):
         """
-        :param ratings:  The user x item ratings DataFrame. Ratings on 1 to 5 scale. 0 represents unknown.
-        :type ratings: DataFrame
+        :param ratings:  The user x item ratings. Ratings on 1 to 5 scale. 0 represents unknown in a DataFrame.
+        :type ratings: RatingsMatrix or DataFrame
+        :param dtype: The float type of the adjusted ratings, similarities and predictions
+        :param weight_dtype: The float type of the kept neighbour weights, defaults to dtype. float16 quarters
+            the memory of the neighbour lists
+        :param n_jobs: The number of worker processes that select neighbours, None for one per CPU
+        :param shrinkage: The number of co-rated users or items at which a similarity is halved, 0 for none.
+            Similarities over few co-rated ratings are shrunk towards 0 by n / (n + shrinkage). None shrinks
+            the pearson and adjusted cosine similarities by CO_RATED_SHRINKAGE and leaves cosine unshrunk
         """
-        self.ratings = ratings
-        self.user_means = self.calculate_user_means(self.ratings)
-        self.user_std_devs = self.calculate_user_std_devs(self.ratings)
+        self.ratings = as_ratings_matrix(ratings)
+        self.dtype = np.dtype(dtype)
+        self.weight_dtype = self.dtype if weight_dtype is None else np.dtype(weight_dtype)
+        self.n_jobs = n_jobs
+        self.shrinkage = shrinkage
+        self.user_means = self.calculate_user_means(self.ratings).astype(self.dtype)
+        self.user_std_devs = self.calculate_user_std_devs(self.ratings).astype(self.dtype)
+        self.item_index = None
+        self.user_neighbours = None
+        self.user_neighbours_options = None
+        self.user_neighbours_resources = None
+        self.item_index_resources = None
+        self._adjusted_ratings = {}
+        self._similarity_engines = {}
 
-    @staticmethod
-    def calculate_user_means(ratings):
+    @property
+    def biases(self):
         """
-        Calculate the user means of the ratings matrix
-        :param ratings: The ratings DataFrame
-        :type ratings: DataFrame
-        :return: A DataFrame indexed on user_id with one column mean with the user means
+        The global mean, user biases and item biases of the regularised bias baseline used by adjust='baseline'
         """
-        ratings = ratings.replace(0, np.nan)
-        means = pd.DataFrame(ratings.mean(axis=1), index=ratings.index, columns=['mean']).fillna(value=0)
-        return means
+        global_mean, user_biases, item_biases = get_biases(self.ratings)
+        return global_mean, user_biases.astype(self.dtype), item_biases.astype(self.dtype)
 
     @staticmethod
-    def calculate_user_std_devs(ratings):
+    @profiled('CollaborativeFiltering.similarity')
+    def get_user_similarity(ratings, method='cosine', dtype=np.float64, shrinkage=None):
         """
-        Calculate the user standard deviations in the user x item DataFrame
-        :param ratings: the ratings DataFrame
-        :type ratings: DataFrame
-        :return: A DataFrame indexed on user_id with one column std with the user standard deviations
+        Calculate the user similarity matrix.
+        The products are taken over the sparse ratings, only the U x U result is dense.
+        :param ratings: The ratings
+        :type ratings: RatingsMatrix or DataFrame
+        :param method: <'cosine', 'pearson', 'adjusted'> the similarity measure to be used.
+            pearson is the correlation over the co-rated items
+        :param dtype: The float type of the similarity
+        :param shrinkage: The number of co-rated items at which a similarity is halved, 0 for no shrinkage.
+            None for CO_RATED_SHRINKAGE with the co-rated methods and no shrinkage with cosine
+        :return: The user x user similarity DataFrame
         """
-        ratings = ratings.replace(0, np.nan)
-        std_devs = pd.DataFrame(ratings.std(axis=1, ddof=0), index=ratings.index, columns=['std']).fillna(value=0)
-        return std_devs
+        ratings = as_ratings_matrix(ratings)
+        user_similarity = SimilarityEngine(ratings.csr, method=method, dtype=dtype, shrinkage=shrinkage).full()
+        return pd.DataFrame(user_similarity, index=ratings.user_ids, columns=ratings.user_ids)
 
     @staticmethod
-    def get_user_similarity(ratings, method='cosine'):
-        """
-        Calculate the user similarity matrix
-        :param ratings: The ratings DataFrame
-        :type ratings: DataFrame
-        :param method: <'cosine', 'pearson'> the similarity measure to be used
-        :return:
-        """
-        if method == 'cosine':
-            user_similarity = ratings.dot(ratings.transpose())
-            normalisation_terms = pd.DataFrame(np.diagonal(user_similarity.values), index=ratings.index).apply(np.sqrt)
-            normalisation_terms = normalisation_terms.dot(normalisation_terms.transpose())
-            user_similarity = user_similarity.div(normalisation_terms)
-            return user_similarity
-        elif method == 'pearson':
-            return ratings.transpose().corr(method='pearson')
-        else:
-            raise KeyError(method+' is not an implemented method.')
+    @profiled('CollaborativeFiltering.knn')
+    def get_user_neighbours(ratings, k, method='cosine', memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.float64,
+                            weight_dtype=None, n_jobs=1, shrinkage=None):
+        """
+        Calculate the k nearest neighbours of every user without building the U x U similarity matrix.
+        Users are compared in blocks sized to fit the memory budget and only the top k of each block are kept.
+        :param ratings: The ratings
+        :type ratings: RatingsMatrix or DataFrame
+        :param k: the number of neighbours for k-nearest neighbour
+        :param method: <'cosine', 'pearson', 'adjusted'> the similarity measure to be used
+        :param memory_budget: The number of bytes the dense similarity blocks may use
+        :param dtype: The float type the similarity blocks are computed in
+        :param weight_dtype: The float type of the neighbour weights, defaults to dtype
+        :param n_jobs: The number of worker processes the blocks are spread over, None for one per CPU
+        :param shrinkage: The number of co-rated items at which a similarity is halved, 0 for no shrinkage.
+            None for CO_RATED_SHRINKAGE with the co-rated methods and no shrinkage with cosine
+        :return: The user NeighbourGraph
+        """
+        ratings = as_ratings_matrix(ratings)
+        return top_k_similarity(ratings.csr, k, method=method, memory_budget=memory_budget, dtype=dtype,
+                                weight_dtype=weight_dtype, n_jobs=n_jobs, shrinkage=shrinkage)
 
     @staticmethod
     def adjust_user_similarity_knn(user_similarity, k):
         """
         Adjust the user similarity matrix for use with k-nearest neighbours.
-        For each user the top k neighbours are kept and for the rest the similarity is set to 0.
-        Thus in the prediction their ratings will be ignored in the calculation.
+        For each user the top k other users are kept as neighbours, the user themselves is never a neighbour.
+        Thus in the prediction the ratings of all other users will be ignored in the calculation.
         :param user_similarity: The user similarity DataFrame
         :param k: the number of neighbours for k-nearest neighbour
-        :return: The adjusted similarity DataFrame
+        :return: The user NeighbourGraph
         """
-        adjusted_similarity = pd.DataFrame(np.zeros(user_similarity.shape),
-                                           index=user_similarity.index, columns=user_similarity.columns)
-
-        for user in user_similarity.iterrows():
-            top_k_indexes = user[1].sort_values(ascending=False).iloc[0:k+1].index.values
-            adjusted_similarity.loc[user[0], top_k_indexes] = user_similarity.loc[user[0], top_k_indexes]
-
-        return adjusted_similarity
+        return top_k_neighbours(user_similarity, k, exclude_self=True)
 
+    @profiled('CollaborativeFiltering.adjust_ratings')
     def adjust_ratings(self, ratings, type='mean'):
         """
-        Adjust the ratings matrix from a 1-5 ratings scale to a -1 to 1 scale indicating user preference
-        :param ratings: The ratings DataFrame
-        :param type: means or full
-        :return: The adjusted ratings DataFrame
+        Adjust the ratings matrix from a 1-5 ratings scale to a -1 to 1 scale indicating user preference.
+        Only the known ratings are adjusted, unknown ratings stay unknown.
+        :param ratings: The ratings
+        :type ratings: RatingsMatrix or DataFrame
+        :param type: means, full or baseline. baseline subtracts the global mean, user bias and item bias
+        :return: The adjusted ratings, in the same form as ratings
         """
-        user_means = self.user_means
-        adjusted_ratings = ratings.replace(0, np.nan)
-        adjusted_ratings_values = adjusted_ratings.values - user_means.values
+        adjusted_ratings = as_ratings_matrix(ratings)
+        rows = adjusted_ratings.user_rows()
+        if type == 'baseline':
+            global_mean, user_biases, item_biases = get_biases(self.ratings)
+            adjusted_values = (adjusted_ratings.csr.data - global_mean - user_biases[rows] -
+                               item_biases[adjusted_ratings.csr.indices])
+        else:
+            adjusted_values = adjusted_ratings.csr.data - self.user_means.values[rows, 0]
         if type == 'full':
-            adjusted_ratings_values = adjusted_ratings_values / self.user_std_devs.values
-        adjusted_ratings = pd.DataFrame(adjusted_ratings_values, index=ratings.index, columns=ratings.columns).fillna(value=0)
+            std_devs = self.user_std_devs.values[rows, 0]
+            adjusted_values = np.divide(adjusted_values, std_devs, out=np.zeros(len(adjusted_values)),
+                                        where=std_devs > 0)
+        adjusted_ratings = adjusted_ratings.with_data(adjusted_values.astype(self.dtype))
 
+        if not isinstance(ratings, RatingsMatrix):
+            adjusted_ratings = adjusted_ratings.to_dataframe()
         return adjusted_ratings
 
+    def get_adjusted_ratings(self, adjust):
+        """
+        The adjusted ratings are kept for reuse.
+        :param adjust: <'mean', 'full', 'baseline', None> The adjustment for the ratings
+        :return: The adjusted RatingsMatrix, or the ratings themselves when not adjusting
+        """
+        if adjust not in ADJUSTMENTS:
+            return self.ratings
+        if adjust not in self._adjusted_ratings:
+            self._adjusted_ratings[adjust] = self.adjust_ratings(self.ratings, type=adjust)
+        return self._adjusted_ratings[adjust]
+
+    @profiled('CollaborativeFiltering.adjust_predictions')
     def adjust_predictions(self, predicted,  type='mean'):
         """
         Adjust the predictions back to a 1-5 ratings scale
         :param predicted: The predicted DataFrame
-        :param user_means: The user means
-        :param user_std_devs: The user standard deviations. Optional
+        :param type: <'mean', 'full', 'baseline'> The adjustment that was applied to the ratings
         :return: The adjusted predictions
         """
-        if type == 'full':
-            adjusted_predictions_values = predicted.values * self.user_std_devs.values
+        if type == 'baseline':
+            global_mean, user_biases, item_biases = self.biases
+            adjusted_predicted_values = predicted.values + (global_mean + user_biases[:, np.newaxis]) + item_biases
+        elif type == 'full':
+            adjusted_predicted_values = predicted.values * self.user_std_devs.values + self.user_means.values
         else:
-            adjusted_predictions_values = predicted.values
-        adjusted_predicted_values = adjusted_predictions_values + self.user_means.values
+            adjusted_predicted_values = predicted.values + self.user_means.values
         adjusted_predictions = pd.DataFrame(adjusted_predicted_values,
                                             index=predicted.index, columns=predicted.columns)
-        adjusted_predictions = adjusted_predictions.fillna(value=0).applymap(clamp)
+        adjusted_predictions = clamp(adjusted_predictions.fillna(value=0), *self.rating_scale)
         return adjusted_predictions
 
-    def predict_user_user(self, adjust='full', similarity='cosine', k=-1):
+    @profiled('CollaborativeFiltering.predict_user_user')
+    def predict_user_user(self, adjust='full', similarity='cosine', k=-1, memory_budget=DEFAULT_MEMORY_BUDGET):
         """
         Do user user prediction.
         Options to use mean or mean and std-dev (full) adjusted ratings (default full),
-        Cosine or pearson correlation for user similarity (default cosine),
+        Cosine or pearson correlation over the co-rated items for user similarity (default cosine),
         and the number of neighbours to consider (default all).
         :param k: The number of neighbours for k-nearest neighbours
-        :param adjust: <'mean','full'> adjust the ratings for user means or means and standard deviations respectively
+        :param adjust: <'mean','full', 'baseline'> adjust the ratings for user means, means and standard deviations
+            or the regularised bias baseline
         :param similarity: <'cosine', 'pearson'> The similarity measure for the user similarity
+        :param memory_budget: The number of bytes the similarity blocks may use when k is set
         :return: The prediction DataFrame
         """
-        ratings = self.ratings
-        if adjust == 'mean':
-            ratings = self.adjust_ratings(ratings, self.user_means)
-        elif adjust == 'full':
-            ratings = self.adjust_ratings(ratings, self.user_means, self.user_std_devs)
+        ratings = self.get_adjusted_ratings(adjust)
 
-        user_similarity = self.get_user_similarity(ratings, method=similarity)
         if k != -1:
-            user_similarity = self.adjust_user_similarity_knn(user_similarity, k)
+            neighbours = self.get_user_neighbours(ratings, k, method=similarity, memory_budget=memory_budget,
+                                                  dtype=self.dtype, weight_dtype=self.weight_dtype, n_jobs=self.n_jobs,
+                                                  shrinkage=self.shrinkage)
+            with stage('CollaborativeFiltering.dot_product') as current:
+                predictions_values = neighbours.to_sparse().dot(ratings.csr.astype(self.dtype)).toarray()
+                current.record(predictions=predictions_values)
+            denom = np.abs(neighbours.weights).sum(axis=1, dtype=self.dtype)
+        else:
+            similarity_values = self.get_user_similarity(ratings, method=similarity, dtype=self.dtype,
+                                                         shrinkage=self.shrinkage).values
+            with stage('CollaborativeFiltering.dot_product') as current:
+                predictions_values = np.asarray(ratings.csr.T.dot(similarity_values.T)).T
+                current.record(predictions=predictions_values)
+            denom = np.abs(similarity_values).sum(axis=1)
+        with stage('CollaborativeFiltering.normalise'):
+            predictions_values = np.divide(predictions_values, denom[:, np.newaxis],
+                                           out=np.zeros_like(predictions_values), where=denom[:, np.newaxis] > 0)
+        predictions = pd.DataFrame(predictions_values, index=self.ratings.user_ids, columns=self.ratings.item_ids)
+
+        if adjust in ADJUSTMENTS:
+            predictions = self.adjust_predictions(predictions, type=adjust)
+
+        return predictions
+
+    @profiled('CollaborativeFiltering.build_user_neighbours')
+    def build_user_neighbours(self, adjust='full', similarity='cosine', k=50, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Build and keep the user neighbour graph, so that user user scoring with the same options
+        looks the neighbours up and add_ratings keeps them up to date.
+        :param adjust: <'mean','full', 'baseline', None> adjust the ratings for user means, means and standard
+            deviations or the regularised bias baseline
+        :param similarity: <'cosine', 'pearson'> The similarity measure for the user similarity
+        :param k: The number of neighbours to keep for each user
+        :param memory_budget: The number of bytes the similarity blocks may use
+        :return: The user NeighbourGraph, also kept as user_neighbours
+        """
+        self.user_neighbours = self._get_similarity_engine(adjust, similarity, memory_budget).top_k(k)
+        self.user_neighbours_options = {'adjust': adjust, 'similarity': similarity, 'k': k}
+        self.user_neighbours_resources = {'memory_budget': memory_budget, 'n_jobs': n_workers(self.n_jobs)}
+        return self.user_neighbours
+
+    def build_item_index(self, adjust='mean', similarity='cosine', k=-1, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Build and keep the item neighbour index, so that item item scoring with the same options
+        looks the neighbours up and add_ratings keeps them up to date.
+        The index only depends on the ratings so it can be built offline, saved and loaded memory-mapped.
+        :param adjust: <'mean','full', 'baseline', None> adjust the ratings for user means, means and standard
+            deviations or the regularised bias baseline
+        :param similarity: <'cosine', 'pearson', 'adjusted'> The item similarity measure.
+            'adjusted' is the adjusted cosine, the cosine over the co-rated users of the user mean centred ratings.
+        :param k: The number of neighbours to keep for each item, -1 for all
+        :param memory_budget: The number of bytes the similarity blocks may use
+        :return: The ItemNeighbourIndex, also kept as item_index
+        """
+        self.item_index = self._build_item_index(adjust, similarity, k, memory_budget)
+        self.item_index_resources = {'memory_budget': memory_budget, 'n_jobs': n_workers(self.n_jobs)}
+        return self.item_index
+
+    @profiled('CollaborativeFiltering.build_item_index')
+    def _build_item_index(self, adjust, similarity, k, memory_budget=DEFAULT_MEMORY_BUDGET):
+        similarity_ratings = self.ratings if similarity == 'adjusted' else self.get_adjusted_ratings(adjust)
+        neighbours = top_k_similarity(similarity_ratings.csc.T, k, method=similarity, memory_budget=memory_budget,
+                                      dtype=self.dtype, weight_dtype=self.weight_dtype, n_jobs=self.n_jobs,
+                                      shrinkage=self.shrinkage)
+        return ItemNeighbourIndex(neighbours, self.ratings.item_ids, adjust=adjust, similarity=similarity)
+
+    def _item_index_matches(self, adjust, similarity, k):
+        """
+        Whether the kept item index was built with these options
+        """
+        if self.item_index is None:
+            return False
+        n_items = self.ratings.shape[1]
+        n_neighbours = n_items - 1 if k < 0 else min(k, n_items - 1)
+        index = self.item_index
+        return (index.adjust, index.similarity, index.k) == (adjust, similarity, n_neighbours)
+
+    def _get_item_index(self, adjust, similarity, k):
+        """
+        The kept item index, rebuilt first when it was built with other options
+        """
+        if not self._item_index_matches(adjust, similarity, k):
+            self.build_item_index(adjust=adjust, similarity=similarity, k=k)
+        return self.item_index
+
+    @profiled('CollaborativeFiltering.predict_item_item')
+    def predict_item_item(self, adjust='mean', similarity='cosine', k=-1, memory_budget=DEFAULT_MEMORY_BUDGET,
+                          index=None):
+        """
+        Do item item prediction.
+        Each known rating of a user is passed on to the neighbours of the rated item, weighted by similarity,
+        and normalised by the total similarity of the rated neighbours.
+        :param adjust: <'mean','full', 'baseline', None> adjust the ratings for user means, means and standard
+            deviations or the regularised bias baseline
+        :param similarity: <'cosine', 'pearson', 'adjusted'> The similarity measure for the item similarity
+        :param k: The number of neighbours for k-nearest neighbours
+        :param memory_budget: The number of bytes the similarity blocks may use
+        :param index: A prebuilt ItemNeighbourIndex. When given adjust, similarity and k are taken from it.
+            Otherwise the kept item_index is used when it was built with the same options, or an index is built
+            for this prediction only
+        :return: The prediction DataFrame
+        """
+        if index is None and self._item_index_matches(adjust, similarity, k):
+            index = self.item_index
+        elif index is None:
+            index = self._build_item_index(adjust, similarity, k, memory_budget)
+        ratings = self.get_adjusted_ratings(index.adjust)
 
-        predictions = user_similarity.dot(ratings)
-        denom = user_similarity.abs().sum().transpose()
-        predictions = predictions.div(denom, axis='index')
+        item_similarity = index.neighbours.to_sparse()
+        rated = ratings.csr.astype(self.dtype)
+        with stage('CollaborativeFiltering.dot_product') as current:
+            predictions_values = rated.dot(item_similarity).toarray()
+            current.record(predictions=predictions_values)
+        with stage('CollaborativeFiltering.normalise'):
+            rated.data = np.ones(len(rated.data), dtype=self.dtype)
+            denom = rated.dot(abs(item_similarity)).toarray()
+            predictions_values = np.divide(predictions_values, denom, out=np.zeros_like(predictions_values),
+                                           where=denom > 0)
+        predictions = pd.DataFrame(predictions_values, index=self.ratings.user_ids, columns=self.ratings.item_ids)
 
-        if adjust == 'mean':
-            predictions = self.adjust_predictions(predictions, self.user_means)
-        elif adjust == 'full':
-            predictions = self.adjust_predictions(self.user_means, self.user_std_devs)
+        if index.adjust in ADJUSTMENTS:
+            predictions = self.adjust_predictions(predictions, type=index.adjust)
 
-        predictions = pd.DataFrame(predictions.values, index=self.ratings.index, columns=self.ratings.columns)
         return predictions
+
+    @profiled('CollaborativeFiltering.score_user')
+    def score_user(self, user, method='user_user', adjust='full', similarity='cosine', k=-1):
+        """
+        Predict the ratings of one user for every item.
+        For user user prediction only the similarity of this user to the others is calculated,
+        for item item prediction the item index is looked up for the items the user has rated.
+        The kept item index is rebuilt when it was built with other adjust, similarity or k options.
+        :param user: The row position of the user
+        :param method: <'user_user', 'item_item'> The collaborative filtering method
+        :param adjust: <'mean','full', 'baseline', None> adjust the ratings for user means, means and standard
+            deviations or the regularised bias baseline
+        :param similarity: The similarity measure, as for predict_user_user and predict_item_item
+        :param k: The number of neighbours for k-nearest neighbours
+        :return: An array of predicted ratings, one per item
+        """
+        if method == 'user_user':
+            ratings = self.get_adjusted_ratings(adjust)
+            if k != -1 and self.user_neighbours_options == {'adjust': adjust, 'similarity': similarity, 'k': k}:
+                indices, weights = self.user_neighbours.indices[user], self.user_neighbours.weights[user]
+                predicted_values = ratings.csr[indices].T.dot(weights)
+                denom = np.abs(weights).sum()
+            elif k != -1:
+                user_similarity = self._get_similarity_engine(adjust, similarity).block(user, user + 1)
+                indices, weights = select_top_k(user_similarity, min(k, self.ratings.shape[0] - 1), row_offset=user)
+                predicted_values = ratings.csr[indices[0]].T.dot(weights[0])
+                denom = np.abs(weights).sum()
+            else:
+                user_similarity = self._get_similarity_engine(adjust, similarity).block(user, user + 1)
+                predicted_values = ratings.csr.T.dot(user_similarity[0])
+                denom = np.abs(user_similarity).sum()
+        elif method == 'item_item':
+            index = self._get_item_index(adjust, similarity, k)
+            items, values = self.get_adjusted_ratings(adjust).user_ratings(user)
+            predicted_values, denom = index.score(items, values)
+        else:
+            raise KeyError(method+' is not an implemented method.')
+
+        predicted_values = np.divide(predicted_values, denom, out=np.zeros(self.ratings.shape[1]), where=denom > 0)
+        if adjust in ADJUSTMENTS:
+            predicted_values = self._restore_predictions(predicted_values, user, adjust)
+        return predicted_values
+
+    @profiled('CollaborativeFiltering.score_users')
+    def score_users(self, users, method='user_user', adjust='full', similarity='cosine', k=-1):
+        """
+        Predict the ratings of a chunk of users for every item, as score_user does for one user.
+        The neighbour weights of the chunk are gathered into one sparse matrix and multiplied with the ratings,
+        so the memory used is proportional to the chunk rather than to all users.
+        :param users: The row positions of the users
+        :param method: <'user_user', 'item_item'> The collaborative filtering method
+        :param adjust: <'mean','full', 'baseline', None> adjust the ratings for user means, means and standard
+            deviations or the regularised bias baseline
+        :param similarity: The similarity measure, as for predict_user_user and predict_item_item
+        :param k: The number of neighbours for k-nearest neighbours
+        :return: A len(users) x n_items array of predicted ratings
+        """
+        users = np.asarray(users)
+        n_users = self.ratings.shape[0]
+        if method == 'user_user':
+            ratings = self.get_adjusted_ratings(adjust)
+            if k == -1:
+                user_similarity = self._get_similarity_engine(adjust, similarity).rows_block(users)
+                predicted_values = ratings.csr.T.dot(user_similarity.T).T
+                denom = np.abs(user_similarity).sum(axis=1)[:, np.newaxis]
+            else:
+                if self.user_neighbours_options == {'adjust': adjust, 'similarity': similarity, 'k': k}:
+                    neighbours = NeighbourGraph(self.user_neighbours.indices[users],
+                                                self.user_neighbours.weights[users], n_columns=n_users)
+                else:
+                    user_similarity = self._get_similarity_engine(adjust, similarity).rows_block(users)
+                    user_similarity[np.arange(len(users)), users] = -np.inf
+                    neighbours = NeighbourGraph(*select_top_k(user_similarity, min(k, n_users - 1),
+                                                              exclude_self=False), n_columns=n_users)
+                user_similarity = neighbours.to_sparse()
+                predicted_values = user_similarity.dot(ratings.csr).toarray()
+                denom = np.asarray(abs(user_similarity).sum(axis=1))
+        elif method == 'item_item':
+            item_similarity = self._get_item_index(adjust, similarity, k).neighbours.to_sparse()
+            rated = self.get_adjusted_ratings(adjust).csr[users].astype(self.dtype)
+            predicted_values = rated.dot(item_similarity).toarray()
+            rated.data = np.ones(len(rated.data), dtype=self.dtype)
+            denom = rated.dot(abs(item_similarity)).toarray()
+        else:
+            raise KeyError(method+' is not an implemented method.')
+
+        predicted_values = np.divide(predicted_values, denom, out=np.zeros(predicted_values.shape, dtype=self.dtype),
+                                     where=denom > 0)
+        if adjust in ADJUSTMENTS:
+            predicted_values = self._restore_predictions(predicted_values, users, adjust)
+        return predicted_values
+
+    @profiled('CollaborativeFiltering.restore_predictions')
+    def _restore_predictions(self, predicted_values, users, adjust):
+        """
+        Move adjusted predictions of one user, or a chunk of users, back to the ratings scale
+        """
+        if adjust == 'baseline':
+            global_mean, user_biases, item_biases = self.biases
+            predicted_values = predicted_values + (global_mean + user_biases[users])[..., np.newaxis] + item_biases
+        else:
+            if adjust == 'full':
+                predicted_values = predicted_values * self.user_std_devs.values[users]
+            predicted_values = predicted_values + self.user_means.values[users]
+        return clamp(predicted_values, *self.rating_scale)
+
+    def _get_similarity_engine(self, adjust, similarity, memory_budget=DEFAULT_MEMORY_BUDGET, n_jobs=None):
+        engine_key = (adjust, similarity)
+        if engine_key not in self._similarity_engines:
+            ratings = self.get_adjusted_ratings(adjust)
+            n_jobs = self.n_jobs if n_jobs is None else n_jobs
+            self._similarity_engines[engine_key] = SimilarityEngine(ratings.csr, method=similarity,
+                                                                    memory_budget=memory_budget, dtype=self.dtype,
+                                                                    weight_dtype=self.weight_dtype,
+                                                                    n_jobs=n_jobs, shrinkage=self.shrinkage)
+        return self._similarity_engines[engine_key]
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None):
+        """
+        Add a batch of new or changed ratings without rebuilding the model.
+        The statistics are updated from the batch, and in the user neighbours and item index only the rows
+        whose similarities can have changed are recomputed. The baseline adjustment depends on every rating,
+        so neighbours built on baseline adjusted ratings are recomputed in full. Pearson and adjusted cosine only
+        compare co-rated values, so new users and items leave the similarity of the others unchanged.
+        The recomputation uses the memory budget and number of workers the neighbours were built with.
+        :param user_ids: The user id of each rating, new users are added
+        :param item_ids: The item id of each rating, new items are added
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        """
+        n_users, n_items = self.ratings.shape
+        rows, cols = self.ratings.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+        rows, cols = np.unique(rows), np.unique(cols)
+        new_users = np.arange(n_users, self.ratings.shape[0])
+        new_items = np.arange(n_items, self.ratings.shape[1])
+
+        self.user_means = self.calculate_user_means(self.ratings).astype(self.dtype)
+        self.user_std_devs = self.calculate_user_std_devs(self.ratings).astype(self.dtype)
+        self._adjusted_ratings = {}
+        self._similarity_engines = {}
+
+        if self.user_neighbours is not None:
+            options, resources = self.user_neighbours_options, self.user_neighbours_resources
+            engine = self._get_similarity_engine(options['adjust'], options['similarity'], **resources)
+            changed_users = np.union1d(rows, new_users)
+            if options['similarity'] == 'adjusted':
+                # The changed ratings move the item means, which every user who rated those items is centred on
+                changed_items = cols
+                if options['adjust'] in ('mean', 'full'):
+                    changed_items = np.union1d(cols, self.ratings.csr[rows].indices)
+                changed_users = np.union1d(changed_users, self.ratings.csc[:, changed_items].indices)
+            if options['adjust'] == 'baseline':
+                changed_users = np.arange(self.ratings.shape[0])
+            self.user_neighbours = update_top_k(engine, self.user_neighbours, changed_users, options['k'])
+
+        if self.item_index is not None:
+            index = self.item_index
+            if index.similarity == 'adjusted':
+                similarity_ratings = self.ratings
+            else:
+                similarity_ratings = self.get_adjusted_ratings(index.adjust)
+            changed_items = np.union1d(cols, new_items)
+            if index.adjust in ('mean', 'full') or index.similarity == 'adjusted':
+                changed_items = np.union1d(changed_items, self.ratings.csr[rows].indices)
+            if index.adjust == 'baseline' and index.similarity != 'adjusted':
+                changed_items = np.arange(self.ratings.shape[1])
+            k = -1 if index.k >= n_items - 1 else index.k
+            engine = SimilarityEngine(similarity_ratings.csc.T, method=index.similarity, dtype=self.dtype,
+                                      weight_dtype=self.weight_dtype, shrinkage=self.shrinkage,
+                                      **self.item_index_resources)
+            self.item_index = ItemNeighbourIndex(update_top_k(engine, index.neighbours, changed_items, k),
+                                                 self.ratings.item_ids, adjust=index.adjust,
+                                                 similarity=index.similarity)
+
+    def save(self, path):
+        """
+        Save the model as raw NumPy arrays and a manifest in the directory path.
+        The ratings, the user neighbours and the item index are kept, the caches are rebuilt on demand.
+        :param path: The directory to save to, created if missing
+        """
+        self.ratings.save(os.path.join(path, 'ratings'))
+        if self.user_neighbours is not None:
+            self.user_neighbours.save(os.path.join(path, 'user_neighbours'))
+        if self.item_index is not None:
+            self.item_index.save(os.path.join(path, 'item_index'))
+        save_arrays(path, {}, {'model': type(self).__name__, 'dtype': self.dtype.name,
+                               'weight_dtype': self.weight_dtype.name, 'shrinkage': self.shrinkage,
+                               'user_neighbours_options': self.user_neighbours_options,
+                               'user_neighbours_resources': self.user_neighbours_resources,
+                               'item_index': self.item_index is not None,
+                               'item_index_resources': self.item_index_resources})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a model saved with save. The ratings and neighbour lists are memory-mapped by default,
+        so processes loading the same directory share one page cached copy.
+        :param path: The directory the model was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The CollaborativeFiltering model
+        """
+        manifest = read_manifest(path)
+        model = cls(RatingsMatrix.load(os.path.join(path, 'ratings'), mmap_mode=mmap_mode), dtype=manifest['dtype'],
+                    weight_dtype=manifest['weight_dtype'], shrinkage=manifest.get('shrinkage', 0.))
+        if manifest['user_neighbours_options'] is not None:
+            model.user_neighbours = NeighbourGraph.load(os.path.join(path, 'user_neighbours'), mmap_mode=mmap_mode)
+            model.user_neighbours_options = manifest['user_neighbours_options']
+            model.user_neighbours_resources = manifest.get('user_neighbours_resources', DEFAULT_RESOURCES)
+        if manifest['item_index']:
+            model.item_index = ItemNeighbourIndex.load(os.path.join(path, 'item_index'), mmap_mode=mmap_mode)
+            model.item_index_resources = manifest.get('item_index_resources', DEFAULT_RESOURCES)
+        return model
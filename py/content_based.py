@@ -0,0 +1,270 @@
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from extras import clamp
+from metadata import FeatureMatrix
+from persistence import load_model, read_manifest, save_arrays
+from profiling import profiled
+from rating_statistics import get_biases
+from ratings import RatingsMatrix, as_ratings_matrix
+from recommender import Recommender
+
+FEATURE_REG = 20.
+BLEND_SHRINKAGE = 20.
+
+
+def _normalise_rows(matrix):
+    """
+    Scale the rows of a sparse matrix to sum to 1, so a product with a row takes the mean over its features
+    """
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    return sp.diags(np.divide(1., sums, out=np.zeros(len(sums)), where=sums > 0)).dot(matrix).tocsr()
+
+
+class ContentBasedPredictor(Recommender):
+    """
+    Predicts ratings from user demographics and item features on top of the regularised bias baseline:
+    global mean + user bias + item bias + the user's affinity for the item's features.
+
+    A user's affinity for a feature is their mean residual on the items with it, shrunk towards the affinity
+    of users with the same demographics. Users without ratings are scored from their demographics alone,
+    and items with few ratings from the biases and affinities of their features, so a cold-start user is
+    scored in O(features) per item from precomputed profile vectors.
+    """
+
+    def __init__(self, ratings, user_features=None, item_features=None, reg=FEATURE_REG, dtype=np.float64):
+        """
+        :param ratings: The user x item ratings
+        :type ratings: RatingsMatrix or DataFrame
+        :param user_features: The user FeatureMatrix, as from read_users. Users without features get none
+        :param item_features: The item FeatureMatrix, as from read_movies. Items without features get none
+        :param reg: The number of pseudo ratings shrinking each affinity and feature bias towards its prior
+        :param dtype: The float type of the predictions
+        """
+        self.ratings = as_ratings_matrix(ratings)
+        self.user_features = user_features if user_features is not None else FeatureMatrix([], (0, 0), [])
+        self.item_features = item_features if item_features is not None else FeatureMatrix([], (0, 0), [])
+        self.reg = reg
+        self.dtype = np.dtype(dtype)
+        self.fit()
+
+    @profiled('ContentBasedPredictor.fit')
+    def fit(self):
+        """
+        Precompute the feature biases and affinity profiles from the ratings
+        :return: self
+        """
+        ratings = self.ratings
+        global_mean, user_biases, item_biases = get_biases(ratings)
+        user_features = self.user_features.align(ratings.user_ids)
+        item_features = self.item_features.align(ratings.item_ids)
+        self.item_profiles = _normalise_rows(item_features)
+
+        csr = ratings.csr
+        residuals = csr.data - global_mean - user_biases[ratings.user_rows()] - item_biases[csr.indices]
+        sums = np.asarray(ratings.with_data(residuals).csr.dot(item_features).todense())
+        counts = np.asarray(ratings.with_data(np.ones(len(residuals))).csr.dot(item_features).todense())
+
+        self.global_mean = global_mean
+        self.user_biases = user_biases
+        self.feature_affinity = (np.asarray(user_features.T.dot(sums)) /
+                                 (np.asarray(user_features.T.dot(counts)) + self.reg))
+        prior_affinity = _normalise_rows(user_features).dot(self.feature_affinity)
+        self.user_affinity = (sums + self.reg * prior_affinity) / (counts + self.reg)
+        self.user_feature_biases = (user_features.T.dot(user_biases) /
+                                    (np.asarray(user_features.sum(axis=0)).ravel() + self.reg))
+        self.item_feature_biases = (item_features.T.dot(item_biases) /
+                                    (np.asarray(item_features.sum(axis=0)).ravel() + self.reg))
+
+        # An item's bias is shrunk towards the mean bias of its features, which matters for items with few ratings
+        item_counts = self.statistics.item_counts
+        feature_biases = self.item_profiles.dot(self.item_feature_biases)
+        self.item_biases = (item_counts * item_biases + self.reg * feature_biases) / (item_counts + self.reg)
+        return self
+
+    def _score_profiles(self, user_biases, affinities):
+        predicted_values = self.item_profiles.dot(np.atleast_2d(affinities).T).T
+        predicted_values += (self.global_mean + np.atleast_1d(user_biases))[:, np.newaxis] + self.item_biases
+        predicted_values = clamp(predicted_values.astype(self.dtype), *self.rating_scale, copy=False)
+        return predicted_values if np.ndim(affinities) == 2 else predicted_values[0]
+
+    def score_user(self, user):
+        """
+        Predict the ratings of one user for every item from their profile
+        :param user: The row position of the user
+        :return: An array of predicted ratings, one per item
+        """
+        return self._score_profiles(self.user_biases[user], self.user_affinity[user])
+
+    def score_users(self, users):
+        """
+        Predict the ratings of a chunk of users for every item from their profiles
+        :param users: The row positions of the users
+        :return: A len(users) x n_items array of predicted ratings
+        """
+        users = np.asarray(users)
+        return self._score_profiles(self.user_biases[users], self.user_affinity[users])
+
+    def score_new_user(self, user_id):
+        """
+        Predict the ratings of a user without ratings for every item from their demographics alone
+        :param user_id: The user id, looked up in user_features. Users without features get the item baseline
+        :return: An array of predicted ratings, one per item
+        """
+        profile = _normalise_rows(self.user_features.align([user_id]))
+        return self._score_profiles(profile.dot(self.user_feature_biases), profile.dot(self.feature_affinity)[0])
+
+    def score_user_id(self, user_id):
+        """
+        Predict the ratings of a user by id, known users from their profile and new users from their demographics
+        :param user_id: The user id
+        :return: An array of predicted ratings, one per item
+        """
+        try:
+            user = self.ratings.user_index(user_id)
+        except KeyError:
+            return self.score_new_user(user_id)
+        return self.score_user(user)
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None):
+        """
+        Add a batch of new or changed ratings and refit the profiles, which takes one pass over the ratings
+        :param user_ids: The user id of each rating, new users are added
+        :param item_ids: The item id of each rating, new items are added
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        """
+        self.ratings.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+        self.fit()
+
+    def save(self, path):
+        """
+        Save the model as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        self.ratings.save(os.path.join(path, 'ratings'))
+        self.user_features.save(os.path.join(path, 'user_features'))
+        self.item_features.save(os.path.join(path, 'item_features'))
+        save_arrays(path, {}, {'model': type(self).__name__, 'reg': self.reg, 'dtype': self.dtype.name})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a model saved with save, refitting the profiles from the ratings
+        :param path: The directory the model was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The ContentBasedPredictor
+        """
+        manifest = read_manifest(path)
+        return cls(RatingsMatrix.load(os.path.join(path, 'ratings'), mmap_mode=mmap_mode),
+                   user_features=FeatureMatrix.load(os.path.join(path, 'user_features'), mmap_mode=mmap_mode),
+                   item_features=FeatureMatrix.load(os.path.join(path, 'item_features'), mmap_mode=mmap_mode),
+                   reg=manifest['reg'], dtype=manifest['dtype'])
+
+
+class HybridRecommender(Recommender):
+    """
+    Blends a collaborative model with a ContentBasedPredictor trained on the same ratings.
+    Each prediction weighs the collaborative score by n_u / (n_u + user_shrinkage) * n_i / (n_i + item_shrinkage),
+    with n_u and n_i the number of ratings of the user and the item, and gives the rest to the content score.
+    Users without any ratings are scored by the content model alone, without touching the collaborative model.
+    """
+
+    def __init__(self, model, content, user_shrinkage=BLEND_SHRINKAGE, item_shrinkage=BLEND_SHRINKAGE):
+        """
+        :param model: The fitted collaborative Recommender
+        :param content: The ContentBasedPredictor over the same ratings
+        :param user_shrinkage: The number of user ratings at which both models weigh the same
+        :param item_shrinkage: The number of item ratings at which both models weigh the same
+        """
+        if model.ratings.shape != content.ratings.shape:
+            raise ValueError('The models must be trained on the same ratings.')
+        self.model = model
+        self.content = content
+        self.user_shrinkage = user_shrinkage
+        self.item_shrinkage = item_shrinkage
+
+    @property
+    def ratings(self):
+        return self.content.ratings
+
+    def _weights(self, users):
+        statistics = self.statistics
+        user_counts = statistics.user_counts[users].astype(np.float64)
+        item_counts = statistics.item_counts.astype(np.float64)
+        return ((user_counts / (user_counts + self.user_shrinkage))[..., np.newaxis] *
+                item_counts / (item_counts + self.item_shrinkage))
+
+    def score_user(self, user, **options):
+        """
+        Predict the ratings of one user for every item
+        :param user: The row position of the user
+        :param options: Prediction options of the collaborative model
+        :return: An array of predicted ratings, one per item
+        """
+        weights = self._weights(user)
+        return weights * self.model.score_user(user, **options) + (1 - weights) * self.content.score_user(user)
+
+    def score_users(self, users, **options):
+        """
+        Predict the ratings of a chunk of users for every item
+        :param users: The row positions of the users
+        :param options: Prediction options of the collaborative model
+        :return: A len(users) x n_items array of predicted ratings
+        """
+        users = np.asarray(users)
+        weights = self._weights(users)
+        return (weights * self.model.score_users(users, **options) +
+                (1 - weights) * self.content.score_users(users))
+
+    def score_user_id(self, user_id, **options):
+        """
+        Predict the ratings of a user by id, new users from the content model alone
+        :param user_id: The user id
+        :param options: Prediction options of the collaborative model
+        :return: An array of predicted ratings, one per item
+        """
+        try:
+            user = self.ratings.user_index(user_id)
+        except KeyError:
+            return self.content.score_new_user(user_id)
+        return self.score_user(user, **options)
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None):
+        """
+        Add a batch of new or changed ratings to both models
+        :param user_ids: The user id of each rating, new users are added
+        :param item_ids: The item id of each rating, new items are added
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        """
+        self.model.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+        if self.content.ratings is getattr(self.model, 'known_ratings', self.model.ratings):
+            self.content.fit()
+        else:
+            self.content.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+
+    def save(self, path):
+        """
+        Save both models under the directory path
+        :param path: The directory to save to, created if missing
+        """
+        self.model.save(os.path.join(path, 'model'))
+        self.content.save(os.path.join(path, 'content'))
+        save_arrays(path, {}, {'model': type(self).__name__, 'user_shrinkage': self.user_shrinkage,
+                               'item_shrinkage': self.item_shrinkage})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a model saved with save
+        :param path: The directory the model was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The HybridRecommender
+        """
+        manifest = read_manifest(path)
+        return cls(load_model(os.path.join(path, 'model'), mmap_mode=mmap_mode),
+                   ContentBasedPredictor.load(os.path.join(path, 'content'), mmap_mode=mmap_mode),
+                   user_shrinkage=manifest['user_shrinkage'], item_shrinkage=manifest['item_shrinkage'])
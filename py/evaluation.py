@@ -0,0 +1,233 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from baseline_predictors import BaselinePredictor
+from collaborative_filtering import CollaborativeFiltering
+from extras import assign_folds, split_fold
+from matrix_factorisation import MatrixFactorisation
+from parallel import WorkerPool
+from ratings import as_ratings_matrix
+from recommender import top_n
+
+EVALUATION_METRICS = ('rmse', 'mae', 'precision', 'recall', 'ndcg')
+
+
+class ModelSpec(object):
+    """
+    One model configuration to evaluate: the model class with its constructor parameters
+    and the options passed to score_user.
+    Models trained by a separate fit call, such as LatentFactorModel and ImplicitALS, also take fit parameters.
+    Specs with the same class and parameters share one fitted model per fold.
+    """
+
+    def __init__(self, name, model_class, params=None, options=None, fit_params=None):
+        """
+        :param name: The name the results are reported under
+        :param model_class: The Recommender subclass
+        :param params: The constructor keyword arguments, besides the ratings
+        :param options: The score_user keyword arguments
+        :param fit_params: The fit keyword arguments, None for models fitted by their constructor
+        """
+        self.name = name
+        self.model_class = model_class
+        self.params = params or {}
+        self.options = options or {}
+        self.fit_params = fit_params
+
+    @property
+    def model_key(self):
+        fit_params = None if self.fit_params is None else tuple(sorted(self.fit_params.items()))
+        return self.model_class.__name__, tuple(sorted(self.params.items())), fit_params
+
+    def build(self, train):
+        """
+        Fit the model on the training ratings
+        :param train: The training RatingsMatrix
+        :return: The fitted model
+        """
+        model = self.model_class(train, **self.params)
+        if self.fit_params is not None:
+            model.fit(**self.fit_params)
+        return model
+
+    def __repr__(self):
+        return '<ModelSpec {0}>'.format(self.name)
+
+
+def model_grid(baselines=('item_user',), methods=('user_user', 'item_item'), adjusts=('mean', 'full'),
+               similarities=('cosine', 'pearson'), ks=(20, 50), ranks=(10, 20), random_state=0):
+    """
+    The specs of a hyperparameter sweep over the baseline, collaborative filtering and matrix factorisation models.
+    All ranks are scored from one factorisation of the largest rank.
+    :param baselines: The baselines of BaselinePredictor
+    :param methods: The collaborative filtering methods
+    :param adjusts: The rating adjustments of collaborative filtering
+    :param similarities: The similarity measures of collaborative filtering
+    :param ks: The numbers of neighbours of collaborative filtering
+    :param ranks: The ranks of matrix factorisation
+    :param random_state: Seed for the randomized SVD
+    :return: A list of ModelSpec
+    """
+    specs = [ModelSpec('baseline {0}'.format(based), BaselinePredictor, options={'based': based})
+             for based in baselines]
+    for method in methods:
+        for adjust in adjusts:
+            for similarity in similarities:
+                for k in ks:
+                    options = {'method': method, 'adjust': adjust, 'similarity': similarity, 'k': k}
+                    specs.append(ModelSpec('cf {0} {1} {2} k={3}'.format(method, adjust, similarity, k),
+                                           CollaborativeFiltering, options=options))
+    if len(ranks):
+        params = {'rank': max(ranks), 'solver': 'randomized', 'random_state': random_state}
+        specs.extend(ModelSpec('mf rank={0}'.format(rank), MatrixFactorisation, params, {'k': rank})
+                     for rank in ranks)
+    return specs
+
+
+def rmse(predicted, actual):
+    """
+    :return: The root mean squared error between two arrays of ratings
+    """
+    return np.sqrt(np.mean((np.asarray(predicted, dtype=np.float64) - actual) ** 2))
+
+
+def mae(predicted, actual):
+    """
+    :return: The mean absolute error between two arrays of ratings
+    """
+    return np.mean(np.abs(np.asarray(predicted, dtype=np.float64) - actual))
+
+
+def precision_at_n(recommended, relevant, n):
+    """
+    :param recommended: The recommended item positions, best first
+    :param relevant: The relevant item positions
+    :param n: The number of recommendations considered
+    :return: The fraction of the top n recommendations that are relevant
+    """
+    return np.isin(recommended[:n], relevant).sum() / float(n)
+
+
+def recall_at_n(recommended, relevant, n):
+    """
+    :param recommended: The recommended item positions, best first
+    :param relevant: The relevant item positions
+    :param n: The number of recommendations considered
+    :return: The fraction of the relevant items in the top n recommendations
+    """
+    if not len(relevant):
+        return 0.
+    return np.isin(recommended[:n], relevant).sum() / float(len(relevant))
+
+
+def ndcg_at_n(recommended, relevant, n):
+    """
+    The normalised discounted cumulative gain with binary relevance
+    :param recommended: The recommended item positions, best first
+    :param relevant: The relevant item positions
+    :param n: The number of recommendations considered
+    :return: The DCG of the top n recommendations over the DCG of a perfect ranking
+    """
+    discounts = 1. / np.log2(np.arange(2, n + 2))
+    hits = np.isin(recommended[:n], relevant)
+    ideal = discounts[:min(len(relevant), n)].sum()
+    if not ideal:
+        return 0.
+    return discounts[:len(hits)][hits].sum() / ideal
+
+
+def evaluate(model, test, n=10, relevance_threshold=4, **options):
+    """
+    Evaluate a fitted model on held out ratings. Each test user is scored once with score_user,
+    the scores at the test ratings give the errors and the top n unrated items give the ranking metrics.
+    The ranking metrics are averaged over the users with at least one relevant test rating.
+    :param model: The fitted Recommender
+    :param test: The held out ratings, over users and items the model knows
+    :type test: RatingsMatrix or DataFrame
+    :param n: The number of recommendations for the ranking metrics
+    :param relevance_threshold: The lowest test rating that counts as relevant
+    :param options: The score_user options
+    :return: A dict of the EVALUATION_METRICS
+    """
+    test = as_ratings_matrix(test)
+    csr = test.csr
+    test_users = np.flatnonzero(np.diff(csr.indptr))
+    users = model.ratings.user_index(test.user_ids[test_users])
+    predicted = np.empty(test.nnz)
+    ranking_metrics = []
+    for test_user, user in zip(test_users, users):
+        start, end = csr.indptr[test_user], csr.indptr[test_user + 1]
+        items = model.ratings.item_index(test.item_ids[csr.indices[start:end]])
+        scores = model.score_user(user, **options)
+        predicted[start:end] = scores[items]
+
+        relevant = items[csr.data[start:end] >= relevance_threshold]
+        if len(relevant):
+            recommended = top_n(scores, n, exclude=model.ratings.user_ratings(user)[0])
+            ranking_metrics.append((precision_at_n(recommended, relevant, n), recall_at_n(recommended, relevant, n),
+                                    ndcg_at_n(recommended, relevant, n)))
+
+    ranking_metrics = np.mean(ranking_metrics, axis=0) if ranking_metrics else np.full(3, np.nan)
+    return dict(zip(EVALUATION_METRICS, (rmse(predicted, csr.data), mae(predicted, csr.data)) +
+                    tuple(ranking_metrics)))
+
+
+def cross_validate(ratings, specs, n_folds=5, n=10, relevance_threshold=4, n_jobs=None, random_state=None):
+    """
+    Run a k-fold experiment over model specs.
+    Every (fold, model) pair is fitted and evaluated as a separate task in a WorkerPool,
+    so all workers share one memory-mapped copy of the ratings and folds.
+    Collaborative filtering specs build the item index, or the user neighbours when k is set, for their own options
+    so every test user is scored from precomputed neighbours.
+    :param ratings: The user x item ratings
+    :type ratings: RatingsMatrix or DataFrame
+    :param specs: The ModelSpec list, as from model_grid
+    :param n_folds: The number of folds
+    :param n: The number of recommendations for the ranking metrics
+    :param relevance_threshold: The lowest test rating that counts as relevant
+    :param n_jobs: The number of worker processes, None for one per CPU and 1 to run in this process
+    :param random_state: Seed for the assignment of ratings to folds
+    :return: A DataFrame with one row per spec and fold of the metrics and the fit and score times.
+        results.groupby('model').mean() gives the cross-validated metrics.
+    """
+    ratings = as_ratings_matrix(ratings)
+    folds = assign_folds(ratings, n_folds=n_folds, random_state=random_state)
+    groups = {}
+    for spec in specs:
+        groups.setdefault(spec.model_key, []).append(spec)
+    tasks = [(fold, group) for fold in range(n_folds) for group in groups.values()]
+
+    with WorkerPool(n_jobs, {'ratings': ratings, 'folds': folds}) as pool:
+        results = list(pool.map(_evaluate_group, [(fold, group, n, relevance_threshold) for fold, group in tasks]))
+
+    rows = [row for result in results for row in result]
+    return pd.DataFrame(rows, columns=['model', 'fold'] + list(EVALUATION_METRICS) + ['fit_time', 'score_time'])
+
+
+def _evaluate_group(shared, fold, specs, n, relevance_threshold):
+    """
+    Fit one model on the train ratings of a fold and evaluate each of its specs on the test ratings
+    :param shared: The dict of the ratings and the folds
+    :return: A list of result rows
+    """
+    train, test = split_fold(shared['ratings'], shared['folds'], fold)
+    start = time.time()
+    model = specs[0].build(train)
+    fit_time = time.time() - start
+
+    rows = []
+    for spec in specs:
+        start = time.time()
+        options = spec.options
+        if options.get('method') == 'item_item':
+            model.build_item_index(adjust=options.get('adjust', 'full'),
+                                   similarity=options.get('similarity', 'cosine'), k=options.get('k', -1))
+        elif options.get('method') == 'user_user' and options.get('k', -1) != -1:
+            model.build_user_neighbours(adjust=options.get('adjust', 'full'),
+                                        similarity=options.get('similarity', 'cosine'), k=options['k'])
+        metrics = evaluate(model, test, n=n, relevance_threshold=relevance_threshold, **options)
+        rows.append([spec.name, fold] + [metrics[metric] for metric in EVALUATION_METRICS] +
+                    [fit_time, time.time() - start])
+    return rows
@@ -1,89 +1,292 @@
+import io
 import os
+import zipfile
 
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 
-from sklearn.cross_validation import train_test_split
 from sklearn.metrics import mean_squared_error
 
+from profiling import profiled
+from ratings import RatingsMatrix, as_ratings_matrix
 
-def read_ratings(file_path, sep='::'):
+
+RATINGS_CACHE_VERSION = 1
+RATING_SCALE = (1, 5)
+
+
+@profiled('read_ratings')
+def read_ratings(file_path, sep='::', cache=True, chunk_bytes=2 ** 24):
     """
-    Reads the ratings file into a user x item DataFrame. Ratings are stored in 'database' form.
+    Reads the ratings file into a sparse user x item RatingsMatrix. Ratings are stored in 'database' form.
     Where each line is in the form: <user_id><sep><item_id><sep><rating><sep><timestamp>
-    Unkown values are 0 and ratings are on a 1-5 scale
+    Only the known ratings are stored and ratings are on a 1-5 scale.
+    The file is parsed in chunks with the C parser, multi-character separators are first replaced by a tab.
+    The parsed ratings are cached next to the file and reused while the file's size and modification time match.
     :param file_path: The ratings file path
     :param sep: The separator between items
-    :return: The user x item ratings DataFrame
+    :param cache: Whether to read and write the binary cache
+    :param chunk_bytes: The number of bytes to parse at a time
+    :return: The user x item RatingsMatrix
     """
     ratings_file = os.path.abspath(file_path)
-    column_names = ['userId', 'movieId', 'rating', 'timestamp']
-    ratings = pd.read_csv(ratings_file, names=column_names, sep=sep, engine='python')
-    ratings = ratings.drop('timestamp', axis=1)
-    ratings[['userId', 'movieId']] = ratings[['userId', 'movieId']].astype('int32')
-    ratings[['rating']] = ratings[['rating']].astype('int8')
-    ratings = ratings.pivot('userId', 'movieId', 'rating').fillna(value=0)
+    cache_file = ratings_file + '.cache.npz'
+    source_key = _ratings_source_key(ratings_file, sep)
+    if cache:
+        ratings = _read_ratings_cache(cache_file, source_key)
+        if ratings is not None:
+            return ratings
+
+    users, items, values, timestamps = [], [], [], []
+    for chunk in _iter_ratings_chunks(ratings_file, sep, chunk_bytes):
+        users.append(chunk[:, 0].astype('int32'))
+        items.append(chunk[:, 1].astype('int32'))
+        values.append(chunk[:, 2])
+        timestamps.append(chunk[:, 3].astype('int64'))
+    values = np.concatenate(values) if values else np.zeros(0)
+    if np.all(values == np.round(values)):
+        values = values.astype('int8')
+    timestamps = np.concatenate(timestamps) if timestamps else np.zeros(0, dtype='int64')
+    ratings = RatingsMatrix.from_coo(np.concatenate(users) if users else np.zeros(0, dtype='int32'),
+                                     np.concatenate(items) if items else np.zeros(0, dtype='int32'),
+                                     values, timestamps=timestamps)
+
+    if cache:
+        _write_ratings_cache(cache_file, source_key, ratings)
     return ratings
 
 
+def _iter_ratings_chunks(ratings_file, sep, chunk_bytes):
+    """
+    Parse the ratings file a chunk of whole lines at a time
+    :return: A generator of n x 4 float arrays of (user_id, item_id, rating, timestamp)
+    """
+    separator = sep.encode('utf-8')
+    with open(ratings_file, 'rb') as ratings_stream:
+        remainder = b''
+        while True:
+            block = ratings_stream.read(chunk_bytes)
+            data = remainder + block
+            if block:
+                end = data.rfind(b'\n') + 1
+                data, remainder = data[:end], data[end:]
+            if data.strip():
+                if len(separator) > 1:
+                    data = data.replace(separator, b'\t')
+                    chunk_sep = '\t'
+                else:
+                    chunk_sep = sep
+                yield pd.read_csv(io.BytesIO(data), sep=chunk_sep, header=None, engine='c',
+                                  usecols=[0, 1, 2, 3], dtype=np.float64).values
+            if not block:
+                break
+
+
+def _ratings_source_key(ratings_file, sep):
+    stat = os.stat(ratings_file)
+    return np.asarray([RATINGS_CACHE_VERSION, stat.st_size, int(stat.st_mtime * 1e6)], dtype=np.int64), sep
+
+
+def _read_ratings_cache(cache_file, source_key):
+    """
+    :return: The cached RatingsMatrix, or None when there is no cache or it is stale
+    """
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if not np.array_equal(cached['source_key'], source_key[0]) or str(cached['sep']) != source_key[1]:
+                return None
+            matrix = sp.csr_matrix((cached['data'], cached['indices'], cached['indptr']),
+                                   shape=tuple(cached['shape']))
+            return RatingsMatrix(matrix, user_ids=cached['user_ids'], item_ids=cached['item_ids'],
+                                 timestamps=cached['timestamps'])
+    except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+        return None
+
+
+def _write_ratings_cache(cache_file, source_key, ratings):
+    csr = ratings.csr
+    partial_file = cache_file + '.partial'
+    try:
+        with open(partial_file, 'wb') as cache_stream:
+            np.savez(cache_stream, source_key=source_key[0], sep=np.asarray(source_key[1]),
+                     shape=np.asarray(csr.shape), data=csr.data, indices=csr.indices, indptr=csr.indptr,
+                     user_ids=ratings.user_ids, item_ids=ratings.item_ids, timestamps=ratings.timestamps)
+        os.rename(partial_file, cache_file)
+    except (IOError, OSError):
+        pass
+
+
 def get_ratings_sparsity(ratings):
     """
     Calculates the sparsity of the ratings matrix
-    :param ratings: The user x item ratings DataFrame
-    :type ratings: DataFrame
-    :return: The percentage sparsity of the DataFrame
+    :param ratings: The user x item ratings
+    :type ratings: RatingsMatrix or DataFrame
+    :return: The percentage sparsity of the ratings
     """
-    sparsity = float(len(ratings.values.nonzero()[0]))
+    ratings = as_ratings_matrix(ratings)
+    sparsity = float(ratings.nnz)
     sparsity /= (ratings.shape[0] * ratings.shape[1])
     sparsity *= 100
 
     return sparsity
 
 
-def split_train_test(ratings, test_ratio=0.2):
+@profiled('split_train_test')
+def split_train_test(ratings, test_ratio=0.2, method='random', n_last=1, random_state=None):
     """
     Split the ratings matrix into test and train matrices.
-    :param ratings: The original user x item ratings DataFrame
-    :type ratings: DataFrame
-    :param test_ratio: The ratio of ratings to take for the test dataset
+    The split is made per user, users with a single rating keep it in train.
+    :param ratings: The original user x item ratings
+    :type ratings: RatingsMatrix or DataFrame
+    :param test_ratio: The ratio of each user's ratings to take for the test dataset, for the random method
     :type test_ratio: float
-    :return: The train and test ratings dataFrames
+    :param method: <'random', 'last'> Take a random test_ratio of each user's ratings,
+        or each user's n_last most recent ratings by timestamp
+    :param n_last: The number of most recent ratings per user to test on, for the last method
+    :param random_state: Seed for the random method
+    :return: The train and test ratings, in the same form as ratings
     """
-    test = pd.DataFrame(np.zeros(ratings.shape), index=ratings.index, columns=ratings.columns)
-    train = pd.DataFrame(np.zeros(ratings.shape), index=ratings.index, columns=ratings.columns)
+    ratings_matrix = as_ratings_matrix(ratings)
+    counts = np.diff(ratings_matrix.csr.indptr)
+    if method == 'random':
+        ranks = _user_ranks(ratings_matrix, np.random.RandomState(random_state).random_sample(ratings_matrix.nnz))
+        n_test = np.ceil(counts * test_ratio).astype(np.int64)
+    elif method == 'last':
+        if ratings_matrix.timestamps is None:
+            raise ValueError('The last method needs ratings with timestamps.')
+        ranks = _user_ranks(ratings_matrix, -ratings_matrix.timestamps)
+        n_test = np.full(len(counts), n_last, dtype=np.int64)
+    else:
+        raise KeyError(method+' is not an implemented split method.')
+
+    n_test = np.minimum(n_test, np.maximum(counts - 1, 0))
+    test_mask = ranks < n_test[ratings_matrix.user_rows()]
+    return _split_by_mask(ratings, ratings_matrix, test_mask)
 
-    for user in xrange(ratings.shape[0]):
-        user_ratings_indexes = ratings.iloc[user, :].nonzero()[0]
-        train_indexes, test_indexes = train_test_split(user_ratings_indexes, test_size=test_ratio)
-        train.iloc[user, train_indexes] = ratings.iloc[user, train_indexes]
-        test.iloc[user, test_indexes] = ratings.iloc[user, test_indexes]
 
+def k_fold_split(ratings, n_folds=5, random_state=None):
+    """
+    Split the ratings into k folds, stratified per user so every user's ratings are spread over the folds.
+    :param ratings: The original user x item ratings
+    :type ratings: RatingsMatrix or DataFrame
+    :param n_folds: The number of folds
+    :param random_state: Seed for the assignment of ratings to folds
+    :return: A generator of (train, test) ratings for each fold, in the same form as ratings
+    """
+    ratings_matrix = as_ratings_matrix(ratings)
+    folds = assign_folds(ratings_matrix, n_folds=n_folds, random_state=random_state)
+    for fold in range(n_folds):
+        yield split_fold(ratings, folds, fold)
+
+
+def assign_folds(ratings, n_folds=5, random_state=None):
+    """
+    Assign each rating to one of k folds, stratified per user as for k_fold_split
+    :param ratings: The RatingsMatrix
+    :param n_folds: The number of folds
+    :param random_state: Seed for the assignment of ratings to folds
+    :return: The fold of each rating, aligned with ratings.csr.data
+    """
+    random = np.random.RandomState(random_state)
+    ranks = _user_ranks(ratings, random.random_sample(ratings.nnz))
+    user_offsets = random.randint(n_folds, size=ratings.shape[0])
+    return (ranks + user_offsets[ratings.user_rows()]) % n_folds
+
+
+def split_fold(ratings, folds, fold):
+    """
+    Split the ratings into the train and test ratings of one fold
+    :param ratings: The original user x item ratings
+    :type ratings: RatingsMatrix or DataFrame
+    :param folds: The fold of each rating, as from assign_folds
+    :param fold: The fold to test on
+    :return: The train and test ratings, in the same form as ratings
+    """
+    return _split_by_mask(ratings, as_ratings_matrix(ratings), np.asarray(folds) == fold)
+
+
+def _user_ranks(ratings, keys):
+    """
+    Rank each rating within its user's ratings
+    :param ratings: The RatingsMatrix
+    :param keys: A sort key for each rating, aligned with ratings.csr.data
+    :return: The rank of each rating within its user, 0 for the smallest key
+    """
+    rows = ratings.user_rows()
+    order = np.lexsort((keys, rows))
+    ranks = np.empty(ratings.nnz, dtype=np.int64)
+    ranks[order] = np.arange(ratings.nnz) - ratings.csr.indptr[rows[order]]
+    return ranks
+
+
+def _split_by_mask(ratings, ratings_matrix, test_mask):
+    train = _select_ratings(ratings_matrix, ~test_mask)
+    test = _select_ratings(ratings_matrix, test_mask)
+    if not isinstance(ratings, RatingsMatrix):
+        train, test = train.to_dataframe(), test.to_dataframe()
     return train, test
 
 
+def _select_ratings(ratings, mask):
+    """
+    Keep only the ratings selected by mask, keeping all users and items
+    :param ratings: The RatingsMatrix
+    :param mask: A boolean mask aligned with ratings.csr.data
+    :return: The selected RatingsMatrix
+    """
+    csr = ratings.csr
+    counts = np.bincount(ratings.user_rows()[mask], minlength=csr.shape[0])
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    matrix = sp.csr_matrix((csr.data[mask], csr.indices[mask], indptr), shape=csr.shape)
+    timestamps = None if ratings.timestamps is None else ratings.timestamps[mask]
+    return RatingsMatrix(matrix, user_ids=ratings.user_ids, item_ids=ratings.item_ids, timestamps=timestamps)
+
+
+@profiled('get_rmse')
 def get_rmse(predicted, actual):
     """
-    Calculates the root mean squared error between the predicted and actual ratings DataFrames
-    :param predicted: The predicted ratings
-    :type predicted: DataFrame
+    Calculates the root mean squared error between the predicted and actual ratings.
+    Only the known actual ratings are scored.
+    :param predicted: The predicted ratings, for every user and item or only at the known actual ratings
+    :type predicted: DataFrame or RatingsMatrix
     :param actual: The actual ratings
-    :type actual: DataFrame
+    :type actual: RatingsMatrix or DataFrame
     :return: root mean squared error
     """
-    return np.sqrt(mean_squared_error(actual.values[actual.values.nonzero()].flatten(),
-                                      predicted.values[actual.values.nonzero()].flatten()))
+    actual = as_ratings_matrix(actual)
+    if isinstance(predicted, RatingsMatrix):
+        predicted_values = predicted.csr[actual.user_rows(), actual.csr.indices].A1
+    else:
+        predicted_values = np.asarray(predicted.values)[actual.user_rows(), actual.csr.indices]
+    return np.sqrt(mean_squared_error(actual.csr.data, predicted_values))
 
 
-def clamp(x, floor=1, ceiling=5):
+@profiled('clamp')
+def clamp(x, floor=None, ceiling=None, copy=True):
     """
-    Clamps a value between the values floor and ceiling
-    :param x: The value to be clamped
-    :param floor: The minimum value for x
-    :param ceiling: The maximum value for x
-    :return: The clamped value of x
+    Clamps values between the values floor and ceiling, vectorised over arrays.
+    Works on scalars, arrays, Series and DataFrames. For scipy sparse matrices and RatingsMatrix only the
+    stored values are clamped.
+    :param x: The value(s) to be clamped
+    :param floor: The minimum value for x, defaults to the bottom of RATING_SCALE
+    :param ceiling: The maximum value for x, defaults to the top of RATING_SCALE
+    :param copy: Whether to leave an ndarray x untouched. When False it is clamped in place
+    :return: The clamped value(s) of x
     """
-    if x > ceiling:
-        x = ceiling
-    elif x < floor:
-        x = floor
-    return x
\ No newline at end of file
+    if floor is None:
+        floor = RATING_SCALE[0]
+    if ceiling is None:
+        ceiling = RATING_SCALE[1]
+
+    if isinstance(x, RatingsMatrix):
+        return x.with_data(np.clip(x.csr.data, floor, ceiling))
+    if sp.issparse(x):
+        x = x.copy()
+        x.data = np.clip(x.data, floor, ceiling)
+        return x
+    if isinstance(x, np.ndarray) and not copy:
+        return np.clip(x, floor, ceiling, out=x)
+    return np.clip(x, floor, ceiling)
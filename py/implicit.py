@@ -0,0 +1,272 @@
+import os
+
+import numpy as np
+
+from batch_scoring import top_n_rows
+from latent_factors import solve_weighted_rows
+from parallel import WorkerPool, partition
+from persistence import load_arrays, save_arrays
+from ratings import RatingsMatrix, as_ratings_matrix
+from recommender import Recommender
+from similarity import DEFAULT_MEMORY_BUDGET
+
+CONFIDENCE_SCALINGS = ('linear', 'log')
+
+
+class ImplicitALS(Recommender):
+    """
+    Weighted matrix factorisation of implicit feedback, as in Hu, Koren and Volinsky,
+    "Collaborative Filtering for Implicit Feedback Datasets".
+    Every user and item pair is a preference of 1 where there is an interaction and 0 elsewhere,
+    weighted by a confidence of 1 + alpha * the interaction strength (views, clicks or ratings).
+    The unobserved pairs all have confidence 1, so their part of each least squares problem is the Gram matrix
+    of the other side's factors, computed once per step. Every epoch then costs time proportional to the number
+    of interactions, the users x items matrix is never formed.
+    Scores are preferences for ranking, not ratings, so they are not clamped to rating_scale.
+    """
+
+    def __init__(self, ratings, n_factors=32, reg=0.1, alpha=40., scaling='linear', epsilon=1., random_state=None,
+                 dtype=np.float32, n_jobs=1):
+        """
+        :param ratings: The user x item interaction strengths, only the stored values are interactions
+        :type ratings: RatingsMatrix or DataFrame
+        :param n_factors: The number of latent factors
+        :param reg: The L2 regularisation of the factors
+        :param alpha: The confidence gained per unit of interaction strength
+        :param scaling: <'linear', 'log'> The confidence, 1 + alpha * r or 1 + alpha * log(1 + r / epsilon)
+        :param epsilon: The interaction strength scale of the log confidence
+        :param random_state: Seed for the initial factors
+        :param dtype: The float type of the factors
+        :param n_jobs: The number of worker processes the least squares solves are spread over, None for one per CPU
+        """
+        if scaling not in CONFIDENCE_SCALINGS:
+            raise KeyError(scaling+' is not an implemented confidence scaling.')
+        self.ratings = as_ratings_matrix(ratings)
+        self.n_factors = n_factors
+        self.reg = reg
+        self.alpha = alpha
+        self.scaling = scaling
+        self.epsilon = epsilon
+        self.dtype = np.dtype(dtype)
+        self.n_jobs = n_jobs
+
+        random = np.random.RandomState(random_state)
+        n_users, n_items = self.ratings.shape
+        self.user_factors = random.normal(scale=0.01, size=(n_users, n_factors)).astype(self.dtype)
+        self.item_factors = random.normal(scale=0.01, size=(n_items, n_factors)).astype(self.dtype)
+        self.history = []
+
+    def confidence(self, values):
+        """
+        :param values: Interaction strengths
+        :return: The confidence of each interaction
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self.scaling == 'log':
+            return 1. + self.alpha * np.log1p(values / self.epsilon)
+        return 1. + self.alpha * values
+
+    def fit(self, n_epochs=15, validation=None, n=10, patience=3, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Train the factors with alternating least squares
+        :param n_epochs: The maximum number of passes over the interactions
+        :param validation: Optional held out interactions for the same users and items, for early stopping
+        :type validation: RatingsMatrix or DataFrame
+        :param n: The number of recommendations the validation precision is taken over
+        :param patience: Stop after this many epochs without a higher validation precision
+        :param memory_budget: The number of bytes the per interaction outer products of a solve may use
+        :return: self, with the factors of the best validation epoch
+        """
+        if validation is not None:
+            validation = as_ratings_matrix(validation)
+            if validation.shape != self.ratings.shape:
+                raise ValueError('The validation interactions must cover the same users and items.')
+
+        best_precision, best_state, stale_epochs = -np.inf, None, 0
+        with WorkerPool(self.n_jobs, self._inputs()) as pool:
+            for epoch in range(n_epochs):
+                self.user_factors = self._solve(pool, 'user', self.item_factors, memory_budget)
+                self.item_factors = self._solve(pool, 'item', self.user_factors, memory_budget)
+
+                validation_precision = None
+                if validation is not None:
+                    validation_precision = self.precision(validation, n=n)
+                self.history.append({'epoch': epoch, 'loss': self.loss(), 'validation_precision': validation_precision})
+
+                if validation is None:
+                    continue
+                if validation_precision > best_precision:
+                    best_precision, stale_epochs = validation_precision, 0
+                    best_state = (self.user_factors.copy(), self.item_factors.copy())
+                else:
+                    stale_epochs += 1
+                    if stale_epochs >= patience:
+                        break
+
+        if best_state is not None:
+            self.user_factors, self.item_factors = best_state
+        return self
+
+    def _inputs(self):
+        csr, csc = self.ratings.csr, self.ratings.csc
+        return {'user_indptr': csr.indptr, 'user_indices': csr.indices, 'user_confidence': self.confidence(csr.data),
+                'item_indptr': csc.indptr, 'item_indices': csc.indices, 'item_confidence': self.confidence(csc.data)}
+
+    def _solve(self, pool, side, other_factors, memory_budget, rows=None):
+        """
+        Solve the weighted least squares problem of every user or every item, holding the other side fixed.
+        The rows are split into contiguous parts solved by the pool's workers, which share the interactions.
+        :param pool: The WorkerPool sharing the interactions from _inputs
+        :param side: <'user', 'item'> The side to solve
+        :param rows: Optional sorted positions of the only rows to solve
+        :return: The new factors of the rows
+        """
+        if rows is None:
+            rows = np.arange(len(pool.shared[side + '_indptr']) - 1)
+        gram = other_factors.T.dot(other_factors)
+        max_entries = max(1, memory_budget // (self.n_factors ** 2 * self.dtype.itemsize))
+        tasks = [(side, rows[start:end], other_factors, gram, self.reg, max_entries)
+                 for start, end in partition(len(rows), 2 * pool.n_jobs if pool.n_jobs > 1 else 1)]
+        if not tasks:
+            return np.zeros((0, self.n_factors), dtype=self.dtype)
+        return np.vstack(list(pool.map(_solve_implicit_rows, tasks)))
+
+    def loss(self):
+        """
+        The weighted squared error over every user and item pair plus the regularisation,
+        computed from the interactions and the Gram matrix of the item factors
+        """
+        csr = self.ratings.csr
+        confidence = self.confidence(csr.data)
+        predicted = np.einsum('ij,ij->i', self.user_factors[self.ratings.user_rows()], self.item_factors[csr.indices],
+                              dtype=np.float64)
+        gram = self.item_factors.T.dot(self.item_factors).astype(np.float64)
+        unobserved = np.einsum('ij,jk,ik->', self.user_factors, gram, self.user_factors, dtype=np.float64)
+        observed = np.sum(confidence * (1 - predicted) ** 2 - predicted ** 2)
+        regularisation = self.reg * (np.sum(self.user_factors.astype(np.float64) ** 2) +
+                                     np.sum(self.item_factors.astype(np.float64) ** 2))
+        return float(unobserved + observed + regularisation)
+
+    def precision(self, test, n=10, chunk_size=1024):
+        """
+        The precision at n of the recommendations against held out interactions, averaged over the test users.
+        The interactions the model was trained on are not recommended.
+        :param test: The held out interactions for the same users and items
+        :type test: RatingsMatrix or DataFrame
+        :param n: The number of recommendations per user
+        :param chunk_size: The number of users scored together
+        :return: The mean precision
+        """
+        test = as_ratings_matrix(test)
+        users = np.flatnonzero(np.diff(test.csr.indptr))
+        hits = 0
+        for start in range(0, len(users), chunk_size):
+            chunk = users[start:start + chunk_size]
+            items, _ = top_n_rows(self.score_users(chunk), n, exclude=self.ratings.csr[chunk])
+            recommended = items >= 0
+            hits += test.csr[chunk[np.nonzero(recommended)[0]], items[recommended]].astype(bool).sum()
+        return hits / float(max(len(users), 1) * n)
+
+    def score_user(self, user):
+        """
+        Predict the preference of one user for every item
+        :param user: The row position of the user
+        :return: An array of preference scores, one per item
+        """
+        return self.item_factors.dot(self.user_factors[user])
+
+    def score_users(self, users):
+        """
+        Predict the preferences of a chunk of users for every item
+        :param users: The row positions of the users
+        :return: A len(users) x n_items array of preference scores
+        """
+        return self.user_factors[users].dot(self.item_factors.T)
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Add a batch of new or changed interactions without refitting.
+        New users and items start with zero factors, then the users and then the items in the batch
+        are re-solved with one alternating least squares step restricted to them.
+        :param user_ids: The user id of each interaction, new users are added
+        :param item_ids: The item id of each interaction, new items are added
+        :param ratings: The interaction strengths
+        :param timestamps: Optional time of each interaction, required when the ratings have timestamps
+        :param memory_budget: The number of bytes the per interaction outer products of a solve may use
+        """
+        n_users, n_items = self.ratings.shape
+        rows, cols = self.ratings.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+        new_users, new_items = self.ratings.shape[0] - n_users, self.ratings.shape[1] - n_items
+        self.user_factors = np.vstack((self.user_factors, np.zeros((new_users, self.n_factors), dtype=self.dtype)))
+        self.item_factors = np.vstack((self.item_factors, np.zeros((new_items, self.n_factors), dtype=self.dtype)))
+
+        users, items = np.unique(rows), np.unique(cols)
+        with WorkerPool(1, self._inputs()) as pool:
+            self.user_factors[users] = self._solve(pool, 'user', self.item_factors, memory_budget, rows=users)
+            self.item_factors[items] = self._solve(pool, 'item', self.user_factors, memory_budget, rows=items)
+
+    def save(self, path):
+        """
+        Save the model as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        self.ratings.save(os.path.join(path, 'ratings'))
+        save_arrays(path, {'user_factors': self.user_factors, 'item_factors': self.item_factors},
+                    {'model': type(self).__name__, 'dtype': self.dtype.name, 'n_factors': self.n_factors,
+                     'reg': self.reg, 'alpha': self.alpha, 'scaling': self.scaling, 'epsilon': self.epsilon,
+                     'history': self.history})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a model saved with save. The interactions and factors are memory-mapped read only by default,
+        load with mmap_mode='c' or None to train the loaded model further.
+        :param path: The directory the model was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The ImplicitALS model, training in this process
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        model = cls.__new__(cls)
+        model.ratings = RatingsMatrix.load(os.path.join(path, 'ratings'), mmap_mode=mmap_mode)
+        model.n_factors = manifest['n_factors']
+        model.reg = manifest['reg']
+        model.alpha = manifest['alpha']
+        model.scaling = manifest['scaling']
+        model.epsilon = manifest['epsilon']
+        model.dtype = np.dtype(manifest['dtype'])
+        model.n_jobs = 1
+        model.user_factors, model.item_factors = arrays['user_factors'], arrays['item_factors']
+        model.history = manifest['history']
+        return model
+
+
+def solve_implicit_rows(indptr, indices, confidence, other_factors, gram, reg, rows, max_entries=2 ** 14):
+    """
+    Solve the weighted least squares problem of some rows of a sparse interaction matrix,
+    holding the other side fixed:
+    (G + reg I + sum over interactions of (c - 1) y y^T) x = sum over interactions of c y,
+    with G the Gram matrix of the other side's factors y and c the confidence of each interaction.
+    Rows are solved in chunks of about max_entries interactions with solve_weighted_rows.
+    :param indptr: The index pointers of the compressed interactions, rows being users or items
+    :param indices: The column positions of the compressed interactions
+    :param confidence: The confidence of each interaction
+    :param other_factors: The factors of the columns
+    :param gram: other_factors.T.dot(other_factors)
+    :param reg: The L2 regularisation of the factors
+    :param rows: The positions of the rows to solve
+    :param max_entries: The number of interactions whose outer products are formed at once
+    :return: A len(rows) x n_factors array of the factors of each row, in the float type of other_factors.
+        Rows without interactions get zero factors
+    """
+    dtype = other_factors.dtype
+
+    def weigh(entries):
+        weights = confidence[entries].astype(dtype)
+        return weights - 1, weights
+    return solve_weighted_rows(indptr, indices, other_factors, gram + reg * np.eye(other_factors.shape[1], dtype=dtype),
+                               rows, weigh, max_entries)
+
+
+def _solve_implicit_rows(shared, side, rows, other_factors, gram, reg, max_entries):
+    return solve_implicit_rows(shared[side + '_indptr'], shared[side + '_indices'], shared[side + '_confidence'],
+                               other_factors, gram, reg, rows, max_entries)
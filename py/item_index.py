@@ -0,0 +1,68 @@
+import numpy as np
+
+from neighbours import NeighbourGraph
+from persistence import load_arrays, save_arrays
+
+
+class ItemNeighbourIndex(object):
+    """
+    The precomputed k nearest neighbours of every item for item-item collaborative filtering.
+    Scoring a user only looks up the neighbour lists of the items the user has rated.
+    """
+
+    def __init__(self, neighbours, item_ids, adjust='mean', similarity='cosine'):
+        """
+        :param neighbours: The item NeighbourGraph
+        :param item_ids: The item id of each row of the graph
+        :param adjust: <'mean', 'full', None> The adjustment applied to the ratings the index was built from
+        :param similarity: <'cosine', 'pearson', 'adjusted'> The similarity measure the index was built with
+        """
+        self.neighbours = neighbours
+        self.item_ids = np.asarray(item_ids)
+        self.adjust = adjust
+        self.similarity = similarity
+
+    @property
+    def n_items(self):
+        return len(self.item_ids)
+
+    @property
+    def k(self):
+        return self.neighbours.k
+
+    def score(self, items, values):
+        """
+        Score every item for one user from the user's rated items.
+        Each rated item passes its rating on to its neighbours weighted by their similarity.
+        :param items: The positions of the rated items
+        :param values: The (adjusted) ratings of the rated items
+        :return: (weighted rating sums, absolute similarity sums) for every item
+        """
+        indices = np.asarray(self.neighbours.indices[items]).ravel()
+        weights = np.asarray(self.neighbours.weights[items], dtype=np.float64)
+        sums = np.bincount(indices, weights=(weights * np.asarray(values)[:, np.newaxis]).ravel(),
+                           minlength=self.n_items)
+        weight_sums = np.bincount(indices, weights=np.abs(weights).ravel(), minlength=self.n_items)
+        return sums, weight_sums
+
+    def save(self, path):
+        """
+        Save the index as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        save_arrays(path, {'indices': self.neighbours.indices, 'weights': self.neighbours.weights,
+                           'item_ids': self.item_ids},
+                    {'adjust': self.adjust, 'similarity': self.similarity, 'n_items': self.n_items, 'k': self.k})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load an index saved with save, memory-mapping the neighbour arrays by default
+        :param path: The directory the index was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The ItemNeighbourIndex
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        item_ids = arrays['item_ids']
+        neighbours = NeighbourGraph(arrays['indices'], arrays['weights'], n_columns=len(item_ids))
+        return cls(neighbours, item_ids, adjust=manifest['adjust'], similarity=manifest['similarity'])
@@ -0,0 +1,340 @@
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from extras import clamp, get_rmse
+from parallel import WorkerPool, partition
+from persistence import load_arrays, save_arrays
+from ratings import RatingsMatrix, as_ratings_matrix
+from recommender import Recommender
+from similarity import DEFAULT_MEMORY_BUDGET
+
+TRAINING_METHODS = ('als', 'sgd')
+
+
+class LatentFactorModel(Recommender):
+    """
+    A biased latent factor model, rating = global mean + user bias + item bias + user factors . item factors,
+    fit only on the known ratings.
+    Every epoch costs time proportional to the number of ratings, unknown ratings are never visited.
+    """
+
+    def __init__(self, ratings, n_factors=20, reg=0.1, method='als', random_state=None, dtype=np.float64, n_jobs=1):
+        """
+        :param ratings: The user x item ratings. Ratings on 1 to 5 scale. 0 represents unknown in a DataFrame.
+        :type ratings: RatingsMatrix or DataFrame
+        :param n_factors: The number of latent factors
+        :param reg: The L2 regularisation of the factors and biases
+        :param method: <'als', 'sgd'> Alternating least squares or mini-batch stochastic gradient descent
+        :param random_state: Seed for the initial factors and the SGD batches
+        :param dtype: The float type of the factors and biases. float32 halves their memory
+        :param n_jobs: The number of worker processes the ALS solves are spread over, None for one per CPU.
+            SGD always runs in this process
+        """
+        if method not in TRAINING_METHODS:
+            raise KeyError(method+' is not an implemented training method.')
+        self.ratings = as_ratings_matrix(ratings)
+        self.n_factors = n_factors
+        self.reg = reg
+        self.method = method
+        self.random = np.random.RandomState(random_state)
+        self.dtype = np.dtype(dtype)
+        self.n_jobs = n_jobs
+
+        n_users, n_items = self.ratings.shape
+        self.global_mean = float(self.statistics.global_mean)
+        self.user_factors = self.random.normal(scale=0.1, size=(n_users, n_factors)).astype(self.dtype)
+        self.item_factors = self.random.normal(scale=0.1, size=(n_items, n_factors)).astype(self.dtype)
+        self.user_biases = np.zeros(n_users, dtype=self.dtype)
+        self.item_biases = np.zeros(n_items, dtype=self.dtype)
+        self.history = []
+
+    def fit(self, n_epochs=20, validation=None, patience=3, learning_rate=0.05, batch_size=4096,
+            memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Train the factors and biases
+        :param n_epochs: The maximum number of passes over the ratings
+        :param validation: Optional held out ratings for the same users and items, for early stopping
+        :type validation: RatingsMatrix or DataFrame
+        :param patience: Stop after this many epochs without a lower validation RMSE
+        :param learning_rate: The SGD step size
+        :param batch_size: The number of ratings per SGD step
+        :param memory_budget: The number of bytes the per rating outer products of an ALS solve may use
+        :return: self, with the factors of the best validation epoch
+        """
+        if validation is not None:
+            validation = as_ratings_matrix(validation)
+            if validation.shape != self.ratings.shape:
+                raise ValueError('The validation ratings must cover the same users and items.')
+
+        best_rmse, best_state, stale_epochs = np.inf, None, 0
+        pool = WorkerPool(self.n_jobs, self._als_inputs()) if self.method == 'als' else None
+        try:
+            for epoch in range(n_epochs):
+                if self.method == 'als':
+                    self._als_epoch(pool, memory_budget)
+                else:
+                    self._sgd_epoch(learning_rate, batch_size)
+
+                train_rmse = get_rmse(self.predict_ratings(self.ratings), self.ratings)
+                validation_rmse = None
+                if validation is not None:
+                    validation_rmse = get_rmse(self.predict_ratings(validation), validation)
+                self.history.append({'epoch': epoch, 'train_rmse': train_rmse, 'validation_rmse': validation_rmse})
+
+                if validation is None:
+                    continue
+                if validation_rmse < best_rmse:
+                    best_rmse, stale_epochs = validation_rmse, 0
+                    best_state = self._state()
+                else:
+                    stale_epochs += 1
+                    if stale_epochs >= patience:
+                        break
+        finally:
+            if pool is not None:
+                pool.close()
+
+        if best_state is not None:
+            self.user_factors, self.item_factors, self.user_biases, self.item_biases = best_state
+        return self
+
+    def _state(self):
+        return (self.user_factors.copy(), self.item_factors.copy(),
+                self.user_biases.copy(), self.item_biases.copy())
+
+    def _als_inputs(self):
+        csr, csc = self.ratings.csr, self.ratings.csc
+        return {'user_indptr': csr.indptr, 'user_indices': csr.indices, 'user_data': csr.data,
+                'item_indptr': csc.indptr, 'item_indices': csc.indices, 'item_data': csc.data}
+
+    def _als_epoch(self, pool, memory_budget):
+        self.user_factors, self.user_biases = self._als_step(pool, 'user', self.item_factors, self.item_biases,
+                                                             memory_budget)
+        self.item_factors, self.item_biases = self._als_step(pool, 'item', self.user_factors, self.user_biases,
+                                                             memory_budget)
+
+    def _als_step(self, pool, side, other_factors, other_biases, memory_budget, rows=None):
+        """
+        Solve the regularised least squares problem of every user or every item, holding the other side fixed.
+        The rows are split into contiguous parts solved by the pool's workers, which share the ratings.
+        :param pool: The WorkerPool sharing the ratings from _als_inputs
+        :param side: <'user', 'item'> The side to solve
+        :param rows: Optional sorted positions of the only rows to solve
+        :return: The new (factors, biases) of the rows
+        """
+        if rows is None:
+            rows = np.arange(len(pool.shared[side + '_indptr']) - 1)
+        max_entries = max(1, memory_budget // ((self.n_factors + 1) ** 2 * self.dtype.itemsize))
+        tasks = [(side, rows[start:end], other_factors, other_biases, self.global_mean, self.reg, max_entries)
+                 for start, end in partition(len(rows), 2 * pool.n_jobs if pool.n_jobs > 1 else 1)]
+        solution = np.zeros((0, self.n_factors + 1), dtype=self.dtype)
+        if tasks:
+            solution = np.vstack(list(pool.map(_solve_rows, tasks)))
+        return solution[:, :self.n_factors], solution[:, self.n_factors]
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Add a batch of new or changed ratings without refitting.
+        The global mean is refreshed from the updated statistics, new users and items start with zero factors
+        and biases, then the users and then the items in the batch are re-solved with one alternating
+        least squares step restricted to them.
+        :param user_ids: The user id of each rating, new users are added
+        :param item_ids: The item id of each rating, new items are added
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        :param memory_budget: The number of bytes the per rating outer products of a solve may use
+        """
+        n_users, n_items = self.ratings.shape
+        rows, cols = self.ratings.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+        self.global_mean = float(self.statistics.global_mean)
+        new_users, new_items = self.ratings.shape[0] - n_users, self.ratings.shape[1] - n_items
+        self.user_factors = np.vstack((self.user_factors, np.zeros((new_users, self.n_factors), dtype=self.dtype)))
+        self.item_factors = np.vstack((self.item_factors, np.zeros((new_items, self.n_factors), dtype=self.dtype)))
+        self.user_biases = np.concatenate((self.user_biases, np.zeros(new_users, dtype=self.dtype)))
+        self.item_biases = np.concatenate((self.item_biases, np.zeros(new_items, dtype=self.dtype)))
+
+        users, items = np.unique(rows), np.unique(cols)
+        with WorkerPool(1, self._als_inputs()) as pool:
+            self.user_factors[users], self.user_biases[users] = self._als_step(
+                pool, 'user', self.item_factors, self.item_biases, memory_budget, rows=users)
+            self.item_factors[items], self.item_biases[items] = self._als_step(
+                pool, 'item', self.user_factors, self.user_biases, memory_budget, rows=items)
+
+    def _sgd_epoch(self, learning_rate, batch_size):
+        users = self.ratings.user_rows()
+        items = self.ratings.csr.indices
+        values = self.ratings.csr.data.astype(self.dtype)
+        order = self.random.permutation(len(values))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            batch_users, batch_items = users[batch], items[batch]
+            user_vectors = self.user_factors[batch_users]
+            item_vectors = self.item_factors[batch_items]
+            errors = values[batch] - self._predict_pairs(batch_users, batch_items)
+
+            user_gradients = errors[:, np.newaxis] * item_vectors - self.reg * user_vectors
+            item_gradients = errors[:, np.newaxis] * user_vectors - self.reg * item_vectors
+            np.add.at(self.user_factors, batch_users, learning_rate * user_gradients)
+            np.add.at(self.item_factors, batch_items, learning_rate * item_gradients)
+            np.add.at(self.user_biases, batch_users,
+                      learning_rate * (errors - self.reg * self.user_biases[batch_users]))
+            np.add.at(self.item_biases, batch_items,
+                      learning_rate * (errors - self.reg * self.item_biases[batch_items]))
+
+    def _predict_pairs(self, users, items):
+        return (self.global_mean + self.user_biases[users] + self.item_biases[items]
+                + np.einsum('ij,ij->i', self.user_factors[users], self.item_factors[items]))
+
+    def predict_ratings(self, ratings):
+        """
+        Predict only at the known ratings of another ratings matrix over the same users and items
+        :param ratings: The RatingsMatrix whose pattern of known ratings to predict
+        :return: A RatingsMatrix of predictions with the same pattern
+        """
+        predicted_values = self._predict_pairs(ratings.user_rows(), ratings.csr.indices)
+        return ratings.with_data(clamp(predicted_values, *self.rating_scale, copy=False))
+
+    def predict(self):
+        """
+        Create the full predictions matrix
+        :return: The predictions DataFrame
+        """
+        predictions_values = self.user_factors.dot(self.item_factors.T)
+        predictions_values += self.global_mean + self.user_biases[:, np.newaxis] + self.item_biases
+        return pd.DataFrame(clamp(predictions_values, *self.rating_scale, copy=False),
+                            index=self.ratings.user_ids, columns=self.ratings.item_ids)
+
+    def score_user(self, user):
+        """
+        Predict the ratings of one user for every item
+        :param user: The row position of the user
+        :return: An array of predicted ratings, one per item
+        """
+        predicted_values = self.item_factors.dot(self.user_factors[user])
+        predicted_values += self.global_mean + self.user_biases[user] + self.item_biases
+        return clamp(predicted_values, *self.rating_scale, copy=False)
+
+    def score_users(self, users):
+        """
+        Predict the ratings of a chunk of users for every item
+        :param users: The row positions of the users
+        :return: A len(users) x n_items array of predicted ratings
+        """
+        predicted_values = self.user_factors[users].dot(self.item_factors.T)
+        predicted_values += self.global_mean + self.user_biases[users, np.newaxis] + self.item_biases
+        return clamp(predicted_values, *self.rating_scale, copy=False)
+
+    def save(self, path):
+        """
+        Save the model as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        self.ratings.save(os.path.join(path, 'ratings'))
+        save_arrays(path, {'user_factors': self.user_factors, 'item_factors': self.item_factors,
+                           'user_biases': self.user_biases, 'item_biases': self.item_biases},
+                    {'model': type(self).__name__, 'dtype': self.dtype.name, 'n_factors': self.n_factors,
+                     'reg': self.reg, 'method': self.method, 'global_mean': self.global_mean,
+                     'history': self.history})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a model saved with save. The ratings and factors are memory-mapped read only by default,
+        load with mmap_mode='c' or None to train the loaded model further.
+        :param path: The directory the model was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The LatentFactorModel, training in this process
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        model = cls.__new__(cls)
+        model.ratings = RatingsMatrix.load(os.path.join(path, 'ratings'), mmap_mode=mmap_mode)
+        model.n_factors = manifest['n_factors']
+        model.reg = manifest['reg']
+        model.method = manifest['method']
+        model.random = np.random.RandomState()
+        model.dtype = np.dtype(manifest['dtype'])
+        model.n_jobs = 1
+        model.global_mean = manifest['global_mean']
+        model.user_factors, model.item_factors = arrays['user_factors'], arrays['item_factors']
+        model.user_biases, model.item_biases = arrays['user_biases'], arrays['item_biases']
+        model.history = manifest['history']
+        return model
+
+
+def solve_rows(indptr, indices, data, other_factors, other_biases, global_mean, reg, rows, max_entries=2 ** 14):
+    """
+    Solve the regularised least squares problem of some rows of a sparse ratings matrix, holding the other side fixed.
+    Each row's factors and bias are solved together against the other side's factors extended with a 1.
+    Rows are solved in chunks of about max_entries ratings with solve_weighted_rows.
+    :param indptr: The index pointers of the compressed ratings, rows being users or items
+    :param indices: The column positions of the compressed ratings
+    :param data: The ratings
+    :param other_factors: The factors of the columns
+    :param other_biases: The biases of the columns
+    :param global_mean: The mean of all ratings
+    :param reg: The L2 regularisation of the factors and biases
+    :param rows: The positions of the rows to solve
+    :param max_entries: The number of ratings whose outer products are formed at once
+    :return: A len(rows) x (n_factors + 1) array of the factors followed by the bias of each row,
+        in the float type of other_factors
+    """
+    dtype = other_factors.dtype
+    extended = np.hstack((other_factors, np.ones((other_factors.shape[0], 1), dtype=dtype)))
+
+    def weigh(entries):
+        return np.ones(len(entries), dtype=dtype), (data[entries] - global_mean - other_biases[indices[entries]])
+    return solve_weighted_rows(indptr, indices, extended, reg * np.eye(extended.shape[1], dtype=dtype), rows, weigh,
+                               max_entries)
+
+
+def solve_weighted_rows(indptr, indices, vectors, base, rows, weigh, max_entries=2 ** 14):
+    """
+    Solve (base + sum over entries of w v v^T) x = sum over entries of t v for some rows of a sparse matrix,
+    with v the vector of each entry's column and w, t the weights of the entry.
+    Rows are solved in chunks of about max_entries entries, whose outer products are formed at once
+    and summed per row with a sparse product, then solved together.
+    :param indptr: The index pointers of the compressed matrix
+    :param indices: The column positions of the compressed entries
+    :param vectors: The vector of each column
+    :param base: The matrix every row's system starts from
+    :param rows: The positions of the rows to solve
+    :param weigh: A function of the positions of some entries returning (w, t), their outer product
+        and target weights
+    :param max_entries: The number of entries whose outer products are formed at once
+    :return: A len(rows) x vectors.shape[1] array of the solution of each row, in the float type of vectors.
+        Rows without entries get zeros
+    """
+    dtype = vectors.dtype
+    n_columns = vectors.shape[1]
+    solution = np.zeros((len(rows), n_columns), dtype=dtype)
+    positions = np.flatnonzero(np.diff(indptr)[rows] > 0)
+    if not len(positions):
+        return solution
+    ends = np.cumsum(np.diff(indptr)[rows[positions]])
+    cuts = np.searchsorted(ends, np.arange(max_entries, ends[-1], max_entries), side='right')
+    cuts = np.unique(np.concatenate(([0], cuts, [len(positions)])))
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        chunk = positions[start:end]
+        lengths = np.diff(indptr)[rows[chunk]]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        entries = np.repeat(indptr[rows[chunk]] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        entry_vectors = vectors[indices[entries]]
+        outer_weights, target_weights = weigh(entries)
+        # Sum the weighted outer products and vectors of each row's entries with a sparse product
+        segments = sp.csr_matrix((np.asarray(outer_weights, dtype=dtype), np.arange(len(entries)), offsets),
+                                 shape=(len(chunk), len(entries)))
+        outer = segments.dot((entry_vectors[:, :, np.newaxis] * entry_vectors[:, np.newaxis, :])
+                             .reshape(len(entries), -1))
+        segments.data = np.asarray(target_weights, dtype=dtype)
+        moments = segments.dot(entry_vectors)
+        outer = outer.reshape(len(chunk), n_columns, n_columns)
+        solution[chunk] = np.linalg.solve(base + outer, moments[:, :, np.newaxis])[:, :, 0]
+    return solution
+
+
+def _solve_rows(shared, side, rows, other_factors, other_biases, global_mean, reg, max_entries):
+    return solve_rows(shared[side + '_indptr'], shared[side + '_indices'], shared[side + '_data'], other_factors,
+                      other_biases, global_mean, reg, rows, max_entries)
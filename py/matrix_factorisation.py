@@ -1,65 +1,314 @@
+import os
+
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
 
-from aux import clamp
-
+from ann import InvertedFileIndex
+from extras import clamp
+from persistence import load_arrays, save_arrays
+from profiling import profiled, stage
+from rating_statistics import get_biases
+from ratings import RatingsMatrix, as_ratings_matrix
+from recommender import Recommender
 
-class MatrixFactorisation(object):
 
-    def __init__(self, ratings):
-        self.user_means = self.calculate_user_means(ratings)
-        self.user_std_devs = self.calculate_user_std_devs(ratings)
-        self.ratings = self.adjust_ratings(ratings)
-        self.U, self.eps, self.T = np.linalg.svd(self.ratings.values, full_matrices=False)
+class MatrixFactorisation(Recommender):
 
-    @staticmethod
-    def calculate_user_means(ratings):
+    @profiled('MatrixFactorisation.fit')
+    def __init__(self, ratings, rank=-1, solver='randomized', n_iter=4, random_state=None, dtype=np.float64,
+                 adjust='full'):
         """
-        Calculate the user means of the ratings matrix
-        :param ratings: The ratings DataFrame
-        :type ratings: DataFrame
-        :return: A DataFrame indexed on user_id with one column mean with the user means
+        :param ratings: The user x item ratings. Ratings on 1 to 5 scale. 0 represents unknown in a DataFrame.
+        :type ratings: RatingsMatrix or DataFrame
+        :param rank: The number of factors to compute, -1 for a full dense decomposition
+        :param solver: <'randomized', 'arpack'> The truncated solver used when rank is set.
+            Both work directly on the sparse adjusted ratings.
+        :param n_iter: The number of power iterations for the randomized solver
+        :param random_state: Seed for the randomized solver
+        :param dtype: The float type of the adjusted ratings and the factors. float32 halves their memory
+        :param adjust: <'full', 'baseline'> The residuals that are factorised, the ratings adjusted for user means
+            and standard deviations or for the regularised bias baseline
         """
-        ratings = ratings.replace(0, np.nan)
-        means = pd.DataFrame(ratings.mean(axis=1), index=ratings.index, columns=['mean']).fillna(value=0)
-        return means
+        if adjust not in ('full', 'baseline'):
+            raise KeyError(adjust+' is not an implemented adjustment.')
+        self.known_ratings = as_ratings_matrix(ratings)
+        self.dtype = np.dtype(dtype)
+        self.adjust = adjust
+        self.user_means = self.calculate_user_means(self.known_ratings).astype(self.dtype)
+        self.user_std_devs = self.calculate_user_std_devs(self.known_ratings).astype(self.dtype)
+        self.ratings = self.adjust_ratings(self.known_ratings)
+        with stage('MatrixFactorisation.svd') as current:
+            if rank == -1:
+                self.U, self.eps, self.T = np.linalg.svd(self.ratings.csr.toarray(), full_matrices=False)
+            elif solver == 'randomized':
+                self.U, self.eps, self.T = randomized_svd(self.ratings.csr, rank, n_iter=n_iter,
+                                                          random_state=random_state)
+            elif solver == 'arpack':
+                self.U, self.eps, self.T = arpack_svd(self.ratings.csr, rank)
+            else:
+                raise KeyError(solver+' is not an implemented solver.')
+            current.record(U=self.U, T=self.T)
+        self.ann_index = None
+        self.ann_rank = None
 
-    @staticmethod
-    def calculate_user_std_devs(ratings):
+    @property
+    def biases(self):
         """
-        Calculate the user standard deviations in the user x item DataFrame
-        :param ratings: the ratings DataFrame
-        :type ratings: DataFrame
-        :return: A DataFrame indexed on user_id with one column std with the user standard deviations
+        The global mean, user biases and item biases of the regularised bias baseline used by adjust='baseline'
         """
-        ratings = ratings.replace(0, np.nan)
-        std_devs = pd.DataFrame(ratings.std(axis=1), index=ratings.index, columns=['std']).fillna(value=0)
-        return std_devs
+        global_mean, user_biases, item_biases = get_biases(self.known_ratings)
+        return global_mean, user_biases.astype(self.dtype), item_biases.astype(self.dtype)
 
+    @profiled('MatrixFactorisation.adjust_ratings')
     def adjust_ratings(self, ratings):
         """
-        Adjust the ratings matrix from a 1-5 ratings scale to a -1 to 1 scale indicating user preference
+        Adjust the ratings matrix from a 1-5 ratings scale to a -1 to 1 scale indicating user preference,
+        or to the residuals of the bias baseline.
+        Only the known ratings are adjusted, unknown ratings stay 0.
+        :param ratings: The ratings
+        :type ratings: RatingsMatrix
+        :return: The adjusted RatingsMatrix
         """
-        adjusted_ratings_values = ratings.values - self.user_means.values
-        adjusted_ratings_values = adjusted_ratings_values / self.user_std_devs.values
-        adjusted_ratings = pd.DataFrame(adjusted_ratings_values, index=ratings.index, columns=ratings.columns)
-        adjusted_ratings.fillna(value=0)
-        return adjusted_ratings
+        rows = ratings.user_rows()
+        if self.adjust == 'baseline':
+            global_mean, user_biases, item_biases = get_biases(self.known_ratings)
+            adjusted_values = ratings.csr.data - global_mean - user_biases[rows] - item_biases[ratings.csr.indices]
+            return ratings.with_data(adjusted_values.astype(self.dtype))
+        std_devs = self.user_std_devs.values[rows, 0]
+        adjusted_values = ratings.csr.data - self.user_means.values[rows, 0]
+        adjusted_values = np.divide(adjusted_values, std_devs, out=np.zeros(len(adjusted_values)),
+                                    where=std_devs > 0)
+        return ratings.with_data(adjusted_values.astype(self.dtype))
 
+    @profiled('MatrixFactorisation.predict')
     def predict(self, k=-1):
         """
         Create the predictions matrix. Optionally for reduced rank k
         :param k: rank of matrix U and T to consider
         :return: The predictions DataFrame
         """
+        if k > len(self.eps):
+            raise ValueError('Only {0} factors were computed.'.format(len(self.eps)))
         U_k = self.U
         T_k = self.T
         if k != -1:
             U_k = U_k[:, :k]
             T_k = T_k[:k, :]
 
-        predictions_values = U_k.dot(T_k)
-        predictions_values * self.user_std_devs.values + self.user_means.values
-        predictions = pd.DataFrame(predictions_values, index=self.ratings.index, columns=self.ratings.columns)
-        predictions = predictions.applymap(clamp)
-        return predictions
+        with stage('MatrixFactorisation.dot_product') as current:
+            predictions_values = (U_k * self.eps[:U_k.shape[1]]).dot(T_k)
+            current.record(predictions=predictions_values)
+        predictions_values = self._restore_predictions(predictions_values, slice(None))
+        return pd.DataFrame(predictions_values, index=self.ratings.user_ids, columns=self.ratings.item_ids)
+
+    @profiled('MatrixFactorisation.score_user')
+    def score_user(self, user, k=-1):
+        """
+        Predict the ratings of one user for every item from the user's factors only
+        :param user: The row position of the user
+        :param k: rank of matrix U and T to consider
+        :return: An array of predicted ratings, one per item
+        """
+        if k == -1:
+            k = len(self.eps)
+        return self._restore_predictions((self.U[user, :k] * self.eps[:k]).dot(self.T[:k, :]), user)
+
+    @profiled('MatrixFactorisation.score_users')
+    def score_users(self, users, k=-1):
+        """
+        Predict the ratings of a chunk of users for every item from their factors only
+        :param users: The row positions of the users
+        :param k: rank of matrix U and T to consider
+        :return: A len(users) x n_items array of predicted ratings
+        """
+        if k == -1:
+            k = len(self.eps)
+        return self._restore_predictions((self.U[users, :k] * self.eps[:k]).dot(self.T[:k, :]), users)
+
+    @profiled('MatrixFactorisation.restore_predictions')
+    def _restore_predictions(self, predicted_values, users):
+        """
+        Move predicted adjusted ratings of one user, or of a set of users, back to the ratings scale
+        """
+        if self.adjust == 'baseline':
+            global_mean, user_biases, item_biases = self.biases
+            predicted_values += (global_mean + user_biases[users])[..., np.newaxis] + item_biases
+        else:
+            predicted_values *= self.user_std_devs.values[users]
+            predicted_values += self.user_means.values[users]
+        return clamp(predicted_values, *self.rating_scale, copy=False)
+
+    @profiled('MatrixFactorisation.build_ann_index')
+    def build_ann_index(self, k=-1, n_lists=None, n_probe=None, n_iter=10, random_state=None):
+        """
+        Build the approximate nearest neighbour index over the item factors used by recommend.
+        A user's predicted ratings are an increasing function of the inner product of the scaled user factors
+        with the item factors, so the top items are found by a maximum inner product search.
+        With the baseline adjustment the item biases are added to the item factors as one more dimension.
+        :param k: rank of matrix U and T to consider
+        :param n_lists: The number of inverted lists, as for InvertedFileIndex.build
+        :param n_probe: The default number of lists to probe, trading recall for latency
+        :param n_iter: The number of k-means iterations
+        :param random_state: Seed for the clustering
+        :return: The InvertedFileIndex, also kept as ann_index
+        """
+        if k == -1:
+            k = len(self.eps)
+        vectors = self.T[:k, :].T
+        if self.adjust == 'baseline':
+            vectors = np.hstack((vectors, self.biases[2][:, np.newaxis]))
+        self.ann_index = InvertedFileIndex.build(vectors, n_lists=n_lists, n_probe=n_probe, n_iter=n_iter,
+                                                 random_state=random_state)
+        self.ann_rank = k
+        return self.ann_index
+
+    @profiled('MatrixFactorisation.recommend')
+    def recommend(self, user_id, n=10, exclude_rated=True, k=-1, n_probe=None):
+        """
+        Recommend the n items with the highest predicted rating for one user.
+        When an ANN index was built for rank k only the items in its probed lists are scored.
+        :param user_id: The user id
+        :param n: The number of items to recommend
+        :param exclude_rated: Whether to leave out the items the user has already rated
+        :param k: rank of matrix U and T to consider
+        :param n_probe: The number of index lists to probe, defaults to the index's n_probe
+        :return: A Series of predicted ratings indexed on item_id, highest first
+        """
+        if k == -1:
+            k = len(self.eps)
+        if self.ann_index is None or self.ann_rank != k:
+            return super(MatrixFactorisation, self).recommend(user_id, n=n, exclude_rated=exclude_rated, k=k)
+
+        user = self.ratings.user_index(user_id)
+        exclude = self.ratings.user_ratings(user)[0] if exclude_rated else None
+        query = self.U[user, :k] * self.eps[:k]
+        if self.adjust == 'baseline':
+            query = np.append(query, 1.)
+        items, products = self.ann_index.search(query, n, n_probe=n_probe, exclude=exclude)
+        if self.adjust == 'baseline':
+            global_mean, user_biases, _ = self.biases
+            scores = products + global_mean + user_biases[user]
+        else:
+            scores = products * self.user_std_devs.values[user, 0] + self.user_means.values[user, 0]
+        return pd.Series(clamp(scores, *self.rating_scale, copy=False), index=self.ratings.item_ids[items],
+                         name='score')
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None):
+        """
+        Add a batch of new or changed ratings without refactorising.
+        The factors of every user in the batch are refolded by projecting their adjusted ratings
+        onto the existing item factors. New items get zero factors, so they are predicted at the user mean,
+        or at the bias baseline, until the model is refit. The ANN index is dropped and has to be rebuilt.
+        :param user_ids: The user id of each rating, new users are added
+        :param item_ids: The item id of each rating, new items are added
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        :return: The positions of the users that were refolded
+        """
+        self.ann_index = self.ann_rank = None
+        n_users, n_items = self.known_ratings.shape
+        rows, _ = self.known_ratings.add_ratings(user_ids, item_ids, ratings, timestamps=timestamps)
+        self.user_means = self.calculate_user_means(self.known_ratings).astype(self.dtype)
+        self.user_std_devs = self.calculate_user_std_devs(self.known_ratings).astype(self.dtype)
+        self.ratings = self.adjust_ratings(self.known_ratings)
+
+        new_users, new_items = self.ratings.shape[0] - n_users, self.ratings.shape[1] - n_items
+        self.U = np.vstack((self.U, np.zeros((new_users, self.U.shape[1]), dtype=self.U.dtype)))
+        self.T = np.hstack((self.T, np.zeros((self.T.shape[0], new_items), dtype=self.T.dtype)))
+
+        users = np.unique(rows)
+        projected = np.asarray(self.ratings.csr[users].dot(self.T.T))
+        self.U[users] = np.divide(projected, self.eps, out=np.zeros_like(projected), where=self.eps > 0)
+        return users
+
+    def fold_in(self, user_id, ratings):
+        """
+        Add a new user by projecting their ratings onto the existing item factors, without refactorising.
+        :param user_id: The id of the new user
+        :param ratings: The ratings of the new user
+        :type ratings: Series indexed on item_id
+        :return: The factors of the new user
+        """
+        self.add_ratings(np.repeat(np.asarray([user_id], dtype=object), len(ratings)), ratings.index.values,
+                         ratings.values)
+        return self.U[self.ratings.user_index(user_id)]
+
+    def save(self, path):
+        """
+        Save the model as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        self.known_ratings.save(os.path.join(path, 'ratings'))
+        if self.ann_index is not None:
+            self.ann_index.save(os.path.join(path, 'ann_index'))
+        save_arrays(path, {'U': self.U, 'eps': self.eps, 'T': self.T, 'adjusted': self.ratings.csr.data},
+                    {'model': type(self).__name__, 'dtype': self.dtype.name, 'adjust': self.adjust,
+                     'ann_rank': self.ann_rank})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a model saved with save without refactorising. The ratings and factors are memory-mapped by default,
+        so processes loading the same directory share one page cached copy.
+        :param path: The directory the model was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The MatrixFactorisation model
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        model = cls.__new__(cls)
+        model.known_ratings = RatingsMatrix.load(os.path.join(path, 'ratings'), mmap_mode=mmap_mode)
+        model.dtype = np.dtype(manifest['dtype'])
+        model.adjust = manifest['adjust']
+        model.user_means = model.calculate_user_means(model.known_ratings).astype(model.dtype)
+        model.user_std_devs = model.calculate_user_std_devs(model.known_ratings).astype(model.dtype)
+        known = model.known_ratings.csr
+        model.ratings = RatingsMatrix(sp.csr_matrix((arrays['adjusted'], known.indices, known.indptr),
+                                                    shape=known.shape, copy=False),
+                                      user_ids=model.known_ratings.user_ids, item_ids=model.known_ratings.item_ids)
+        model.U, model.eps, model.T = arrays['U'], arrays['eps'], arrays['T']
+        model.ann_rank = manifest['ann_rank']
+        model.ann_index = None
+        if model.ann_rank is not None:
+            model.ann_index = InvertedFileIndex.load(os.path.join(path, 'ann_index'), mmap_mode=mmap_mode)
+        return model
+
+
+def randomized_svd(matrix, k, n_oversamples=10, n_iter=4, random_state=None):
+    """
+    Approximate the top k singular triplets of a sparse matrix with a randomized range finder.
+    Only products of the sparse matrix with thin dense matrices are taken.
+    :param matrix: A scipy sparse matrix
+    :param k: The number of singular values
+    :param n_oversamples: Extra random directions for a more accurate range
+    :param n_iter: The number of power iterations
+    :param random_state: Seed for the random directions
+    :return: (U, eps, T) as from np.linalg.svd, truncated to k
+    """
+    random = np.random.RandomState(random_state)
+    n_components = min(k + n_oversamples, min(matrix.shape))
+    Q = matrix.dot(random.normal(size=(matrix.shape[1], n_components)).astype(matrix.dtype))
+    Q, _ = np.linalg.qr(Q)
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(matrix.T.dot(Q))
+        Q, _ = np.linalg.qr(matrix.dot(Q))
+
+    B = np.asarray(matrix.T.dot(Q)).T
+    U_B, eps, T = np.linalg.svd(B, full_matrices=False)
+    U = Q.dot(U_B)
+    return U[:, :k], eps[:k], T[:k, :]
+
+
+def arpack_svd(matrix, k):
+    """
+    The top k singular triplets of a sparse matrix with ARPACK
+    :param matrix: A scipy sparse matrix
+    :param k: The number of singular values, less than the smallest dimension of matrix
+    :return: (U, eps, T) as from np.linalg.svd, truncated to k
+    """
+    if not np.issubdtype(matrix.dtype, np.floating):
+        matrix = matrix.astype(np.float64)
+    U, eps, T = svds(matrix, k=k)
+    order = np.argsort(eps)[::-1]
+    return U[:, order], eps[order], T[order, :]
@@ -0,0 +1,130 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from persistence import load_arrays, save_arrays
+
+
+class FeatureMatrix(object):
+    """
+    Binary features of a set of users or items, one sparse row per id and one column per named feature
+    such as 'genre=Comedy' or 'age=25'.
+    """
+
+    def __init__(self, ids, matrix, names):
+        """
+        :param ids: The user or item id of each row
+        :param matrix: The ids x features scipy sparse matrix, 1 where an id has a feature
+        :param names: The name of each feature
+        """
+        self.ids = np.asarray(ids)
+        self.matrix = sp.csr_matrix(matrix, dtype=np.float32)
+        self.names = [str(name) for name in names]
+        self._lookup = None
+
+    @classmethod
+    def from_lists(cls, ids, features):
+        """
+        Encode the named features of each id
+        :param ids: The ids
+        :param features: A list, per id, of its feature names
+        :return: The FeatureMatrix, with the feature names sorted
+        """
+        lengths = np.asarray([len(row) for row in features], dtype=np.int64)
+        names, columns = np.unique(np.asarray([name for row in features for name in row], dtype=object).astype(str),
+                                   return_inverse=True)
+        matrix = sp.csr_matrix((np.ones(len(columns), dtype=np.float32), columns.ravel(),
+                                np.concatenate(([0], np.cumsum(lengths)))), shape=(len(ids), len(names)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return cls(ids, matrix, names)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def align(self, ids):
+        """
+        The feature rows of some ids, ids without metadata get an empty row
+        :param ids: The user or item ids, for example ratings.user_ids
+        :return: A len(ids) x features sparse matrix
+        """
+        if self._lookup is None:
+            self._lookup = pd.Index(self.ids)
+        rows = self._lookup.get_indexer(np.asarray(ids))
+        known = np.flatnonzero(rows >= 0)
+        selection = sp.csr_matrix((np.ones(len(known), dtype=np.float32), (known, rows[known])),
+                                  shape=(len(rows), self.matrix.shape[0]))
+        return selection.dot(self.matrix).tocsr()
+
+    def save(self, path):
+        """
+        Save the features as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        save_arrays(path, {'ids': self.ids, 'indices': self.matrix.indices, 'indptr': self.matrix.indptr},
+                    {'names': self.names})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        :param path: The directory the features were saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The FeatureMatrix
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        indices = arrays['indices']
+        matrix = sp.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, arrays['indptr']),
+                               shape=(len(arrays['ids']), len(manifest['names'])))
+        return cls(arrays['ids'], matrix, manifest['names'])
+
+    def __repr__(self):
+        return '<FeatureMatrix of {0} ids x {1} features>'.format(*self.shape)
+
+
+def _read_table(file_path, sep, n_columns):
+    with open(file_path, encoding='latin-1') as table_file:
+        rows = [line.rstrip('\r\n').split(sep) for line in table_file if line.strip()]
+    for row in rows:
+        if len(row) != n_columns:
+            raise ValueError('Expected {0} fields in {1}: {2}'.format(n_columns, os.path.basename(file_path),
+                                                                   sep.join(row)))
+    return rows
+
+
+def read_users(file_path, sep='::'):
+    """
+    Reads the user demographics, each line in the form <user_id><sep><gender><sep><age><sep><occupation><sep><zip>.
+    Each user gets a gender, an age group, an occupation and a region, the first digit of the zip code.
+    :param file_path: The users file path, as ML-1M users.dat
+    :param sep: The separator between fields
+    :return: The user FeatureMatrix
+    """
+    rows = _read_table(file_path, sep, 5)
+    user_ids = np.asarray([int(row[0]) for row in rows], dtype=np.int32)
+    features = [['gender=' + gender, 'age=' + age, 'occupation=' + occupation, 'region=' + zip_code[:1]]
+                for _, gender, age, occupation, zip_code in rows]
+    return FeatureMatrix.from_lists(user_ids, features)
+
+
+def read_movies(file_path, sep='::'):
+    """
+    Reads the movie metadata, each line in the form <item_id><sep><title (year)><sep><genre>|<genre>...
+    Each movie gets its genres and the decade of its release year.
+    :param file_path: The movies file path, as ML-1M movies.dat
+    :param sep: The separator between fields
+    :return: The item FeatureMatrix
+    """
+    rows = _read_table(file_path, sep, 3)
+    item_ids = np.asarray([int(row[0]) for row in rows], dtype=np.int32)
+    features = []
+    for _, title, genres in rows:
+        row = ['genre=' + genre for genre in genres.split('|') if genre]
+        year = re.search(r'\((\d{4})\)\s*$', title)
+        if year:
+            row.append('decade={0}'.format(int(year.group(1)) // 10 * 10))
+        features.append(row)
+    return FeatureMatrix.from_lists(item_ids, features)
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from persistence import load_arrays, save_arrays
+
+
+class NeighbourGraph(object):
+    """
+    The k nearest neighbours of each row as a sparse graph.
+    Row r has the neighbours indices[r, :] with similarity weights[r, :], sorted by decreasing weight.
+    Rows with fewer than k neighbours are padded with weight 0.
+    """
+
+    def __init__(self, indices, weights, n_columns=None):
+        """
+        :param indices: n_rows x k array of neighbour positions
+        :param weights: n_rows x k array of neighbour similarities
+        :param n_columns: The number of possible neighbours. Defaults to n_rows
+        """
+        self.indices = indices
+        self.weights = weights
+        if n_columns is None:
+            n_columns = indices.shape[0]
+        self.n_columns = n_columns
+
+    @property
+    def shape(self):
+        return self.indices.shape
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    def neighbours(self, row):
+        """
+        :param row: The row position
+        :return: (neighbour positions, weights) with the padding removed
+        """
+        weights = self.weights[row]
+        keep = weights != 0
+        return self.indices[row][keep], weights[keep]
+
+    def to_sparse(self):
+        """
+        :return: The graph as an n_rows x n_columns scipy CSR matrix of similarity weights
+        """
+        n_rows, k = self.indices.shape
+        indptr = np.arange(0, n_rows * k + 1, k)
+        weights = np.array(self.weights, dtype=np.float32 if self.weights.dtype == np.float16 else None)
+        matrix = sp.csr_matrix((weights.ravel(), np.array(self.indices).ravel(), indptr),
+                               shape=(n_rows, self.n_columns))
+        matrix.eliminate_zeros()
+        matrix.sum_duplicates()
+        return matrix
+
+    def save(self, path):
+        """
+        Save the graph as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        save_arrays(path, {'indices': self.indices, 'weights': self.weights}, {'n_columns': int(self.n_columns)})
+
+    @classmethod
+    def load(cls, path, n_columns=None, mmap_mode='r'):
+        """
+        Load a graph saved with save. By default the arrays are memory-mapped rather than read.
+        :param path: The directory the graph was saved to
+        :param n_columns: The number of possible neighbours. Defaults to the number saved with the graph
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The NeighbourGraph
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        if n_columns is None:
+            n_columns = manifest['n_columns']
+        return cls(arrays['indices'], arrays['weights'], n_columns=n_columns)
+
+
+def select_top_k(block, k, row_offset=0, exclude_self=True):
+    """
+    Select the k largest values of each row of a dense block with a partial sort.
+    :param block: A dense rows x columns array of similarities
+    :param k: The number of neighbours to keep
+    :param row_offset: The position of the first row of the block, used to find self similarities
+    :param exclude_self: Whether to drop the similarity of each row with itself
+    :return: (indices, weights) both rows x k, sorted by decreasing weight. The weights keep a float block's type
+    """
+    block = np.array(block)
+    if not np.issubdtype(block.dtype, np.floating):
+        block = block.astype(np.float64)
+    n_rows, n_columns = block.shape
+    if exclude_self:
+        rows = np.arange(n_rows)
+        columns = rows + row_offset
+        in_block = columns < n_columns
+        block[rows[in_block], columns[in_block]] = -np.inf
+    block[np.isnan(block)] = -np.inf
+
+    k = min(k, n_columns)
+    if k < n_columns:
+        indices = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.tile(np.arange(n_columns), (n_rows, 1))
+    weights = np.take_along_axis(block, indices, axis=1)
+    order = np.argsort(-weights, axis=1, kind='stable')
+    indices = np.take_along_axis(indices, order, axis=1)
+    weights = np.take_along_axis(weights, order, axis=1)
+    weights[np.isinf(weights)] = 0
+    return indices, weights
+
+
+def top_k_neighbours(similarity, k, exclude_self=True, block_size=1024):
+    """
+    Build the k nearest neighbour graph of a similarity matrix, a block of rows at a time.
+    :param similarity: The rows x columns similarity, a DataFrame, array or scipy sparse matrix
+    :param k: The number of neighbours to keep for each row
+    :param exclude_self: Whether row i may not be a neighbour of itself
+    :param block_size: The number of rows to select from at a time
+    :return: The NeighbourGraph
+    """
+    if isinstance(similarity, pd.DataFrame):
+        similarity = similarity.values
+    n_rows, n_columns = similarity.shape
+    if exclude_self:
+        k = min(k, n_columns - 1)
+    else:
+        k = min(k, n_columns)
+
+    indices = np.empty((n_rows, k), dtype=np.int32)
+    weights = np.empty((n_rows, k), dtype=np.float64)
+    for start in range(0, n_rows, block_size):
+        end = min(start + block_size, n_rows)
+        block = similarity[start:end]
+        if sp.issparse(block):
+            block = block.toarray()
+        indices[start:end], weights[start:end] = select_top_k(block, k, row_offset=start,
+                                                              exclude_self=exclude_self)
+    return NeighbourGraph(indices, weights, n_columns=n_columns)
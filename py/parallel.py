@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from persistence import load_arrays, save_arrays
+
+SHARED_MEMORY_PATH = '/dev/shm'
+
+_attached = {}
+
+
+def n_workers(n_jobs):
+    """
+    :param n_jobs: The number of worker processes, None for one per CPU
+    :return: The number of worker processes
+    """
+    if n_jobs is None:
+        return os.cpu_count() or 1
+    return max(1, n_jobs)
+
+
+def partition(n, n_parts):
+    """
+    Split range(n) into at most n_parts contiguous parts of nearly equal size
+    :return: A list of (start, end)
+    """
+    bounds = np.linspace(0, n, max(1, min(n_parts, n)) + 1).astype(np.int64)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+class WorkerPool(object):
+    """
+    A pool of worker processes that share read only inputs.
+    The shared arrays, and objects with save and load methods such as the ratings and the models,
+    are written once as raw NumPy files under shared memory (/dev/shm where it exists) and memory-mapped
+    by every worker, so the inputs are never pickled and all workers read one page cached copy.
+    Tasks only carry their own small arguments. With one job the tasks run in this process on the inputs themselves.
+    """
+
+    def __init__(self, n_jobs=None, shared=None):
+        """
+        :param n_jobs: The number of worker processes, None for one per CPU and 1 to run in this process
+        :param shared: A dict of name to array, or to an object with save(path) and a load(path, mmap_mode) classmethod
+        """
+        self.n_jobs = n_workers(n_jobs)
+        self.shared = dict(shared or {})
+        self.path = None
+        self._classes = {}
+        self._executor = None
+        if self.n_jobs == 1:
+            return
+
+        self.path = tempfile.mkdtemp(prefix='worker_pool',
+                                     dir=SHARED_MEMORY_PATH if os.path.isdir(SHARED_MEMORY_PATH) else None)
+        arrays = {}
+        for name, value in self.shared.items():
+            if value is None or isinstance(value, np.ndarray):
+                arrays[name] = value
+            else:
+                value.save(os.path.join(self.path, name))
+                self._classes[name] = type(value)
+        save_arrays(self.path, arrays)
+        self._executor = ProcessPoolExecutor(max_workers=self.n_jobs)
+
+    def map(self, function, tasks):
+        """
+        Run function(shared, *task) for every task, where shared is the dict of shared inputs.
+        The function must be defined at module level so the workers can import it.
+        Results are yielded in task order, with at most two tasks per worker in flight.
+        :param function: The task function
+        :param tasks: An iterable of argument tuples
+        :return: A generator of the results
+        """
+        if self._executor is None:
+            for task in tasks:
+                yield function(self.shared, *task)
+            return
+
+        pending = deque()
+        for task in tasks:
+            pending.append(self._executor.submit(_run_task, self.path, self._classes, function, task))
+            if len(pending) >= 2 * self.n_jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        """
+        Stop the workers and remove the shared files
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _attach(path, classes):
+    """
+    Memory-map the shared inputs of a pool, once per worker process
+    """
+    if path not in _attached:
+        _attached.clear()
+        shared, _ = load_arrays(path)
+        for name, shared_class in classes.items():
+            shared[name] = shared_class.load(os.path.join(path, name))
+        _attached[path] = shared
+    return _attached[path]
+
+
+def _run_task(path, classes, function, task):
+    return function(_attach(path, classes), *task)
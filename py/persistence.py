@@ -0,0 +1,124 @@
+import json
+import os
+
+import numpy as np
+
+MODEL_FORMAT_VERSION = 2
+
+
+def save_arrays(path, arrays, manifest=None):
+    """
+    Save named arrays as raw NumPy files and a manifest in the directory path
+    :param path: The directory to save to, created if missing
+    :param arrays: A dict of array name to array, None values are skipped
+    :param manifest: Optional JSON serialisable settings to keep with the arrays
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    names, object_arrays = [], []
+    for name, array in sorted(arrays.items()):
+        if array is None:
+            continue
+        if save_array(path, name, array):
+            object_arrays.append(name)
+        names.append(name)
+    write_manifest(path, names, dict(manifest or {}, object_arrays=object_arrays))
+
+
+def save_array(path, name, array):
+    """
+    Save one array as the raw NumPy file name.npy in the directory path, never pickled.
+    Arrays of Python objects, such as mixed type ids, are saved as the JSON text of each value,
+    to be listed under object_arrays in the manifest.
+    :param path: The directory to save to, which must exist
+    :param name: The array name
+    :param array: The array
+    :return: Whether the array was saved as JSON text
+    """
+    array = np.asarray(array)
+    encode = array.dtype.hasobject
+    if encode:
+        array = np.asarray([json.dumps(value, default=_json_value) for value in array.ravel().tolist()],
+                           dtype=str).reshape(array.shape)
+    np.save(os.path.join(path, name + '.npy'), array, allow_pickle=False)
+    return encode
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('{0!r} can not be saved in an array.'.format(value))
+
+
+def _decode_objects(array):
+    values = np.empty(array.size, dtype=object)
+    values[:] = [json.loads(value) for value in array.ravel().tolist()]
+    return values.reshape(array.shape)
+
+
+def write_manifest(path, names, manifest=None):
+    """
+    Write the manifest of arrays already saved as name.npy files in the directory path
+    :param path: The directory of the arrays
+    :param names: The names of the arrays
+    :param manifest: Optional JSON serialisable settings to keep with the arrays
+    """
+    manifest = dict(manifest or {}, version=MODEL_FORMAT_VERSION, arrays=list(names))
+    with open(os.path.join(path, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def load_arrays(path, mmap_mode='r'):
+    """
+    Load arrays saved with save_arrays. Arrays are memory-mapped by default, so processes loading the same
+    directory share one page cached copy. Arrays of Python objects, such as mixed type ids, are decoded
+    into memory instead. Nothing is unpickled, so a directory can not run code when it is loaded.
+    :param path: The directory the arrays were saved to
+    :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+    :return: (dict of array name to array, the manifest)
+    """
+    manifest = read_manifest(path)
+    arrays = {}
+    object_arrays = set(manifest.get('object_arrays', []))
+    for name in manifest['arrays']:
+        file_path = os.path.join(path, name + '.npy')
+        if name in object_arrays:
+            arrays[name] = _decode_objects(np.load(file_path, allow_pickle=False))
+        else:
+            arrays[name] = np.load(file_path, mmap_mode=mmap_mode, allow_pickle=False)
+    return arrays, manifest
+
+
+def read_manifest(path):
+    """
+    :param path: A directory saved with save_arrays
+    :return: The manifest
+    """
+    with open(os.path.join(path, 'manifest.json')) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != MODEL_FORMAT_VERSION:
+        raise ValueError('Unsupported model format version {0}.'.format(manifest.get('version')))
+    return manifest
+
+
+def load_model(path, mmap_mode='r'):
+    """
+    Load any model saved with its save method
+    :param path: The directory the model was saved to
+    :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+    :return: The model
+    """
+    from baseline_predictors import BaselinePredictor
+    from collaborative_filtering import CollaborativeFiltering
+    from content_based import ContentBasedPredictor, HybridRecommender
+    from implicit import ImplicitALS
+    from latent_factors import LatentFactorModel
+    from matrix_factorisation import MatrixFactorisation
+
+    model_classes = dict((model_class.__name__, model_class) for model_class in
+                         (BaselinePredictor, CollaborativeFiltering, ContentBasedPredictor, HybridRecommender,
+                          ImplicitALS, LatentFactorModel, MatrixFactorisation))
+    model = read_manifest(path).get('model')
+    if model not in model_classes:
+        raise KeyError('{0} is not a saved model.'.format(model))
+    return model_classes[model].load(path, mmap_mode=mmap_mode)
@@ -0,0 +1,204 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+_active = None
+
+
+class Profiler(object):
+    """
+    Records the wall time, peak allocated bytes and array shapes of the named stages run while it is active.
+    The library marks its stages with stage() and profiled(). While no profiler is active they cost one global
+    lookup, so instrumentation is off by default and free to leave in the hot paths.
+
+        with Profiler() as profiler:
+            model.predict_user_user(k=50)
+        print(profiler.summary())
+        profiler.to_chrome_trace('trace.json')
+
+    Stages nest. The peak bytes of a stage are the most memory traced by tracemalloc above the level at its start,
+    including its nested stages. tracemalloc slows allocation heavy code down, so the times of a profile taken
+    with trace_memory are only comparable with each other.
+    """
+
+    def __init__(self, trace_memory=True):
+        """
+        :param trace_memory: Whether to trace the peak allocated bytes of each stage with tracemalloc
+        """
+        self.trace_memory = trace_memory
+        self.records = []
+        self._local = threading.local()
+        self._previous = None
+        self._started_tracing = False
+        self._origin = None
+
+    def start(self):
+        """
+        Make this the active profiler
+        """
+        global _active
+        self._previous, _active = _active, self
+        self._origin = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """
+        Stop recording and restore the profiler that was active before
+        """
+        global _active
+        _active, self._previous = self._previous, None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self, stage):
+        stack = self._stack
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            stage.base = stage.peak = current
+        stage.depth = len(stack)
+        stack.append(stage)
+        stage.start = time.perf_counter()
+
+    def _exit(self, stage):
+        end = time.perf_counter()
+        stack = self._stack
+        stack.pop()
+        peak_bytes = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            peak = max(stage.peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            peak_bytes = peak - stage.base
+        self.records.append({'name': stage.name, 'start': stage.start - self._origin, 'seconds': end - stage.start,
+                             'peak_bytes': peak_bytes, 'shapes': stage.shapes, 'depth': stage.depth,
+                             'thread': threading.get_ident()})
+
+    def summary(self):
+        """
+        :return: A DataFrame indexed on stage name, in order of first completion, of the number of calls,
+            the total and mean seconds and the largest peak bytes
+        """
+        records = pd.DataFrame(self.records, columns=['name', 'seconds', 'peak_bytes'])
+        return records.groupby('name', sort=False).agg(
+            calls=('seconds', 'size'), total_seconds=('seconds', 'sum'), mean_seconds=('seconds', 'mean'),
+            peak_bytes=('peak_bytes', 'max'))
+
+    def to_json(self, path):
+        """
+        Write the stage records as JSON, one object per completed stage
+        :param path: The file to write
+        """
+        with open(path, 'w') as output_file:
+            json.dump({'records': self.records}, output_file, indent=2)
+
+    def to_chrome_trace(self, path):
+        """
+        Write the stages in the Chrome trace event format, for chrome://tracing or https://ui.perfetto.dev
+        :param path: The file to write
+        """
+        events = [{'name': record['name'], 'ph': 'X', 'ts': 1e6 * record['start'], 'dur': 1e6 * record['seconds'],
+                   'pid': os.getpid(), 'tid': record['thread'],
+                   'args': dict(record['shapes'], peak_bytes=record['peak_bytes'])} for record in self.records]
+        with open(path, 'w') as output_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, output_file)
+
+
+class _Stage(object):
+
+    __slots__ = ('profiler', 'name', 'shapes', 'start', 'depth', 'base', 'peak')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.shapes = {}
+        self.base = self.peak = 0
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._exit(self)
+        return False
+
+    def record(self, **arrays):
+        """
+        Keep the shapes of arrays, DataFrames or RatingsMatrix objects with the stage
+        """
+        for name, array in arrays.items():
+            shape = getattr(array, 'shape', None)
+            if shape is not None:
+                self.shapes[name] = list(shape)
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def record(self, **arrays):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """
+    Mark a named stage of the pipeline, recorded by the active Profiler
+
+        with stage('CollaborativeFiltering.dot_product') as current:
+            products = ...
+            current.record(products=products)
+
+    :param name: The stage name
+    :return: A context manager whose record(**arrays) keeps the shapes of arrays with the stage
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active, name)
+
+
+def profiled(name):
+    """
+    Decorate a function so each call is a named stage, recording the shape of its result
+    :param name: The stage name
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            with _Stage(_active, name) as current:
+                result = function(*args, **kwargs)
+                current.record(result=result)
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,195 @@
+import numpy as np
+
+USER_BIAS_REG = 10.
+ITEM_BIAS_REG = 25.
+BIAS_ITERATIONS = 3
+
+
+class RatingsStatistics(object):
+    """
+    The per user and per item counts, means, standard deviations and biases of a ratings matrix.
+    Everything is derived from running counts, sums and sums of squares gathered in one pass over the known ratings,
+    so the statistics can also be updated as ratings are added.
+    Derived arrays are computed once and shared, they must not be modified.
+    """
+
+    def __init__(self, user_counts, user_sums, user_squares, item_counts, item_sums, item_squares):
+        self.user_counts = user_counts
+        self.user_sums = user_sums
+        self.user_squares = user_squares
+        self.item_counts = item_counts
+        self.item_sums = item_sums
+        self.item_squares = item_squares
+        self._derived = {}
+
+    def _memoise(self, name, calculate):
+        if name not in self._derived:
+            self._derived[name] = calculate()
+        return self._derived[name]
+
+    @classmethod
+    def from_ratings(cls, ratings):
+        """
+        Gather the running sums of a RatingsMatrix
+        :param ratings: The RatingsMatrix
+        :return: The RatingsStatistics
+        """
+        csr = ratings.csr
+        n_users, n_items = csr.shape
+        values = csr.data.astype(np.float64)
+        squares = values ** 2
+        rows = ratings.user_rows()
+        return cls(np.diff(csr.indptr).astype(np.float64),
+                   np.bincount(rows, weights=values, minlength=n_users),
+                   np.bincount(rows, weights=squares, minlength=n_users),
+                   np.bincount(csr.indices, minlength=n_items).astype(np.float64),
+                   np.bincount(csr.indices, weights=values, minlength=n_items),
+                   np.bincount(csr.indices, weights=squares, minlength=n_items))
+
+    def add(self, rows, cols, values, old_values, replaced, n_users, n_items):
+        """
+        Update the running sums for a batch of added ratings
+        :param rows: The row position of each added rating
+        :param cols: The column position of each added rating
+        :param values: The added ratings
+        :param old_values: The ratings they replace, ignored where not replaced
+        :param replaced: Whether each rating replaced a known rating
+        :param n_users: The number of users after the batch
+        :param n_items: The number of items after the batch
+        """
+        values = np.asarray(values, dtype=np.float64)
+        old_values = np.where(replaced, old_values, 0.)
+        counts = (~replaced).astype(np.float64)
+        sums = values - old_values
+        squares = values ** 2 - old_values ** 2
+        for name, positions, size in (('user', rows, n_users), ('item', cols, n_items)):
+            for statistic, change in (('counts', counts), ('sums', sums), ('squares', squares)):
+                attribute = '{0}_{1}'.format(name, statistic)
+                current = getattr(self, attribute)
+                updated = np.zeros(size)
+                updated[:len(current)] = current
+                updated += np.bincount(positions, weights=change, minlength=size)
+                setattr(self, attribute, updated)
+        self._derived = {}
+
+    @property
+    def n_ratings(self):
+        return self.user_counts.sum()
+
+    @property
+    def global_mean(self):
+        """
+        The mean of all known ratings, 0 without ratings
+        """
+        n_ratings = self.n_ratings
+        return self._memoise('global_mean', lambda: self.user_sums.sum() / n_ratings if n_ratings else 0.)
+
+    @property
+    def user_means(self):
+        """
+        The mean of the known ratings of each user, 0 for users without ratings
+        """
+        return self._memoise('user_means', lambda: _means(self.user_counts, self.user_sums))
+
+    @property
+    def user_std_devs(self):
+        """
+        The population standard deviation of the known ratings of each user, 0 for users without ratings
+        """
+        return self._memoise('user_std_devs', lambda: _std_devs(self.user_counts, self.user_sums, self.user_squares))
+
+    @property
+    def item_means(self):
+        """
+        The mean of the known ratings of each item, 0 for items without ratings
+        """
+        return self._memoise('item_means', lambda: _means(self.item_counts, self.item_sums))
+
+    @property
+    def item_std_devs(self):
+        """
+        The population standard deviation of the known ratings of each item, 0 for items without ratings
+        """
+        return self._memoise('item_std_devs', lambda: _std_devs(self.item_counts, self.item_sums, self.item_squares))
+
+    @property
+    def user_biases(self):
+        """
+        The offset of each user's mean from the global mean, 0 for users without ratings
+        """
+        return self._memoise('user_biases',
+                             lambda: np.where(self.user_counts > 0, self.user_means - self.global_mean, 0.))
+
+    @property
+    def item_biases(self):
+        """
+        The offset of each item's mean from the global mean, 0 for items without ratings
+        """
+        return self._memoise('item_biases',
+                             lambda: np.where(self.item_counts > 0, self.item_means - self.global_mean, 0.))
+
+
+def get_statistics(ratings):
+    """
+    Get the statistics of a RatingsMatrix.
+    The statistics are memoised on the ratings object and recomputed once its version changes,
+    so every model built on the same ratings shares one copy.
+    :param ratings: The RatingsMatrix
+    :return: The RatingsStatistics
+    """
+    cached = getattr(ratings, '_statistics', None)
+    if cached is None or cached[0] != ratings.version:
+        cached = (ratings.version, RatingsStatistics.from_ratings(ratings))
+        ratings._statistics = cached
+    return cached[1]
+
+
+def fit_biases(ratings, reg_users=USER_BIAS_REG, reg_items=ITEM_BIAS_REG, n_iter=BIAS_ITERATIONS):
+    """
+    Fit the baseline rating = global mean + user bias + item bias by regularised least squares.
+    The item and user biases are solved in turn, each in closed form given the other, by one weighted bincount
+    over the known ratings. The regularisation shrinks the biases of users and items with few ratings towards 0.
+    :param ratings: The RatingsMatrix
+    :param reg_users: The regularisation of the user biases, as a number of ratings at the global mean
+    :param reg_items: The regularisation of the item biases, as a number of ratings at the global mean
+    :param n_iter: The number of alternating passes, the first pass is the usual shrunk mean offsets
+    :return: (global mean, user biases, item biases)
+    """
+    csr = ratings.csr
+    n_users, n_items = csr.shape
+    rows, cols = ratings.user_rows(), csr.indices
+    values = csr.data.astype(np.float64)
+    global_mean = values.mean() if len(values) else 0.
+    residuals = values - global_mean
+    user_counts = np.bincount(rows, minlength=n_users) + float(reg_users)
+    item_counts = np.bincount(cols, minlength=n_items) + float(reg_items)
+    user_biases = np.zeros(n_users)
+    item_biases = np.zeros(n_items)
+    for _ in range(n_iter):
+        item_biases = _means(item_counts, np.bincount(cols, weights=residuals - user_biases[rows], minlength=n_items))
+        user_biases = _means(user_counts, np.bincount(rows, weights=residuals - item_biases[cols], minlength=n_users))
+    return float(global_mean), user_biases, item_biases
+
+
+def get_biases(ratings, reg_users=USER_BIAS_REG, reg_items=ITEM_BIAS_REG, n_iter=BIAS_ITERATIONS):
+    """
+    Get the regularised biases of a RatingsMatrix, as from fit_biases.
+    Like the statistics the biases are memoised on the ratings object until its version changes,
+    so a baseline predictor and the models that use it as their residual baseline share one fit.
+    :return: (global mean, user biases, item biases), they must not be modified
+    """
+    key = (ratings.version, reg_users, reg_items, n_iter)
+    cached = getattr(ratings, '_biases', None)
+    if cached is None or cached[0] != key:
+        cached = (key, fit_biases(ratings, reg_users=reg_users, reg_items=reg_items, n_iter=n_iter))
+        ratings._biases = cached
+    return cached[1]
+
+
+def _means(counts, sums):
+    return np.divide(sums, counts, out=np.zeros(len(sums)), where=counts > 0)
+
+
+def _std_devs(counts, sums, squares):
+    squared_deviations = np.maximum(squares - sums * _means(counts, sums), 0)
+    return np.sqrt(np.divide(squared_deviations, counts, out=np.zeros(len(sums)), where=counts > 0))
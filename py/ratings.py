@@ -0,0 +1,339 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from persistence import load_arrays, save_arrays
+from rating_statistics import get_statistics
+
+
+class RatingsMatrix(object):
+    """
+    A sparse user x item ratings store.
+    Only the known ratings are kept, in CSR form, together with the user and item ids of the rows and columns.
+    Memory scales with the number of ratings rather than users x items.
+    """
+
+    def __init__(self, matrix, user_ids=None, item_ids=None, timestamps=None):
+        """
+        :param matrix: The user x item ratings. Any scipy sparse matrix or dense array, stored entries are known ratings
+        :param user_ids: The user id of each row. Defaults to 0..n_users-1
+        :param item_ids: The item id of each column. Defaults to 0..n_items-1
+        :param timestamps: Optional time of each rating, aligned with the data of matrix in CSR order
+        """
+        matrix = sp.csr_matrix(matrix)
+        if timestamps is not None and not matrix.has_canonical_format:
+            raise ValueError('Timestamps need a matrix in canonical CSR order.')
+        matrix.sum_duplicates()
+        self._csr = matrix
+        self._csc = None
+        self.timestamps = None if timestamps is None else np.asarray(timestamps)
+
+        if user_ids is None:
+            user_ids = np.arange(matrix.shape[0])
+        if item_ids is None:
+            item_ids = np.arange(matrix.shape[1])
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        if len(self.user_ids) != matrix.shape[0] or len(self.item_ids) != matrix.shape[1]:
+            raise ValueError('The id maps do not match the ratings matrix shape.')
+        self._user_lookup = None
+        self._item_lookup = None
+        self.version = 0
+
+    @classmethod
+    def from_dataframe(cls, ratings):
+        """
+        Build the store from a dense user x item DataFrame where 0 represents unknown
+        :param ratings: The user x item ratings DataFrame
+        :type ratings: DataFrame
+        :return: The RatingsMatrix
+        """
+        values = ratings.values
+        rows, cols = values.nonzero()
+        matrix = sp.csr_matrix((values[rows, cols], (rows, cols)), shape=values.shape)
+        return cls(matrix, user_ids=ratings.index.values, item_ids=ratings.columns.values)
+
+    @classmethod
+    def from_coo(cls, users, items, ratings, timestamps=None, dtype=None):
+        """
+        Build the store from parallel arrays of (user_id, item_id, rating) in 'database' form.
+        The ids may be any sortable values, they are mapped to rows and columns in sorted order.
+        When a user rated an item more than once the last rating is kept.
+        :param users: The user id of each rating
+        :param items: The item id of each rating
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating
+        :param dtype: Optional dtype for the stored ratings
+        :return: The RatingsMatrix
+        """
+        user_ids, rows = np.unique(np.asarray(users), return_inverse=True)
+        item_ids, cols = np.unique(np.asarray(items), return_inverse=True)
+        return cls.from_positions(rows, cols, np.asarray(ratings, dtype=dtype), user_ids, item_ids,
+                                  timestamps=timestamps)
+
+    @classmethod
+    def from_positions(cls, rows, cols, ratings, user_ids, item_ids, timestamps=None):
+        """
+        Build the store from the row and column position of each rating and the id maps
+        :param rows: The row position of each rating
+        :param cols: The column position of each rating
+        :param ratings: The rating values
+        :param user_ids: The user id of each row
+        :param item_ids: The item id of each column
+        :param timestamps: Optional time of each rating
+        :return: The RatingsMatrix
+        """
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        order = _last_occurrences(rows * len(item_ids) + cols)
+
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows[order], minlength=len(user_ids)))))
+        matrix = sp.csr_matrix((np.asarray(ratings)[order], cols[order].astype(np.int32), indptr),
+                               shape=(len(user_ids), len(item_ids)))
+        if timestamps is not None:
+            timestamps = np.asarray(timestamps)[order]
+        return cls(matrix, user_ids=user_ids, item_ids=item_ids, timestamps=timestamps)
+
+    @property
+    def csr(self):
+        """
+        :return: The ratings as a scipy CSR matrix, users on the rows
+        """
+        return self._csr
+
+    @property
+    def csc(self):
+        """
+        :return: The ratings as a scipy CSC matrix, built once on first use
+        """
+        if self._csc is None:
+            self._csc = self._csr.tocsc()
+        return self._csc
+
+    @property
+    def shape(self):
+        return self._csr.shape
+
+    @property
+    def nnz(self):
+        return self._csr.nnz
+
+    @property
+    def nbytes(self):
+        """
+        :return: The number of bytes used by the CSR arrays
+        """
+        return self._csr.data.nbytes + self._csr.indices.nbytes + self._csr.indptr.nbytes
+
+    def user_index(self, user_ids):
+        """
+        Map user ids to row positions
+        :param user_ids: A single user id or a sequence of them
+        :return: The row position(s). Raises KeyError for unknown users
+        """
+        if self._user_lookup is None:
+            self._user_lookup = pd.Index(self.user_ids)
+        return self._lookup(self._user_lookup, user_ids)
+
+    def item_index(self, item_ids):
+        """
+        Map item ids to column positions
+        :param item_ids: A single item id or a sequence of them
+        :return: The column position(s). Raises KeyError for unknown items
+        """
+        if self._item_lookup is None:
+            self._item_lookup = pd.Index(self.item_ids)
+        return self._lookup(self._item_lookup, item_ids)
+
+    @staticmethod
+    def _lookup(index, ids):
+        if np.ndim(ids) == 0:
+            return index.get_loc(ids)
+        positions = index.get_indexer(np.asarray(ids))
+        if np.any(positions < 0):
+            raise KeyError(np.asarray(ids)[positions < 0].tolist())
+        return positions
+
+    def user_ratings(self, user):
+        """
+        The known ratings of one user
+        :param user: The row position of the user
+        :return: (item positions, ratings)
+        """
+        start, end = self._csr.indptr[user], self._csr.indptr[user + 1]
+        return self._csr.indices[start:end], self._csr.data[start:end]
+
+    def with_data(self, data):
+        """
+        Make a new RatingsMatrix with the same users, items and pattern of known ratings but new values.
+        Values equal to 0 are kept as known entries.
+        :param data: The new values, aligned with csr.data
+        :return: The new RatingsMatrix
+        """
+        csr = self._csr
+        matrix = sp.csr_matrix((np.asarray(data), csr.indices.copy(), csr.indptr.copy()), shape=csr.shape)
+        return RatingsMatrix(matrix, user_ids=self.user_ids, item_ids=self.item_ids, timestamps=self.timestamps)
+
+    def add_ratings(self, user_ids, item_ids, ratings, timestamps=None):
+        """
+        Add a batch of ratings in place. Existing ratings of the same user and item are overwritten and
+        unknown users and items are appended as new rows and columns.
+        The cached statistics are updated from the batch alone rather than recomputed.
+        :param user_ids: The user id of each rating
+        :param item_ids: The item id of each rating
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        :return: (rows, cols) the positions of the distinct ratings that were added or changed
+        """
+        user_ids, item_ids = pd.Index(user_ids).values, pd.Index(item_ids).values
+        values = np.asarray(ratings)
+        if self.timestamps is not None and timestamps is None:
+            raise ValueError('These ratings have timestamps, the added ratings need them too.')
+
+        self.user_ids = _append_ids(self.user_ids, user_ids)
+        self.item_ids = _append_ids(self.item_ids, item_ids)
+        self._user_lookup = self._item_lookup = None
+        n_users, n_items = len(self.user_ids), len(self.item_ids)
+        rows = self.user_index(user_ids).astype(np.int64)
+        cols = self.item_index(item_ids).astype(np.int64)
+
+        keys = rows * n_items + cols
+        order = _last_occurrences(keys)
+        keys, rows, cols, values = keys[order], rows[order], cols[order], values[order]
+
+        csr = self._csr
+        known_keys = self.user_rows().astype(np.int64) * n_items + csr.indices
+        positions = np.searchsorted(known_keys, keys)
+        present = positions < len(known_keys)
+        present[present] = known_keys[positions[present]] == keys[present]
+        old_values = np.zeros(len(keys))
+        old_values[present] = csr.data[positions[present]]
+
+        data = csr.data
+        if not np.array_equal(values.astype(data.dtype), values):
+            data = data.astype(np.result_type(data.dtype, values.dtype))
+        else:
+            data = data.copy()
+        data[positions[present]] = values[present]
+        inserted = ~present
+        data = np.insert(data, positions[inserted], values[inserted].astype(data.dtype))
+        indices = np.insert(csr.indices, positions[inserted], cols[inserted].astype(csr.indices.dtype))
+        counts = np.bincount(self.user_rows(), minlength=n_users) + np.bincount(rows[inserted], minlength=n_users)
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        if self.timestamps is not None:
+            added_timestamps = np.asarray(timestamps)[order]
+            self.timestamps = self.timestamps.copy()
+            self.timestamps[positions[present]] = added_timestamps[present]
+            self.timestamps = np.insert(self.timestamps, positions[inserted], added_timestamps[inserted])
+
+        cached = getattr(self, '_statistics', None)
+        statistics = cached[1] if cached is not None and cached[0] == self.version else None
+        self._csr = sp.csr_matrix((data, indices, indptr), shape=(n_users, n_items))
+        self.changed()
+        if statistics is not None:
+            statistics.add(rows, cols, values, old_values, present, n_users, n_items)
+            self._statistics = (self.version, statistics)
+        return rows, cols
+
+    def save(self, path):
+        """
+        Save the ratings as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        csr = self._csr
+        save_arrays(path, {'data': csr.data, 'indices': csr.indices, 'indptr': csr.indptr,
+                           'user_ids': self.user_ids, 'item_ids': self.item_ids, 'timestamps': self.timestamps},
+                    {'shape': list(csr.shape)})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load ratings saved with save, memory-mapping the arrays by default
+        :param path: The directory the ratings were saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The RatingsMatrix
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        matrix = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(manifest['shape']),
+                               copy=False)
+        return cls(matrix, user_ids=arrays['user_ids'], item_ids=arrays['item_ids'],
+                   timestamps=arrays.get('timestamps'))
+
+    def user_rows(self):
+        """
+        :return: The row position of each stored rating, aligned with csr.data
+        """
+        return np.repeat(np.arange(self.shape[0]), np.diff(self._csr.indptr))
+
+    def to_dataframe(self):
+        """
+        Densify into the user x item DataFrame form with 0 for unknown ratings.
+        Only meant for small matrices and display.
+        :return: The ratings DataFrame
+        """
+        return pd.DataFrame(self._csr.toarray(), index=self.user_ids, columns=self.item_ids)
+
+    def changed(self):
+        """
+        Record that the ratings were modified in place, invalidating the CSC copy and the cached statistics
+        """
+        self.version += 1
+        self._csc = None
+
+    def user_means(self):
+        """
+        :return: The mean of the known ratings of each user, 0 for users without ratings
+        """
+        return get_statistics(self).user_means
+
+    def user_std_devs(self):
+        """
+        :return: The population standard deviation of the known ratings of each user, 0 for users without ratings
+        """
+        return get_statistics(self).user_std_devs
+
+    def item_means(self):
+        """
+        :return: The mean of the known ratings of each item, 0 for items without ratings
+        """
+        return get_statistics(self).item_means
+
+    def __repr__(self):
+        return '<RatingsMatrix {0} users x {1} items, {2} ratings>'.format(self.shape[0], self.shape[1], self.nnz)
+
+
+def as_ratings_matrix(ratings):
+    """
+    Get a RatingsMatrix for either a RatingsMatrix or a dense user x item DataFrame
+    :param ratings: The ratings
+    :type ratings: RatingsMatrix or DataFrame
+    :return: The RatingsMatrix
+    """
+    if isinstance(ratings, RatingsMatrix):
+        return ratings
+    if isinstance(ratings, pd.DataFrame):
+        return RatingsMatrix.from_dataframe(ratings)
+    if sp.issparse(ratings):
+        return RatingsMatrix(ratings)
+    raise TypeError('Cannot use {0} as ratings.'.format(type(ratings).__name__))
+
+
+def _last_occurrences(keys):
+    """
+    :return: The positions of the last occurrence of each distinct key, in order of the keys
+    """
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = sorted_keys[1:] != sorted_keys[:-1]
+    return order[last]
+
+
+def _append_ids(ids, added_ids):
+    """
+    :return: ids followed by the distinct added_ids not already in it, in order of first appearance
+    """
+    new_ids = pd.unique(added_ids)
+    new_ids = new_ids[~pd.Index(new_ids).isin(ids)]
+    if not len(new_ids):
+        return ids
+    return pd.Index(ids).append(pd.Index(new_ids)).values
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+from extras import RATING_SCALE
+from rating_statistics import get_statistics
+from ratings import as_ratings_matrix
+
+
+class Recommender(object):
+    """
+    The single user recommendation API shared by the predictors.
+    Subclasses keep their known ratings in ratings and implement score_user,
+    which predicts one user's ratings for every item without computing any other user's row.
+    Predictions are clamped to rating_scale.
+    """
+
+    rating_scale = RATING_SCALE
+
+    @staticmethod
+    def calculate_user_means(ratings):
+        """
+        Calculate the user means of the ratings matrix
+        :param ratings: The ratings
+        :type ratings: RatingsMatrix or DataFrame
+        :return: A DataFrame indexed on user_id with one column mean with the user means
+        """
+        ratings = as_ratings_matrix(ratings)
+        return pd.DataFrame(get_statistics(ratings).user_means, index=ratings.user_ids, columns=['mean'])
+
+    @staticmethod
+    def calculate_user_std_devs(ratings):
+        """
+        Calculate the user standard deviations in the user x item ratings
+        :param ratings: the ratings
+        :type ratings: RatingsMatrix or DataFrame
+        :return: A DataFrame indexed on user_id with one column std with the user standard deviations
+        """
+        ratings = as_ratings_matrix(ratings)
+        return pd.DataFrame(get_statistics(ratings).user_std_devs, index=ratings.user_ids, columns=['std'])
+
+    @staticmethod
+    def calculate_item_means(ratings):
+        """
+        Calculate the item means
+        :param ratings: The ratings
+        :type ratings: RatingsMatrix or DataFrame
+        :return: A DataFrame indexed on item_id with one column mean with the item means
+        """
+        ratings = as_ratings_matrix(ratings)
+        return pd.DataFrame(get_statistics(ratings).item_means, index=ratings.item_ids, columns=['mean'])
+
+    @property
+    def statistics(self):
+        """
+        The shared statistics of the ratings
+        """
+        return get_statistics(self.ratings)
+
+    def score_user(self, user, **options):
+        """
+        Predict the ratings of one user for every item
+        :param user: The row position of the user
+        :param options: Model specific prediction options
+        :return: An array of predicted ratings, one per item
+        """
+        raise NotImplementedError
+
+    def score_users(self, users, **options):
+        """
+        Predict the ratings of a chunk of users for every item.
+        Models override this to score the whole chunk with matrix products.
+        :param users: The row positions of the users
+        :param options: Model specific prediction options, as for score_user
+        :return: A len(users) x n_items array of predicted ratings
+        """
+        return np.vstack([self.score_user(user, **options) for user in users])
+
+    def score_user_id(self, user_id, **options):
+        """
+        Predict the ratings of one user for every item by id.
+        Models that can score users without ratings, from their metadata, override this.
+        :param user_id: The user id
+        :param options: Model specific prediction options, as for score_user
+        :return: An array of predicted ratings, one per item. Raises KeyError for unknown users
+        """
+        return self.score_user(self.ratings.user_index(user_id), **options)
+
+    def score(self, user_id, item_ids, **options):
+        """
+        Predict the ratings of one user for some items
+        :param user_id: The user id
+        :param item_ids: The item ids to score
+        :param options: Model specific prediction options, as for the predict methods
+        :return: A Series of predicted ratings indexed on item_id
+        """
+        items = self.ratings.item_index(item_ids)
+        scores = self.score_user_id(user_id, **options)
+        return pd.Series(scores[items], index=self.ratings.item_ids[items], name='score')
+
+    def recommend(self, user_id, n=10, exclude_rated=True, **options):
+        """
+        Recommend the n items with the highest predicted rating for one user
+        :param user_id: The user id
+        :param n: The number of items to recommend
+        :param exclude_rated: Whether to leave out the items the user has already rated
+        :param options: Model specific prediction options, as for the predict methods
+        :return: A Series of predicted ratings indexed on item_id, highest first
+        """
+        scores = self.score_user_id(user_id, **options)
+        exclude = None
+        if exclude_rated:
+            try:
+                exclude = self.ratings.user_ratings(self.ratings.user_index(user_id))[0]
+            except KeyError:
+                pass
+        items = top_n(scores, n, exclude=exclude)
+        return pd.Series(scores[items], index=self.ratings.item_ids[items], name='score')
+
+
+def top_n(scores, n, exclude=None):
+    """
+    Find the positions of the n highest scores with a partial sort
+    :param scores: An array of scores
+    :param n: The number of positions to return
+    :param exclude: Optional positions that may not be returned
+    :return: The positions of the top n scores, highest first
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if exclude is not None and len(exclude):
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+    n = min(n, len(scores))
+    if n <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if n < len(scores):
+        top = np.argpartition(-scores, n - 1)[:n]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return top[np.isfinite(scores[top])]
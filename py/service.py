@@ -0,0 +1,364 @@
+"""
+A local HTTP recommendation service over a saved model.
+
+    python py/service.py MODEL_PATH --port 8000 --option method=item_item --option adjust=mean --option k=50
+
+Endpoints, all answering JSON:
+
+    GET  /recommend?user=<id>&n=10&exclude_rated=true   the top n items of a user
+    GET  /score?user=<id>&items=<id>,<id>               the predicted ratings of some items
+    POST /ratings   {"user_ids": [...], "item_ids": [...], "ratings": [...], "timestamps": [...]}
+    GET  /health    the model size and the batching and cache counters
+"""
+import argparse
+import asyncio
+import json
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from persistence import load_model
+from recommender import top_n
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_BATCH_WAIT = 0.002
+DEFAULT_CACHE_SIZE = 10000
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+
+class RecommendationService(object):
+    """
+    Serves one model to concurrent requests.
+    Requests arriving within batch_wait seconds of each other are coalesced into one micro-batch,
+    scored with a single score_users call so one matrix product serves every user in the batch.
+    All model access, scoring and rating updates, runs in order on one background thread, so the event loop keeps
+    accepting requests while a batch is scored and updates never interleave with scoring.
+    The top n lists are kept in an LRU cache. The lists of a user are dropped when that user's ratings change,
+    and every list is dropped when new items are added since any of them may now rank.
+    """
+
+    def __init__(self, model, options=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE, batch_wait=DEFAULT_BATCH_WAIT,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param model: The fitted Recommender
+        :param options: Model specific prediction options, as for score_user
+        :param max_batch_size: The largest number of requests scored together
+        :param batch_wait: The seconds a batch waits for more requests after its first one
+        :param cache_size: The number of top n lists kept, 0 to disable the cache
+        """
+        self.model = model
+        self.options = dict(options or {})
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.counters = {'scored': 0, 'batches': 0, 'cache_hits': 0, 'updates': 0}
+        self.server = None
+        self._generation = 0
+        self._queue = None
+        self._batcher = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """
+        Start batching and listening for HTTP connections
+        :param host: The address to listen on
+        :param port: The port to listen on, 0 for any free port
+        :return: The asyncio server
+        """
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        """
+        Stop listening and batching
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        self._executor.shutdown(wait=True)
+
+    async def recommend(self, user_id, n=10, exclude_rated=True):
+        """
+        :param user_id: The user id
+        :param n: The number of items to recommend
+        :param exclude_rated: Whether to leave out the items the user has already rated
+        :return: (item ids, scores) highest first. Raises KeyError for users the model cannot score
+        """
+        key = (user_id, n, exclude_rated)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.counters['cache_hits'] += 1
+            return self.cache[key]
+        generation = self._generation
+        result = await self._submit(user_id, ('recommend', n, exclude_rated))
+        if self.cache_size and generation == self._generation:
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    async def score(self, user_id, item_ids):
+        """
+        :param user_id: The user id
+        :param item_ids: The item ids to score
+        :return: The predicted ratings of the items. Raises KeyError for users the model cannot score or unknown items
+        """
+        return await self._submit(user_id, ('score', item_ids))
+
+    async def add_ratings(self, user_ids, item_ids, ratings, timestamps=None):
+        """
+        Add new or changed ratings to the model and drop the cached lists they affect
+        :param user_ids: The user id of each rating, new users are added
+        :param item_ids: The item id of each rating, new items are added
+        :param ratings: The rating values
+        :param timestamps: Optional time of each rating, required when the ratings have timestamps
+        """
+        n_items = self.model.ratings.shape[1]
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, lambda: self.model.add_ratings(
+            user_ids, item_ids, ratings, timestamps=timestamps))
+        self._generation += 1
+        self.counters['updates'] += 1
+        if self.model.ratings.shape[1] != n_items:
+            self.cache.clear()
+            return
+        changed = set(user_ids)
+        for key in [key for key in self.cache if key[0] in changed]:
+            del self.cache[key]
+
+    async def _submit(self, user_id, request):
+        self.counters['scored'] += 1
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user_id, request, future))
+        return await future
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.batch_wait)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self.counters['batches'] += 1
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._serve_batch, [(user_id, request) for user_id, request, _ in batch])
+            except Exception as error:
+                results = [error] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _serve_batch(self, requests):
+        """
+        Score the distinct known users of a batch together and answer each request from its user's row.
+        Users without ratings are scored one at a time with score_user_id, which models that score cold-start
+        users from their metadata override, and are not found otherwise.
+        :param requests: A list of (user id, request)
+        :return: A list of results, or of the exception of each failed request
+        """
+        ratings = self.model.ratings
+        positions = {}
+        for user_id, _ in requests:
+            if user_id not in positions:
+                try:
+                    positions[user_id] = ratings.user_index(user_id)
+                except KeyError:
+                    positions[user_id] = None
+        known = sorted(set(position for position in positions.values() if position is not None))
+        rows = {}
+        if known:
+            known_rows = dict(zip(known, self.model.score_users(np.asarray(known, dtype=np.int64), **self.options)))
+            rows = dict((user_id, known_rows[user]) for user_id, user in positions.items() if user is not None)
+        for user_id, user in positions.items():
+            if user is None:
+                try:
+                    rows[user_id] = self.model.score_user_id(user_id, **self.options)
+                except KeyError:
+                    rows[user_id] = KeyError('Unknown user {0}.'.format(user_id))
+
+        results = []
+        for user_id, request in requests:
+            user, scores = positions[user_id], rows[user_id]
+            try:
+                if isinstance(scores, KeyError):
+                    raise scores
+                if request[0] == 'recommend':
+                    _, n, exclude_rated = request
+                    exclude = ratings.user_ratings(user)[0] if exclude_rated and user is not None else None
+                    items = top_n(scores, n, exclude=exclude)
+                    results.append((ratings.item_ids[items].tolist(), scores[items].tolist()))
+                else:
+                    results.append(scores[ratings.item_index(request[1])].tolist())
+            except KeyError as error:
+                results.append(error)
+        return results
+
+    async def handle(self, method, target, body=b''):
+        """
+        Answer one HTTP request
+        :param method: The HTTP method
+        :param target: The request path and query string
+        :param body: The request body
+        :return: (status code, JSON serialisable payload)
+        """
+        url = urlsplit(target)
+        query = dict((name, values[-1]) for name, values in parse_qs(url.query).items())
+        routes = {'/recommend': ('GET', self._handle_recommend), '/score': ('GET', self._handle_score),
+                  '/ratings': ('POST', self._handle_ratings), '/health': ('GET', self._handle_health)}
+        if url.path not in routes:
+            return 404, {'error': 'Unknown path {0}.'.format(url.path)}
+        expected_method, handler = routes[url.path]
+        if method != expected_method:
+            return 405, {'error': '{0} expects {1}.'.format(url.path, expected_method)}
+        try:
+            return 200, await handler(query, body)
+        except KeyError as error:
+            return 404, {'error': str(error.args[0]) if error.args else 'Not found.'}
+        except (ValueError, TypeError) as error:
+            return 400, {'error': str(error)}
+
+    async def _handle_recommend(self, query, body):
+        user_id = _parse_id(query['user'], self.model.ratings.user_ids)
+        exclude_rated = query.get('exclude_rated', 'true').lower() not in ('false', '0', 'no')
+        items, scores = await self.recommend(user_id, n=int(query.get('n', 10)), exclude_rated=exclude_rated)
+        return {'user_id': user_id, 'items': items, 'scores': scores}
+
+    async def _handle_score(self, query, body):
+        user_id = _parse_id(query['user'], self.model.ratings.user_ids)
+        item_ids = [_parse_id(item_id, self.model.ratings.item_ids) for item_id in query['items'].split(',')]
+        scores = await self.score(user_id, item_ids)
+        return {'user_id': user_id, 'items': item_ids, 'scores': scores}
+
+    async def _handle_ratings(self, query, body):
+        update = json.loads(body.decode('utf-8'))
+        await self.add_ratings(update['user_ids'], update['item_ids'], update['ratings'],
+                               timestamps=update.get('timestamps'))
+        return {'added': len(update['ratings'])}
+
+    async def _handle_health(self, query, body):
+        n_users, n_items = self.model.ratings.shape
+        return dict(self.counters, model=type(self.model).__name__, users=n_users, items=n_items,
+                    cached=len(self.cache))
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serve the HTTP/1.1 requests of one connection, keeping it alive between requests unless asked not to
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, payload = await self.handle(method, target, body)
+                except Exception as error:
+                    status, payload = 500, {'error': repr(error)}
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                content = json.dumps(payload).encode('utf-8')
+                writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n'
+                             'Connection: {3}\r\n\r\n'.format(status, HTTP_REASONS[status], len(content),
+                                                              'keep-alive' if keep_alive else 'close')
+                             .encode('latin-1') + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def _parse_id(value, ids):
+    """
+    Convert an id from a query string to the type of the known ids
+    """
+    if ids.dtype.kind in 'iu':
+        return int(value)
+    if ids.dtype.kind == 'f':
+        return float(value)
+    return value
+
+
+def _parse_option(option):
+    name, _, value = option.partition('=')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+async def serve(model, host='127.0.0.1', port=8000, **kwargs):
+    """
+    Serve a model until cancelled
+    :param model: The fitted Recommender
+    :param host: The address to listen on
+    :param port: The port to listen on
+    :param kwargs: The RecommendationService settings
+    """
+    service = RecommendationService(model, **kwargs)
+    server = await service.start(host, port)
+    print('serving {0} on {1}'.format(type(model).__name__,
+                                      ', '.join(str(socket.getsockname()) for socket in server.sockets)))
+    sys.stdout.flush()
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='the directory of a model saved with its save method')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--option', action='append', default=[],
+                        help='a prediction option as name=value, for example k=50, may be repeated')
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument('--batch-wait', type=float, default=DEFAULT_BATCH_WAIT * 1000.,
+                        help='milliseconds a batch waits for more requests')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help='top n lists kept, 0 for none')
+    args = parser.parse_args(argv)
+
+    # Copy on write maps keep the arrays shared until rating updates change them
+    model = load_model(args.model, mmap_mode='c')
+    try:
+        asyncio.run(serve(model, args.host, args.port, options=dict(map(_parse_option, args.option)),
+                          max_batch_size=args.max_batch_size, batch_wait=args.batch_wait / 1000.,
+                          cache_size=args.cache_size))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
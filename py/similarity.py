@@ -0,0 +1,281 @@
+import numpy as np
+import scipy.sparse as sp
+
+from neighbours import NeighbourGraph, select_top_k
+from parallel import WorkerPool, n_workers
+from persistence import load_arrays, save_arrays
+
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+SIMILARITY_METHODS = ('cosine', 'pearson', 'adjusted')
+CO_RATED_METHODS = ('pearson', 'adjusted')
+# The default shrinkage of the co-rated methods, whose similarity over a single shared column is always +-1
+CO_RATED_SHRINKAGE = 10.
+
+
+class SimilarityEngine(object):
+    """
+    Computes the similarity between the rows of a sparse matrix a block of rows at a time.
+    Each block is compared against every row and normalised with precomputed row and column norm vectors,
+    so only a block x rows array is ever dense.
+
+    Only the stored values are known, unknown values are not zeros. 'pearson' centres each row on the mean of its
+    stored values and 'adjusted' (adjusted cosine) each column, as the user means of item rows. Both then take
+    the cosine over the co-rated columns of each pair of rows, so the norms of a pair come from sparse products
+    of the squared values with the stored pattern instead of from one norm per row.
+    A shrinkage weighs each similarity by n / (n + shrinkage), with n the number of co-rated columns,
+    so that similarities over small overlaps count less. The co-rated methods shrink by default, as otherwise
+    pairs sharing one or two columns get similarities of +-1 and crowd out neighbours with real overlaps.
+    Neighbour selection can spread the blocks over a WorkerPool, then the memory budget applies to each worker.
+    """
+
+    def __init__(self, matrix, method='cosine', memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.float64,
+                 weight_dtype=None, n_jobs=1, shrinkage=None):
+        """
+        :param matrix: The rows to compare, a scipy sparse matrix with unknown values not stored
+        :param method: <'cosine', 'pearson', 'adjusted'> the similarity measure to be used
+        :param memory_budget: The number of bytes the dense working blocks may use
+        :param dtype: The float type the blocks are computed in. float32 halves the memory and bandwidth per block
+        :param weight_dtype: The float type of the kept neighbour weights, defaults to dtype
+        :param n_jobs: The number of worker processes for neighbour selection, None for one per CPU
+        :param shrinkage: The number of co-rated columns at which a similarity is halved, 0 for no shrinkage.
+            None for CO_RATED_SHRINKAGE with the co-rated methods and no shrinkage with cosine
+        """
+        if method not in SIMILARITY_METHODS:
+            raise KeyError(method+' is not an implemented method.')
+        self.dtype = np.dtype(dtype)
+        self.weight_dtype = self.dtype if weight_dtype is None else np.dtype(weight_dtype)
+        self.method = method
+        self.memory_budget = memory_budget
+        self.n_jobs = n_jobs
+        if shrinkage is None:
+            shrinkage = CO_RATED_SHRINKAGE if method in CO_RATED_METHODS else 0.
+        self.shrinkage = shrinkage
+
+        matrix = sp.csr_matrix(matrix)
+        data = matrix.data.astype(np.float64)
+        entry_rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        if method in CO_RATED_METHODS:
+            # Pearson centres each row on its mean, adjusted cosine each column
+            groups = entry_rows if method == 'pearson' else matrix.indices
+            n_groups = matrix.shape[0] if method == 'pearson' else matrix.shape[1]
+            counts = np.bincount(groups, minlength=n_groups)
+            sums = np.bincount(groups, weights=data, minlength=n_groups)
+            means = np.divide(sums, counts, out=np.zeros(n_groups), where=counts > 0)
+            data -= means[groups]
+            self.means = means.astype(self.dtype)
+        else:
+            self.means = None
+        self.matrix = sp.csr_matrix((data.astype(self.dtype), matrix.indices, matrix.indptr), shape=matrix.shape)
+        self.norms = np.sqrt(np.bincount(entry_rows, weights=data ** 2, minlength=matrix.shape[0])).astype(self.dtype)
+        self._prepare()
+
+    def _prepare(self):
+        """
+        Keep the stored pattern and the squared values, the operands of the co-rated norms and overlap counts
+        """
+        self.pattern = self.squares = None
+        if self.method in CO_RATED_METHODS or self.shrinkage:
+            self.pattern = self.matrix.copy()
+            self.pattern.data = np.ones(len(self.pattern.data), dtype=self.dtype)
+        if self.method in CO_RATED_METHODS:
+            self.squares = self.matrix.multiply(self.matrix).tocsr()
+
+    @property
+    def n_rows(self):
+        return self.matrix.shape[0]
+
+    @property
+    def block_size(self):
+        """
+        The number of rows per block so that the block, the copies made for selection and the selected positions
+        fit in the memory budget
+        """
+        dense_arrays = 8 if self.pattern is not None else 4
+        row_bytes = dense_arrays * self.dtype.itemsize * max(self.n_rows, 1)
+        return int(max(1, min(self.n_rows, self.memory_budget // row_bytes)))
+
+    @property
+    def task_size(self):
+        """
+        The number of rows per block when the blocks are spread over workers, at most block_size
+        and small enough to give each worker several blocks
+        """
+        n_jobs = n_workers(self.n_jobs)
+        if n_jobs == 1:
+            return self.block_size
+        return int(max(1, min(self.block_size, -(-self.n_rows // (4 * n_jobs)))))
+
+    def block(self, start, end):
+        """
+        The similarity of rows start to end against all rows
+        :param start: The first row of the block
+        :param end: One past the last row of the block
+        :return: A dense (end - start) x n_rows similarity array
+        """
+        return self._similarity(slice(start, end))
+
+    def rows_block(self, rows):
+        """
+        The similarity of any set of rows against all rows
+        :param rows: The row positions
+        :return: A dense len(rows) x n_rows similarity array
+        """
+        return self._similarity(rows)
+
+    def _similarity(self, rows):
+        block = self.matrix[rows]
+        products = block.dot(self.matrix.T).toarray()
+        if self.method in CO_RATED_METHODS:
+            # The squared norm of each row over the columns it shares with each other row, and the other way round
+            norms = block.multiply(block).dot(self.pattern.T).toarray()
+            norms *= self.pattern[rows].dot(self.squares.T).toarray()
+            np.sqrt(norms, out=norms)
+        else:
+            norms = np.outer(self.norms[rows], self.norms)
+        similarity = np.divide(products, norms, out=np.zeros_like(products), where=norms > 0)
+        if self.shrinkage:
+            counts = self.pattern[rows].dot(self.pattern.T).toarray()
+            similarity *= counts / (counts + self.dtype.type(self.shrinkage))
+        return similarity
+
+    def blocks(self):
+        """
+        Iterate over the row blocks
+        :return: A generator of (start, end, block)
+        """
+        block_size = self.block_size
+        for start in range(0, self.n_rows, block_size):
+            end = min(start + block_size, self.n_rows)
+            yield start, end, self.block(start, end)
+
+    def full(self):
+        """
+        :return: The dense n_rows x n_rows similarity array
+        """
+        return self.block(0, self.n_rows)
+
+    def top_k(self, k, exclude_self=True):
+        """
+        Keep only the k most similar rows for each row
+        :param k: The number of neighbours, -1 for all
+        :param exclude_self: Whether a row may not be its own neighbour
+        :return: The NeighbourGraph
+        """
+        n_neighbours = self.n_rows - 1 if exclude_self else self.n_rows
+        k = n_neighbours if k < 0 else min(k, n_neighbours)
+        indices = np.empty((self.n_rows, k), dtype=np.int32)
+        weights = np.empty((self.n_rows, k), dtype=self.weight_dtype)
+        task_size = self.task_size
+        blocks = [(start, min(start + task_size, self.n_rows)) for start in range(0, self.n_rows, task_size)]
+        with WorkerPool(self.n_jobs, {'engine': self}) as pool:
+            selected = pool.map(_select_block, [(start, end, k, exclude_self) for start, end in blocks])
+            for (start, end), (block_indices, block_weights) in zip(blocks, selected):
+                indices[start:end], weights[start:end] = block_indices, block_weights
+        return NeighbourGraph(indices, weights, n_columns=self.n_rows)
+
+    def save(self, path):
+        """
+        Save the engine as raw NumPy arrays and a manifest in the directory path
+        :param path: The directory to save to, created if missing
+        """
+        save_arrays(path, {'data': self.matrix.data, 'indices': self.matrix.indices, 'indptr': self.matrix.indptr,
+                           'norms': self.norms, 'means': self.means},
+                    {'shape': list(self.matrix.shape), 'method': self.method, 'memory_budget': self.memory_budget,
+                     'dtype': self.dtype.name, 'weight_dtype': self.weight_dtype.name, 'shrinkage': self.shrinkage})
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load an engine saved with save without recomputing the norms, memory-mapping the arrays by default.
+        The co-rated operands are rebuilt from the matrix in one pass over its values.
+        :param path: The directory the engine was saved to
+        :param mmap_mode: The numpy memory-map mode, None to read the arrays into memory
+        :return: The SimilarityEngine, selecting neighbours in this process
+        """
+        arrays, manifest = load_arrays(path, mmap_mode=mmap_mode)
+        engine = cls.__new__(cls)
+        engine.dtype = np.dtype(manifest['dtype'])
+        engine.weight_dtype = np.dtype(manifest['weight_dtype'])
+        engine.matrix = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                      shape=tuple(manifest['shape']), copy=False)
+        engine.method = manifest['method']
+        engine.memory_budget = manifest['memory_budget']
+        engine.n_jobs = 1
+        engine.norms = arrays['norms']
+        engine.means = arrays.get('means')
+        engine.shrinkage = manifest.get('shrinkage', 0.)
+        engine._prepare()
+        return engine
+
+
+def top_k_similarity(matrix, k, method='cosine', memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.float64,
+                     weight_dtype=None, n_jobs=1, shrinkage=None):
+    """
+    Build the k nearest neighbour graph of the rows of a sparse matrix without the full similarity matrix
+    :param matrix: The rows to compare, a scipy sparse matrix
+    :param k: The number of neighbours for each row
+    :param method: <'cosine', 'pearson', 'adjusted'> the similarity measure to be used
+    :param memory_budget: The number of bytes the dense working blocks may use
+    :param dtype: The float type the blocks are computed in
+    :param weight_dtype: The float type of the neighbour weights, defaults to dtype
+    :param n_jobs: The number of worker processes, None for one per CPU
+    :param shrinkage: The number of co-rated columns at which a similarity is halved, 0 for no shrinkage.
+            None for CO_RATED_SHRINKAGE with the co-rated methods and no shrinkage with cosine
+    :return: The NeighbourGraph
+    """
+    return SimilarityEngine(matrix, method=method, memory_budget=memory_budget, dtype=dtype,
+                            weight_dtype=weight_dtype, n_jobs=n_jobs, shrinkage=shrinkage).top_k(k)
+
+
+def update_top_k(engine, graph, changed_rows, k):
+    """
+    Update a k nearest neighbour graph after some rows of the compared matrix changed or were appended.
+    Changed rows, and rows that had a changed row as a neighbour, are recomputed in full.
+    Every other row only merges its similarity to the changed rows into its current neighbours,
+    which gives the same graph as a full rebuild.
+    :param engine: The SimilarityEngine over the updated matrix
+    :param graph: The NeighbourGraph of the matrix before the change
+    :param changed_rows: The positions of the changed and appended rows
+    :param k: The number of neighbours the graph was built with, -1 for all
+    :return: The updated NeighbourGraph
+    """
+    n_rows = engine.n_rows
+    n_neighbours = n_rows - 1 if k < 0 else min(k, n_rows - 1)
+    if n_neighbours != graph.k:
+        return engine.top_k(k)
+
+    changed_rows = np.unique(changed_rows)
+    indices = np.zeros((n_rows, n_neighbours), dtype=np.int32)
+    weights = np.zeros((n_rows, n_neighbours), dtype=engine.weight_dtype)
+    indices[:graph.shape[0]] = graph.indices
+    weights[:graph.shape[0]] = graph.weights
+
+    stale = np.zeros(n_rows, dtype=bool)
+    stale[changed_rows] = True
+    stale |= np.isin(indices, changed_rows).any(axis=1)
+    stale_rows = np.flatnonzero(stale)
+    if len(stale_rows):
+        task_size = engine.task_size
+        tasks = [(stale_rows[start:start + task_size], n_neighbours) for start in range(0, len(stale_rows), task_size)]
+        with WorkerPool(engine.n_jobs if len(tasks) > 1 else 1, {'engine': engine}) as pool:
+            for (rows, _), (row_indices, row_weights) in zip(tasks, pool.map(_select_rows, tasks)):
+                indices[rows], weights[rows] = row_indices, row_weights
+
+    kept_rows = np.flatnonzero(~stale)
+    if len(kept_rows) and len(changed_rows):
+        changed_similarity = engine.rows_block(changed_rows).T[kept_rows]
+        candidates = np.hstack((indices[kept_rows], np.tile(changed_rows, (len(kept_rows), 1))))
+        candidate_weights = np.hstack((weights[kept_rows], changed_similarity))
+        chosen, weights[kept_rows] = select_top_k(candidate_weights, n_neighbours, exclude_self=False)
+        indices[kept_rows] = np.take_along_axis(candidates, chosen, axis=1)
+    return NeighbourGraph(indices, weights, n_columns=n_rows)
+
+
+def _select_block(shared, start, end, k, exclude_self):
+    return select_top_k(shared['engine'].block(start, end), k, row_offset=start, exclude_self=exclude_self)
+
+
+def _select_rows(shared, rows, k):
+    block = shared['engine'].rows_block(rows)
+    block[np.arange(len(rows)), rows] = -np.inf
+    return select_top_k(block, k, exclude_self=False)
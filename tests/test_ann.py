@@ -0,0 +1,54 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from ann import InvertedFileIndex
+
+
+class TestInvertedFileIndex(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.vectors = random.normal(size=(2000, 8)) * random.uniform(0.2, 2., size=(2000, 1))
+        self.queries = random.normal(size=(20, 8))
+        self.index = InvertedFileIndex.build(self.vectors, n_lists=40, random_state=0)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def recall(self, n_probe):
+        hits = 0
+        for query in self.queries:
+            exact = np.argsort(-self.vectors.dot(query))[:10]
+            items, _ = self.index.search(query, 10, n_probe=n_probe)
+            hits += len(np.intersect1d(items, exact))
+        return hits / (10. * len(self.queries))
+
+    def test_build(self):
+        self.assertEqual(self.index.n_lists, 40)
+        self.assertEqual(self.index.n_probe, 4)
+        self.assertEqual(sorted(self.index.list_items), list(range(2000)))
+        self.assertTrue(np.allclose(self.index.vectors, self.vectors[self.index.list_items]))
+
+    def test_probing_every_list_is_exact(self):
+        query = self.queries[0]
+        items, scores = self.index.search(query, 10, n_probe=40, exclude=[3])
+        products = self.vectors.dot(query)
+        products[3] = -np.inf
+        self.assertEqual(list(items), list(np.argsort(-products)[:10]))
+        self.assertTrue(np.allclose(scores, products[items]))
+
+    def test_recall_grows_with_probes(self):
+        recalls = [self.recall(n_probe) for n_probe in (1, 8, 40)]
+        self.assertLess(recalls[0], recalls[1])
+        self.assertGreater(recalls[1], 0.7)
+        self.assertEqual(recalls[2], 1.)
+
+    def test_save_load(self):
+        self.index.save(self.path)
+        loaded = InvertedFileIndex.load(self.path)
+        self.assertIsInstance(loaded.vectors, np.memmap)
+        self.assertEqual(loaded.n_probe, self.index.n_probe)
+        for query in self.queries[:3]:
+            self.assertTrue(np.array_equal(loaded.search(query, 5)[0], self.index.search(query, 5)[0]))
@@ -85,4 +85,39 @@ class TestBaselinePredictors(unittest.TestCase):
         true_predictions = np.asarray([[2.5, 4., 5.],
                                      [2.5, 4., 5.],
                                      [2.5, 4., 5.]])
-        self.assertTrue(np.all((true_predictions - predictions.values[:, :]) == 0))
\ No newline at end of file
+        self.assertTrue(np.all((true_predictions - predictions.values[:, :]) == 0))
+
+    def test_recommend(self):
+        ratings_values = np.asarray([[1, 3, 0, 0],
+                                     [2, 0, 4, 5],
+                                     [0, 3, 5, 1]])
+        bp = BaselinePredictor(pd.DataFrame(ratings_values, columns=[10, 20, 30, 40]))
+        recommended = bp.recommend(0, n=5, based='item')
+        self.assertEqual(list(recommended.index), [30, 40])
+        self.assertTrue(np.all(recommended.values == [4.5, 3.]))
+        recommended = bp.recommend(0, n=1, exclude_rated=False, based='item')
+        self.assertEqual(list(recommended.index), [30])
+
+    def test_score(self):
+        ratings_values = np.asarray([[1, 3, 0],
+                                     [2, 0, 4],
+                                     [0, 3, 5]])
+        bp = BaselinePredictor(pd.DataFrame(ratings_values))
+        scores = bp.score(2, [0, 2], based='item_user')
+        self.assertTrue(np.all(scores.values == [2.5, 5.]))
+        self.assertEqual(list(scores.index), [0, 2])
+
+    def test_bias_based(self):
+        ratings_values = np.asarray([[1, 3, 0],
+                                     [2, 0, 4],
+                                     [0, 3, 5]])
+        bp = BaselinePredictor(pd.DataFrame(ratings_values), reg_users=1., reg_items=1.)
+        global_mean, user_biases, item_biases = bp.biases
+        self.assertAlmostEqual(global_mean, 3.)
+        self.assertAlmostEqual(item_biases[2] + user_biases[2], bp.predict_bias_based().values[2, 2] - 3.)
+        predictions = bp.predict_bias_based()
+        self.assertTrue(np.allclose(bp.score_user(1, based='bias'), predictions.values[1]))
+        self.assertTrue(np.allclose(bp.score_users([0, 2], based='bias'), predictions.values[[0, 2]]))
+        self.assertTrue(np.allclose(bp.score(1, [2, 0], based='bias').values, predictions.values[1, [2, 0]]))
+        self.assertGreater(item_biases[2], 0.)
+        self.assertLess(item_biases[0], 0.)
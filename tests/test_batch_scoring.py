@@ -0,0 +1,75 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from baseline_predictors import BaselinePredictor
+from batch_scoring import read_recommendations, recommend_batches, top_n_rows, write_recommendations
+from collaborative_filtering import CollaborativeFiltering
+from latent_factors import LatentFactorModel
+from matrix_factorisation import MatrixFactorisation
+from ratings import RatingsMatrix
+
+
+class TestBatchScoring(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        ratings_values = random.randint(1, 6, size=(30, 20)) * (random.rand(30, 20) < 0.4)
+        ratings_values[4, :] = 3
+        user_ids = np.asarray(['u{0}'.format(user) for user in range(30)], dtype=object)
+        self.ratings = RatingsMatrix(sp.csr_matrix(ratings_values), user_ids=user_ids)
+        self.users = np.asarray([0, 4, 17, 29])
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_score_users(self, model, **options):
+        expected = np.vstack([model.score_user(user, **options) for user in self.users])
+        self.assertTrue(np.allclose(model.score_users(self.users, **options), expected))
+
+    def test_score_users(self):
+        self.assert_score_users(BaselinePredictor(self.ratings), based='user')
+        self.assert_score_users(BaselinePredictor(self.ratings), based='item_user')
+        self.assert_score_users(MatrixFactorisation(self.ratings, rank=4, random_state=0), k=3)
+        self.assert_score_users(LatentFactorModel(self.ratings, n_factors=3, random_state=0).fit(n_epochs=2))
+        cf = CollaborativeFiltering(self.ratings)
+        for similarity in ('cosine', 'pearson'):
+            for k in (-1, 5):
+                self.assert_score_users(cf, adjust='full', similarity=similarity, k=k)
+        self.assert_score_users(cf, adjust=None, k=5)
+        cf.build_user_neighbours(adjust='mean', k=5)
+        self.assert_score_users(cf, adjust='mean', k=5)
+        cf.build_item_index(k=5)
+        self.assert_score_users(cf, method='item_item', adjust='mean', k=5)
+
+    def test_top_n_rows(self):
+        scores = np.asarray([[1., 3., 2.], [5., 4., 6.]])
+        positions, top_scores = top_n_rows(scores, 2, exclude=sp.csr_matrix([[0, 1, 0], [1, 1, 0]]))
+        self.assertEqual(positions.tolist(), [[2, 0], [2, -1]])
+        self.assertEqual(top_scores[0].tolist(), [2., 1.])
+        self.assertTrue(np.isnan(top_scores[1, 1]))
+
+    def test_recommend_batches_matches_recommend(self):
+        model = MatrixFactorisation(self.ratings, rank=4, random_state=0)
+        batches = list(recommend_batches(model, n=5, chunk_size=7))
+        self.assertEqual(len(batches), 5)
+        user_ids = np.concatenate([batch[0] for batch in batches])
+        self.assertEqual(list(user_ids), list(self.ratings.user_ids))
+        for user_ids, items, scores in batches[:2]:
+            for user_id, user_items, user_scores in zip(user_ids, items, scores):
+                expected = model.recommend(user_id, n=5)
+                self.assertTrue(np.allclose(user_scores[user_items >= 0], expected.values))
+        self.assertTrue((batches[0][1][4] == -1).all())
+
+    def test_write_recommendations(self):
+        model = CollaborativeFiltering(self.ratings)
+        model.build_user_neighbours(k=5)
+        write_recommendations(self.path, model, n=3, users=self.users, chunk_size=3, n_jobs=2, k=5)
+        recommendations = read_recommendations(self.path)
+        self.assertEqual(len(recommendations), 3 * (len(self.users) - 1))
+        expected = model.recommend('u17', n=3, k=5)
+        written = recommendations[recommendations['user_id'] == 'u17'].sort_values('rank')
+        self.assertEqual(list(written['item_id']), list(expected.index))
+        self.assertTrue(np.allclose(written['score'], expected.values))
@@ -1,7 +1,9 @@
 import unittest
 import pandas as pd
 import numpy as np
+import collaborative_filtering
 from collaborative_filtering import CollaborativeFiltering
+from similarity import SimilarityEngine
 
 
 class TestCollaborativeFiltering(unittest.TestCase):
@@ -72,15 +74,16 @@ class TestCollaborativeFiltering(unittest.TestCase):
         ratings = pd.DataFrame(ratings_values)
         cf = CollaborativeFiltering(ratings)
         user_similarity = cf.get_user_similarity(ratings)
-        user_similarity = cf.adjust_user_similarity_knn(user_similarity, 1)
+        neighbours = cf.adjust_user_similarity_knn(user_similarity, 1)
         u1 = np.sqrt(10.)
         u2 = np.sqrt(20.)
         u3 = np.sqrt(34.)
-        true_simil = np.asarray([[1, 0., 9./(u1*u3)],
-                                 [0., 1, 20./(u2*u3)],
-                                 [0., 20./(u2*u3), 1]])
+        true_simil = np.asarray([[0., 0., 9./(u1*u3)],
+                                 [0., 0., 20./(u2*u3)],
+                                 [0., 20./(u2*u3), 0.]])
 
-        self.assertTrue(np.all((true_simil - user_similarity.values[:, :]).round(decimals=12) == 0))
+        self.assertEqual(neighbours.shape, (3, 1))
+        self.assertTrue(np.all((true_simil - neighbours.to_sparse().toarray()).round(decimals=12) == 0))
 
     def test_adjust_ratings_with_means(self):
         ratings_values = np.asarray([[1, 3, 0],
@@ -137,4 +140,150 @@ class TestCollaborativeFiltering(unittest.TestCase):
                                      [5, 3, 1],
                                      [3, 1, 5]])
 
-        self.assertTrue(np.all((true_predictions - predictions.values[:, :]) == 0))
\ No newline at end of file
+        self.assertTrue(np.all((true_predictions - predictions.values[:, :]) == 0))
+
+    def test_predict_item_item(self):
+        ratings_values = np.asarray([[1, 3, 0],
+                                     [2, 0, 4],
+                                     [0, 3, 5]])
+        cf = CollaborativeFiltering(pd.DataFrame(ratings_values))
+        predictions = cf.predict_item_item(adjust=None, similarity='cosine')
+
+        i0 = np.sqrt(5.)
+        i1 = np.sqrt(18.)
+        i2 = np.sqrt(41.)
+        s01 = 3./(i0*i1)
+        s02 = 8./(i0*i2)
+        s12 = 15./(i1*i2)
+        self.assertAlmostEqual(predictions.values[0, 2], (s02*1 + s12*3) / (s02 + s12))
+        self.assertAlmostEqual(predictions.values[1, 1], (s01*2 + s12*4) / (s01 + s12))
+        self.assertAlmostEqual(predictions.values[0, 0], 3.)
+        self.assertIsNone(cf.item_index)
+
+    def test_score_user_matches_predict(self):
+        ratings_values = np.asarray([[1, 3, 0, 2],
+                                     [2, 0, 4, 0],
+                                     [0, 3, 5, 4],
+                                     [5, 1, 0, 2]])
+        cf = CollaborativeFiltering(pd.DataFrame(ratings_values))
+        predictions = cf.predict_user_user(adjust=None, k=2)
+        for user in range(4):
+            self.assertTrue(np.allclose(cf.score_user(user, adjust=None, k=2), predictions.values[user]))
+        predictions = cf.predict_item_item(adjust=None, k=2)
+        self.assertTrue(np.allclose(cf.score_user(1, method='item_item', adjust=None, k=2), predictions.values[1]))
+
+    def test_item_index_options(self):
+        random = np.random.RandomState(6)
+        cf = CollaborativeFiltering(pd.DataFrame(random.randint(1, 6, (20, 10)) * (random.rand(20, 10) < 0.6)))
+        index = cf.build_item_index(adjust='mean', similarity='cosine', k=5)
+        predictions = cf.predict_item_item(adjust='full', similarity='pearson', k=3)
+        self.assertIs(cf.item_index, index)
+        self.assertTrue(np.allclose(cf.score_user(2, method='item_item', adjust='mean', k=5),
+                                    cf.predict_item_item(adjust='mean', k=5).values[2]))
+        self.assertIs(cf.item_index, index)
+
+        scores = cf.score_users([2, 4], method='item_item', adjust='full', similarity='pearson', k=3)
+        self.assertTrue(np.allclose(scores, predictions.values[[2, 4]]))
+        self.assertEqual((cf.item_index.adjust, cf.item_index.similarity, cf.item_index.k), ('full', 'pearson', 3))
+
+    def test_add_ratings_matches_refit(self):
+        random = np.random.RandomState(3)
+        ratings_values = (1 + 4 * random.rand(30, 15)) * (random.rand(30, 15) < 0.5)
+        new_values = (1 + 4 * random.rand(32, 17)) * (random.rand(32, 17) < 0.5)
+        new_values[:30, :15] = ratings_values
+        new_values[[2, 9], :15] = (1 + 4 * random.rand(2, 15)) * ((ratings_values[[2, 9]] > 0) |
+                                                                   (random.rand(2, 15) < 0.3))
+        changed = new_values.copy()
+        changed[:30, :15][(new_values[:30, :15] == ratings_values)] = 0
+        rows, cols = np.nonzero(changed)
+
+        cf = CollaborativeFiltering(pd.DataFrame(ratings_values))
+        cf.build_user_neighbours(adjust='full', similarity='cosine', k=4)
+        cf.build_item_index(adjust='mean', similarity='adjusted', k=5)
+        cf.add_ratings(rows, cols, new_values[rows, cols])
+        added = cf.ratings.to_dataframe()
+        self.assertTrue(np.all(added.loc[range(32), range(17)].values == new_values))
+        refit = CollaborativeFiltering(added)
+        refit.build_user_neighbours(adjust='full', similarity='cosine', k=4)
+        refit.build_item_index(adjust='mean', similarity='adjusted', k=5)
+
+        self.assertTrue(np.allclose(cf.user_means.values, refit.user_means.values))
+        self.assertTrue(np.allclose(cf.user_std_devs.values, refit.user_std_devs.values))
+        self.assertTrue(np.array_equal(cf.user_neighbours.indices, refit.user_neighbours.indices))
+        self.assertTrue(np.allclose(cf.user_neighbours.weights, refit.user_neighbours.weights))
+        self.assertTrue(np.array_equal(cf.item_index.neighbours.indices, refit.item_index.neighbours.indices))
+        self.assertTrue(np.allclose(cf.item_index.neighbours.weights, refit.item_index.neighbours.weights))
+        for method in ('user_user', 'item_item'):
+            self.assertTrue(np.allclose(cf.score_user(31, method=method, k=4),
+                                        refit.score_user(31, method=method, k=4)))
+
+    def test_add_ratings_co_rated_matches_refit(self):
+        # Dense enough that pairs share several ratings, pairs with one co-rated item tie at a similarity of 1
+        random = np.random.RandomState(5)
+        ratings_values = (1 + 4 * random.rand(30, 15)) * (random.rand(30, 15) < 0.8)
+        cf_options = (('pearson', 'pearson', 0.), ('adjusted', 'adjusted', 5.), ('pearson', 'cosine', 5.))
+        for user_similarity, item_similarity, shrinkage in cf_options:
+            cf = CollaborativeFiltering(pd.DataFrame(ratings_values), shrinkage=shrinkage)
+            cf.build_user_neighbours(adjust='mean', similarity=user_similarity, k=4)
+            cf.build_item_index(adjust='mean', similarity=item_similarity, k=5)
+            cf.add_ratings([3, 3, 30, 30, 30, 30, 7], [2, 15, 0, 1, 4, 9, 15], [5, 4, 1, 2, 5, 3, 2])
+            refit = CollaborativeFiltering(cf.ratings.to_dataframe(), shrinkage=shrinkage)
+            refit.build_user_neighbours(adjust='mean', similarity=user_similarity, k=4)
+            refit.build_item_index(adjust='mean', similarity=item_similarity, k=5)
+
+            self.assertTrue(np.array_equal(cf.user_neighbours.indices, refit.user_neighbours.indices))
+            self.assertTrue(np.allclose(cf.user_neighbours.weights, refit.user_neighbours.weights))
+            self.assertTrue(np.array_equal(cf.item_index.neighbours.indices, refit.item_index.neighbours.indices))
+            self.assertTrue(np.allclose(cf.item_index.neighbours.weights, refit.item_index.neighbours.weights))
+
+    def test_add_ratings_keeps_build_resources(self):
+        random = np.random.RandomState(6)
+        ratings_values = (1 + 4 * random.rand(20, 10)) * (random.rand(20, 10) < 0.5)
+        cf = CollaborativeFiltering(pd.DataFrame(ratings_values))
+        cf.build_user_neighbours(adjust='mean', k=4, memory_budget=4096)
+        cf.n_jobs = 2
+        cf.build_item_index(adjust='mean', k=5, memory_budget=2048)
+        cf.n_jobs = 1
+
+        resources = []
+
+        class RecordingEngine(SimilarityEngine):
+            def __init__(self, matrix, **options):
+                resources.append((options['memory_budget'], options['n_jobs']))
+                super(RecordingEngine, self).__init__(matrix, **options)
+        collaborative_filtering.SimilarityEngine = RecordingEngine
+        try:
+            cf.add_ratings([3, 20], [2, 4], [5, 1])
+        finally:
+            collaborative_filtering.SimilarityEngine = SimilarityEngine
+        self.assertEqual(resources, [(4096, 1), (2048, 2)])
+
+    def test_single_precision_matches_double(self):
+        random = np.random.RandomState(4)
+        ratings = pd.DataFrame(random.randint(1, 6, (20, 12)) * (random.rand(20, 12) < 0.5))
+        single = CollaborativeFiltering(ratings, dtype=np.float32, weight_dtype=np.float16)
+        double = CollaborativeFiltering(ratings)
+        for predict in ('predict_user_user', 'predict_item_item'):
+            predictions = getattr(single, predict)(k=5)
+            self.assertEqual(predictions.values.dtype, np.float32)
+            self.assertTrue(np.allclose(predictions.values, getattr(double, predict)(k=5).values, atol=1e-2))
+
+    def test_baseline_adjustment(self):
+        random = np.random.RandomState(5)
+        ratings = pd.DataFrame(random.randint(1, 6, (20, 12)) * (random.rand(20, 12) < 0.5))
+        cf = CollaborativeFiltering(ratings)
+        adjusted = cf.get_adjusted_ratings('baseline')
+        global_mean, user_biases, item_biases = cf.biases
+        rows, cols = adjusted.user_rows(), adjusted.csr.indices
+        self.assertTrue(np.allclose(adjusted.csr.data + global_mean + user_biases[rows] + item_biases[cols],
+                                    cf.ratings.csr.data))
+        for method, predict in (('user_user', cf.predict_user_user), ('item_item', cf.predict_item_item)):
+            predictions = predict(adjust='baseline', k=5)
+            self.assertTrue(np.allclose(cf.score_user(3, method=method, adjust='baseline', k=5),
+                                        predictions.values[3]))
+
+        cf.build_user_neighbours(adjust='baseline', k=4)
+        cf.add_ratings([0, 20], [1, 1], [5, 2])
+        refit = CollaborativeFiltering(cf.ratings.to_dataframe())
+        refit.build_user_neighbours(adjust='baseline', k=4)
+        self.assertTrue(np.allclose(cf.user_neighbours.weights, refit.user_neighbours.weights))
@@ -0,0 +1,69 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from content_based import ContentBasedPredictor, HybridRecommender
+from matrix_factorisation import MatrixFactorisation
+from metadata import FeatureMatrix
+from persistence import load_model
+from ratings import RatingsMatrix
+
+
+class TestContentBased(unittest.TestCase):
+
+    def setUp(self):
+        # Users of group a like the items of genre x and dislike those of genre y, group b the other way round
+        random = np.random.RandomState(0)
+        user_groups = np.arange(40) % 2
+        item_genres = np.arange(20) % 2
+        values = np.where(user_groups[:, np.newaxis] == item_genres, 5, 1) + random.randint(-1, 1, size=(40, 20))
+        values *= random.rand(40, 20) < 0.5
+        self.ratings = RatingsMatrix(sp.csr_matrix(values), user_ids=np.arange(40), item_ids=np.arange(20))
+        self.user_features = FeatureMatrix.from_lists(np.arange(41), [['group=' + 'ab'[group]]
+                                                                      for group in np.append(user_groups, 1)])
+        self.item_features = FeatureMatrix.from_lists(np.arange(20), [['genre=' + 'xy'[genre]]
+                                                                      for genre in item_genres])
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_cold_start_user(self):
+        model = ContentBasedPredictor(self.ratings, user_features=self.user_features,
+                                      item_features=self.item_features)
+        scores = model.score_new_user(40)
+        self.assertTrue(np.all(scores[1::2] > scores[0::2] + 2))
+        self.assertEqual(set(model.recommend(40, n=5).index) - set(range(1, 20, 2)), set())
+
+        no_features = model.score_new_user(99)
+        self.assertTrue(np.allclose(no_features, model.global_mean + model.item_biases))
+        self.assertTrue(np.allclose(model.score_users([0, 3]), np.vstack([model.score_user(0),
+                                                                          model.score_user(3)])))
+
+    def test_add_ratings(self):
+        model = ContentBasedPredictor(self.ratings, user_features=self.user_features,
+                                      item_features=self.item_features)
+        model.add_ratings([40], [1], [5])
+        self.assertEqual(model.ratings.shape[0], 41)
+        self.assertEqual(model.user_affinity.shape, (41, 2))
+
+    def test_hybrid(self):
+        mf = MatrixFactorisation(self.ratings, rank=2, random_state=0)
+        content = ContentBasedPredictor(self.ratings, user_features=self.user_features,
+                                        item_features=self.item_features)
+        hybrid = HybridRecommender(mf, content, user_shrinkage=5, item_shrinkage=0)
+        counts = self.ratings.csr.getnnz(axis=1)
+        weight = counts[3] / (counts[3] + 5.)
+        self.assertTrue(np.allclose(hybrid.score_user(3), weight * mf.score_user(3) +
+                                    (1 - weight) * content.score_user(3)))
+        self.assertTrue(np.allclose(hybrid.score_users([3])[0], hybrid.score_user(3)))
+        self.assertTrue(np.allclose(hybrid.score(40, [0, 1]).values, content.score_new_user(40)[[0, 1]]))
+
+        hybrid.save(self.path)
+        loaded = load_model(self.path)
+        self.assertIsInstance(loaded, HybridRecommender)
+        self.assertTrue(np.allclose(loaded.score_user(3), hybrid.score_user(3)))
+
+        hybrid.add_ratings([40], [1], [5])
+        self.assertEqual(hybrid.score_users([40]).shape, (1, 20))
@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+import scipy.sparse as sp
+from baseline_predictors import BaselinePredictor
+from evaluation import (ModelSpec, cross_validate, evaluate, mae, model_grid, ndcg_at_n, precision_at_n,
+                        recall_at_n, rmse)
+from extras import split_train_test
+from ratings import RatingsMatrix
+
+
+class TestEvaluation(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        user_factors = random.normal(size=(60, 2))
+        item_factors = random.normal(size=(30, 2))
+        ratings_values = np.clip(np.round(3 + user_factors.dot(item_factors.T)), 1, 5)
+        ratings_values *= random.rand(60, 30) < 0.4
+        user_ids = np.asarray(['u{0}'.format(user) for user in range(60)], dtype=object)
+        self.ratings = RatingsMatrix(sp.csr_matrix(ratings_values), user_ids=user_ids)
+
+    def test_error_metrics(self):
+        self.assertAlmostEqual(rmse([1., 2., 4.], np.asarray([1., 4., 3.])), np.sqrt(5. / 3.))
+        self.assertAlmostEqual(mae([1., 2., 4.], np.asarray([1., 4., 3.])), 1.)
+
+    def test_ranking_metrics(self):
+        recommended = np.asarray([3, 1, 4, 0])
+        relevant = np.asarray([1, 0, 7])
+        self.assertAlmostEqual(precision_at_n(recommended, relevant, 2), 0.5)
+        self.assertAlmostEqual(recall_at_n(recommended, relevant, 4), 2. / 3.)
+        ideal = 1. + 1. / np.log2(3) + 0.5
+        self.assertAlmostEqual(ndcg_at_n(recommended, relevant, 4), (1. / np.log2(3) + 1. / np.log2(5)) / ideal)
+        self.assertAlmostEqual(ndcg_at_n(np.asarray([1, 0]), relevant[:2], 2), 1.)
+        self.assertEqual(recall_at_n(recommended, np.asarray([], dtype=int), 4), 0.)
+
+    def test_evaluate_matches_get_rmse(self):
+        train, test = split_train_test(self.ratings, random_state=0)
+        baseline = BaselinePredictor(train)
+        metrics = evaluate(baseline, test, n=5, based='item')
+        predicted = baseline.predict_item_based().values[test.user_rows(), test.csr.indices]
+        self.assertAlmostEqual(metrics['rmse'], rmse(predicted, test.csr.data))
+        self.assertTrue(0 <= metrics['ndcg'] <= 1)
+
+    def test_model_grid(self):
+        specs = model_grid(methods=('user_user',), adjusts=('mean',), similarities=('cosine', 'pearson'),
+                           ks=(5,), ranks=(2, 3))
+        self.assertEqual(len(specs), 5)
+        self.assertEqual(len(set(spec.model_key for spec in specs)), 3)
+
+    def test_cross_validate(self):
+        specs = model_grid(adjusts=('mean',), similarities=('cosine',), ks=(5,), ranks=(2, 3))
+        results = cross_validate(self.ratings, specs, n_folds=3, n=5, n_jobs=1, random_state=0)
+        self.assertEqual(len(results), 3 * len(specs))
+        self.assertEqual(set(results['model']), set(spec.name for spec in specs))
+        summary = results.groupby('model')['rmse'].mean()
+        self.assertLess(summary['mf rank=2'], summary['baseline item_user'])
+
+    def test_cross_validate_in_processes(self):
+        specs = [ModelSpec('baseline', BaselinePredictor, options={'based': 'item'})] + model_grid(
+            baselines=(), methods=('item_item',), adjusts=('mean',), similarities=('cosine',), ks=(5,), ranks=())
+        in_process = cross_validate(self.ratings, specs, n_folds=2, n_jobs=1, random_state=0)
+        in_pool = cross_validate(self.ratings, specs, n_folds=2, n_jobs=2, random_state=0)
+        metrics = ['rmse', 'mae', 'precision', 'recall', 'ndcg']
+        self.assertTrue(np.allclose(in_process[metrics].values, in_pool[metrics].values))
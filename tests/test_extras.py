@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 import pandas as pd
 import numpy as np
@@ -5,6 +8,43 @@ import extras
 
 class TestExtras(unittest.TestCase):
 
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ratings_file = os.path.join(self.directory, 'ratings.dat')
+        with open(self.ratings_file, 'w') as ratings_file:
+            ratings_file.write('1::10::5::978300760\n1::20::3::978302109\n7::10::4::978301968\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_ratings(self):
+        ratings = extras.read_ratings(self.ratings_file, cache=False, chunk_bytes=16)
+        self.assertEqual(ratings.shape, (2, 2))
+        self.assertTrue(np.all(ratings.user_ids == [1, 7]))
+        self.assertTrue(np.all(ratings.item_ids == [10, 20]))
+        self.assertTrue(np.all(ratings.to_dataframe().values == [[5, 3], [4, 0]]))
+        self.assertTrue(np.all(ratings.timestamps == [978300760, 978302109, 978301968]))
+        self.assertEqual(ratings.csr.dtype, np.int8)
+        self.assertFalse(os.path.exists(self.ratings_file + '.cache.npz'))
+
+    def test_read_ratings_empty(self):
+        empty_file = os.path.join(self.directory, 'empty.dat')
+        open(empty_file, 'w').close()
+        ratings = extras.read_ratings(empty_file, cache=False)
+        self.assertEqual(ratings.shape, (0, 0))
+        self.assertEqual(len(ratings.timestamps), 0)
+
+    def test_read_ratings_cache(self):
+        ratings = extras.read_ratings(self.ratings_file)
+        self.assertTrue(os.path.exists(self.ratings_file + '.cache.npz'))
+        cached = extras.read_ratings(self.ratings_file)
+        self.assertTrue(np.all(cached.to_dataframe().values == ratings.to_dataframe().values))
+        self.assertTrue(np.all(cached.timestamps == ratings.timestamps))
+
+        with open(self.ratings_file, 'a') as ratings_file:
+            ratings_file.write('9::30::2::978302000\n')
+        self.assertEqual(extras.read_ratings(self.ratings_file).shape, (3, 3))
+
     def test_get_ratings_sparsity(self):
         ratings = pd.DataFrame(np.asarray([[1,0],[1,0]]))
         self.assertEqual(extras.get_ratings_sparsity(ratings), 50.0, 'Sparsity calculation incorrect')
@@ -23,6 +63,37 @@ class TestExtras(unittest.TestCase):
         self.assertEqual(train.shape, ratings.shape)
         self.assertEqual(test.shape, ratings.shape)
 
+    def test_split_train_test_sparse(self):
+        ratings = extras.read_ratings(self.ratings_file, cache=False)
+        train, test = extras.split_train_test(ratings, test_ratio=0.5, random_state=0)
+        self.assertEqual(train.nnz + test.nnz, ratings.nnz)
+        self.assertEqual(test.nnz, 1)
+        self.assertEqual(test.user_ids[test.user_rows()[0]], 1)
+        self.assertEqual(len(test.timestamps), 1)
+
+    def test_split_train_test_reproducible(self):
+        ratings = pd.DataFrame(np.random.RandomState(0).randint(0, 6, (20, 10)))
+        first = extras.split_train_test(ratings, random_state=3)[1]
+        second = extras.split_train_test(ratings, random_state=3)[1]
+        self.assertTrue(np.all(first.values == second.values))
+
+    def test_split_train_test_last(self):
+        ratings = extras.read_ratings(self.ratings_file, cache=False)
+        train, test = extras.split_train_test(ratings, method='last')
+        self.assertTrue(np.all(test.to_dataframe().values == [[0, 3], [0, 0]]))
+        self.assertEqual(train.nnz, 2)
+        train, test = extras.split_train_test(ratings.with_data(ratings.csr.data), method='last', n_last=5)
+        self.assertEqual(test.nnz, 1)
+
+    def test_k_fold_split(self):
+        ratings = pd.DataFrame(np.random.RandomState(0).randint(0, 6, (20, 10)))
+        n_ratings = len(ratings.values.nonzero()[0])
+        tested = np.zeros(ratings.shape)
+        for train, test in extras.k_fold_split(ratings, n_folds=4, random_state=0):
+            self.assertEqual(len(train.values.nonzero()[0]) + len(test.values.nonzero()[0]), n_ratings)
+            tested += test.values != 0
+        self.assertTrue(np.all(tested == (ratings.values != 0)))
+
     def test_clamp_default(self):
         self.assertEqual(extras.clamp(4), 4, 'Clamp default changing value in range')
 
@@ -40,4 +111,21 @@ class TestExtras(unittest.TestCase):
         self.assertEqual(map_results[2], 1, 'Clamp in map changing value at floor')
         self.assertEqual(map_results[3], 3, 'Clamp in map changing value in range')
         self.assertEqual(map_results[4], 5, 'Clamp in map changing value at ceiling')
-        self.assertEqual(map_results[5], 5, 'Clamp not handling value above ceiling')
\ No newline at end of file
+        self.assertEqual(map_results[5], 5, 'Clamp not handling value above ceiling')
+
+    def test_clamp_array(self):
+        test_array = np.asarray([-1., 0., 1., 3., 5., 6.])
+        self.assertTrue(np.all(extras.clamp(test_array) == [1, 1, 1, 3, 5, 5]))
+        self.assertEqual(test_array[0], -1.)
+        extras.clamp(test_array, copy=False)
+        self.assertEqual(test_array[0], 1.)
+
+    def test_clamp_dataframe(self):
+        clamped = extras.clamp(pd.DataFrame(np.asarray([[0, 6], [2, 3]])), floor=2, ceiling=4)
+        self.assertIsInstance(clamped, pd.DataFrame)
+        self.assertTrue(np.all(clamped.values == [[2, 4], [2, 3]]))
+
+    def test_clamp_sparse(self):
+        import scipy.sparse as sp
+        clamped = extras.clamp(sp.csr_matrix(np.asarray([[0, 7.], [-2., 3.]])))
+        self.assertTrue(np.all(clamped.toarray() == [[0, 5], [1, 3]]))
@@ -0,0 +1,103 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from implicit import ImplicitALS, solve_implicit_rows
+from persistence import load_model
+from ratings import RatingsMatrix
+
+
+class TestImplicit(unittest.TestCase):
+
+    def setUp(self):
+        # Two communities of users, each interacting with its own half of the items
+        random = np.random.RandomState(0)
+        users, items = np.arange(60) % 2, np.arange(30) % 2
+        same = users[:, np.newaxis] == items
+        values = random.randint(1, 4, size=(60, 30)) * (random.rand(60, 30) < np.where(same, 0.6, 0.02))
+        self.ratings = RatingsMatrix(sp.csr_matrix(values), user_ids=np.arange(60), item_ids=np.arange(30))
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_solve_rows(self):
+        model = ImplicitALS(self.ratings, n_factors=4, random_state=0, dtype=np.float64)
+        csr = self.ratings.csr
+        confidence = model.confidence(csr.data)
+        gram = model.item_factors.T.dot(model.item_factors)
+        rows = np.array([0, 3, 7])
+        factors = solve_implicit_rows(csr.indptr, csr.indices, confidence, model.item_factors, gram, 0.1, rows)
+
+        for position, row in enumerate(rows):
+            weights = np.ones(30)
+            preferences = np.zeros(30)
+            start, end = csr.indptr[row], csr.indptr[row + 1]
+            weights[csr.indices[start:end]] = confidence[start:end]
+            preferences[csr.indices[start:end]] = 1
+            y = model.item_factors
+            expected = np.linalg.solve(y.T.dot(weights[:, np.newaxis] * y) + 0.1 * np.eye(4),
+                                       y.T.dot(weights * preferences))
+            self.assertTrue(np.allclose(factors[position], expected))
+
+        chunked = solve_implicit_rows(csr.indptr, csr.indices, confidence, model.item_factors, gram, 0.1, rows,
+                                      max_entries=5)
+        self.assertTrue(np.allclose(factors, chunked))
+
+    def test_fit(self):
+        model = ImplicitALS(self.ratings, n_factors=4, alpha=10., random_state=0).fit(n_epochs=5)
+        losses = [record['loss'] for record in model.history]
+        self.assertTrue(np.all(np.diff(losses) <= 1e-3 * losses[0]))
+
+        recommendations = model.recommend(0, n=5)
+        rated = self.ratings.csr[0].indices
+        self.assertEqual(set(recommendations.index) & set(rated), set())
+        self.assertTrue(np.all(recommendations.index % 2 == 0))
+
+        log_model = ImplicitALS(self.ratings, n_factors=4, scaling='log', random_state=0).fit(n_epochs=2)
+        self.assertEqual(len(log_model.history), 2)
+        with self.assertRaises(KeyError):
+            ImplicitALS(self.ratings, scaling='square')
+
+    def test_validation(self):
+        csr = self.ratings.csr.tocoo()
+        held_out = np.arange(csr.nnz) % 5 == 0
+        train = RatingsMatrix(sp.csr_matrix((csr.data[~held_out], (csr.row[~held_out], csr.col[~held_out])),
+                                            shape=csr.shape), user_ids=np.arange(60), item_ids=np.arange(30))
+        test = RatingsMatrix(sp.csr_matrix((csr.data[held_out], (csr.row[held_out], csr.col[held_out])),
+                                           shape=csr.shape), user_ids=np.arange(60), item_ids=np.arange(30))
+        model = ImplicitALS(train, n_factors=4, alpha=10., random_state=0)
+        untrained = model.precision(test, n=5)
+        model.fit(n_epochs=20, validation=test, n=5, patience=2)
+        precisions = [record['validation_precision'] for record in model.history]
+        self.assertLessEqual(len(precisions), 20)
+        self.assertAlmostEqual(model.precision(test, n=5), max(precisions))
+        self.assertGreater(max(precisions), 2 * untrained)
+
+    def test_parallel(self):
+        serial = ImplicitALS(self.ratings, n_factors=4, random_state=0).fit(n_epochs=2)
+        parallel = ImplicitALS(self.ratings, n_factors=4, random_state=0, n_jobs=2).fit(n_epochs=2,
+                                                                                        memory_budget=4096)
+        self.assertTrue(np.allclose(serial.user_factors, parallel.user_factors, atol=1e-4))
+        self.assertTrue(np.allclose(serial.item_factors, parallel.item_factors, atol=1e-4))
+
+    def test_add_ratings(self):
+        model = ImplicitALS(self.ratings, n_factors=4, alpha=10., random_state=0).fit(n_epochs=5)
+        model.add_ratings([60, 60, 60, 60], [0, 2, 4, 6], [3, 3, 3, 3])
+        self.assertEqual(model.user_factors.shape, (61, 4))
+        recommendations = model.recommend(60, n=5)
+        self.assertEqual(set(recommendations.index) & {0, 2, 4, 6}, set())
+        self.assertTrue(np.all(recommendations.index % 2 == 0))
+
+    def test_save_load(self):
+        model = ImplicitALS(self.ratings, n_factors=4, random_state=0).fit(n_epochs=2)
+        model.save(self.path)
+        loaded = load_model(self.path)
+        self.assertIsInstance(loaded, ImplicitALS)
+        self.assertEqual(loaded.history, model.history)
+        self.assertTrue(np.allclose(loaded.score_user(3), model.score_user(3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from item_index import ItemNeighbourIndex
+from neighbours import NeighbourGraph
+
+
+class TestItemNeighbourIndex(unittest.TestCase):
+
+    def setUp(self):
+        indices = np.asarray([[1, 2], [2, 0], [0, 1]], dtype=np.int32)
+        weights = np.asarray([[0.5, 0.25], [1., 0.5], [0.25, 0.]])
+        self.index = ItemNeighbourIndex(NeighbourGraph(indices, weights), [10, 20, 30], adjust=None)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_score(self):
+        sums, weight_sums = self.index.score(np.asarray([0, 1]), np.asarray([2., 4.]))
+        self.assertTrue(np.allclose(sums, [2., 1., 4.5]))
+        self.assertTrue(np.allclose(weight_sums, [0.5, 0.5, 1.25]))
+
+    def test_save_load(self):
+        self.index.save(self.path)
+        loaded = ItemNeighbourIndex.load(self.path)
+        self.assertIsInstance(loaded.neighbours.indices, np.memmap)
+        self.assertIsNone(loaded.adjust)
+        self.assertEqual(loaded.similarity, 'cosine')
+        self.assertTrue(np.all(loaded.item_ids == [10, 20, 30]))
+        self.assertTrue(np.all(loaded.neighbours.weights == self.index.neighbours.weights))
@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+import scipy.sparse as sp
+from extras import get_rmse, split_train_test
+from latent_factors import LatentFactorModel, solve_rows
+from ratings import RatingsMatrix
+
+
+class TestLatentFactorModel(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        user_factors = random.normal(size=(200, 2))
+        item_factors = random.normal(size=(100, 2))
+        ratings_values = np.clip(np.round(3 + user_factors.dot(item_factors.T)), 1, 5)
+        ratings_values *= random.rand(200, 100) < 0.2
+        self.ratings = RatingsMatrix(sp.csr_matrix(ratings_values))
+
+    def test_unknown_method(self):
+        self.assertRaises(KeyError, LatentFactorModel, self.ratings, 2, 0.1, 'gd')
+
+    def test_als_fits_known_ratings(self):
+        lf = LatentFactorModel(self.ratings, n_factors=2, reg=0.1, method='als', random_state=0).fit(n_epochs=10)
+        self.assertEqual(len(lf.history), 10)
+        self.assertLess(lf.history[-1]['train_rmse'], 0.5)
+        self.assertAlmostEqual(get_rmse(lf.predict(), self.ratings), lf.history[-1]['train_rmse'])
+
+    def test_memory_budget(self):
+        # A budget of a few ratings per chunk solves the same normal equations as one large chunk
+        small = LatentFactorModel(self.ratings, n_factors=2, random_state=0).fit(n_epochs=2, memory_budget=200)
+        large = LatentFactorModel(self.ratings, n_factors=2, random_state=0).fit(n_epochs=2)
+        self.assertTrue(np.allclose(small.user_factors, large.user_factors))
+        self.assertTrue(np.allclose(small.item_biases, large.item_biases))
+
+        csr = self.ratings.csr
+        rows = np.arange(10)
+        solution = solve_rows(csr.indptr, csr.indices, csr.data, large.item_factors, large.item_biases,
+                              large.global_mean, 0.1, rows, max_entries=1)
+        for row in rows:
+            columns = csr.indices[csr.indptr[row]:csr.indptr[row + 1]]
+            extended = np.hstack((large.item_factors[columns], np.ones((len(columns), 1))))
+            targets = csr.data[csr.indptr[row]:csr.indptr[row + 1]] - large.global_mean - large.item_biases[columns]
+            expected = np.linalg.solve(extended.T.dot(extended) + 0.1 * np.eye(3), extended.T.dot(targets))
+            self.assertTrue(np.allclose(solution[row], expected))
+
+    def test_early_stopping(self):
+        train, validation = split_train_test(self.ratings, test_ratio=0.2, random_state=0)
+        for method in ('als', 'sgd'):
+            lf = LatentFactorModel(train, n_factors=2, reg=0.05, method=method, random_state=0)
+            lf.fit(n_epochs=200, validation=validation, patience=2)
+            validation_rmses = [epoch['validation_rmse'] for epoch in lf.history]
+            self.assertLess(len(validation_rmses), 200)
+            self.assertAlmostEqual(get_rmse(lf.predict_ratings(validation), validation), min(validation_rmses))
+
+    def test_score_user(self):
+        lf = LatentFactorModel(self.ratings, n_factors=2, random_state=0).fit(n_epochs=2)
+        self.assertTrue(np.allclose(lf.score_user(3), lf.predict().values[3]))
+
+    def test_add_ratings(self):
+        lf = LatentFactorModel(self.ratings, n_factors=2, random_state=0).fit(n_epochs=10)
+        user_factors, item_factors = lf.user_factors.copy(), lf.item_factors.copy()
+        items = self.ratings.csr[0].indices
+        values = self.ratings.csr[0].data
+        lf.add_ratings(np.full(len(items), 'new', dtype=object), self.ratings.item_ids[items], values)
+        self.assertEqual(lf.user_factors.shape, (201, 2))
+        self.assertTrue(np.allclose(lf.user_factors[:200], user_factors))
+        unrated = np.setdiff1d(np.arange(100), items)
+        self.assertTrue(np.allclose(lf.item_factors[unrated], item_factors[unrated]))
+        self.assertLess(np.sqrt(np.mean((lf.score_user(200)[items] - values) ** 2)), 0.5)
+
+        # A new user rating many items 5 moves the mean, the refreshed mean matches a model built on the new ratings
+        global_mean = lf.global_mean
+        lf.add_ratings(np.full(100, 'fan', dtype=object), self.ratings.item_ids[:100], np.full(100, 5))
+        self.assertGreater(lf.global_mean, global_mean + 0.04)
+        self.assertAlmostEqual(lf.global_mean, LatentFactorModel(self.ratings.csr, n_factors=2).global_mean)
+        self.assertLess(np.sqrt(np.mean((lf.score_user(201) - 5) ** 2)), 0.5)
+
+    def test_add_ratings_empty(self):
+        lf = LatentFactorModel(self.ratings, n_factors=2, random_state=0).fit(n_epochs=3)
+        user_factors, item_factors = lf.user_factors.copy(), lf.item_factors.copy()
+        lf.add_ratings([], [], [])
+        self.assertTrue(np.array_equal(lf.user_factors, user_factors))
+        self.assertTrue(np.array_equal(lf.item_factors, item_factors))
+
+    def test_single_precision(self):
+        single = LatentFactorModel(self.ratings, n_factors=2, random_state=0, dtype=np.float32).fit(n_epochs=3)
+        double = LatentFactorModel(self.ratings, n_factors=2, random_state=0).fit(n_epochs=3)
+        self.assertEqual(single.user_factors.dtype, np.float32)
+        self.assertEqual(single.item_biases.dtype, np.float32)
+        self.assertAlmostEqual(single.history[-1]['train_rmse'], double.history[-1]['train_rmse'], places=4)
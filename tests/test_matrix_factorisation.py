@@ -0,0 +1,76 @@
+import unittest
+import pandas as pd
+import numpy as np
+from matrix_factorisation import MatrixFactorisation
+
+
+class TestMatrixFactorisation(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        ratings_values = random.randint(1, 6, (30, 20)) * (random.rand(30, 20) < 0.5)
+        self.ratings = pd.DataFrame(ratings_values)
+
+    def test_truncated_solvers_match_full(self):
+        full = MatrixFactorisation(self.ratings)
+        for solver in ('randomized', 'arpack'):
+            mf = MatrixFactorisation(self.ratings, rank=4, solver=solver, n_iter=10, random_state=0)
+            self.assertEqual(mf.U.shape, (30, 4))
+            self.assertEqual(mf.T.shape, (4, 20))
+            self.assertTrue(np.allclose(mf.eps, full.eps[:4], atol=1e-6))
+
+    def test_predict_beyond_rank(self):
+        mf = MatrixFactorisation(self.ratings, rank=3, random_state=0)
+        self.assertRaises(ValueError, mf.predict, 5)
+
+    def test_fold_in_existing_user(self):
+        mf = MatrixFactorisation(self.ratings, rank=5, solver='arpack')
+        user_ratings = self.ratings.iloc[4]
+        user_ratings = user_ratings[user_ratings > 0]
+        factors = mf.fold_in('new', user_ratings)
+        self.assertTrue(np.allclose(factors, mf.U[4]))
+        self.assertEqual(mf.U.shape, (31, 5))
+        self.assertTrue(np.allclose(mf.score_user(30), mf.score_user(4)))
+        self.assertEqual(list(mf.recommend('new', n=3).index), list(mf.recommend(4, n=3).index))
+
+    def test_add_ratings_refolds_users(self):
+        mf = MatrixFactorisation(self.ratings, rank=5, solver='arpack')
+        U = mf.U.copy()
+        users = mf.add_ratings([2, 2, 'new'], [0, 'new item', 3], [5, 4, 2])
+        self.assertTrue(np.all(users == [2, 30]))
+        self.assertEqual(mf.U.shape, (31, 5))
+        self.assertEqual(mf.T.shape, (5, 21))
+        self.assertTrue(np.allclose(mf.U[:30][np.arange(30) != 2], U[np.arange(30) != 2]))
+        self.assertFalse(np.allclose(mf.U[2], U[2]))
+        self.assertTrue(np.allclose(mf.score_user(2)[20], mf.user_means.values[2, 0]))
+        self.assertEqual(mf.known_ratings.nnz, (self.ratings.values > 0).sum() + 3)
+
+    def test_recommend_with_ann_index(self):
+        mf = MatrixFactorisation(self.ratings, rank=5, solver='arpack')
+        exact = mf.recommend(3, n=4)
+        mf.build_ann_index(n_lists=4, random_state=0)
+        approximate = mf.recommend(3, n=4, n_probe=4)
+        self.assertTrue(np.allclose(approximate.values, exact.values))
+        self.assertTrue(np.allclose(approximate.values, mf.score(3, approximate.index)))
+        self.assertEqual(len(mf.recommend(3, n=4, n_probe=1)), 4)
+        self.assertEqual(len(mf.recommend(3, n=4, k=2)), 4)
+
+    def test_single_precision_matches_double(self):
+        single = MatrixFactorisation(self.ratings, rank=4, random_state=0, dtype=np.float32)
+        double = MatrixFactorisation(self.ratings, rank=4, random_state=0)
+        self.assertEqual(single.U.dtype, np.float32)
+        self.assertEqual(single.predict().values.dtype, np.float32)
+        self.assertTrue(np.allclose(single.predict().values, double.predict().values, atol=1e-4))
+
+    def test_baseline_adjustment(self):
+        mf = MatrixFactorisation(self.ratings, rank=5, solver='arpack', adjust='baseline')
+        global_mean, user_biases, item_biases = mf.biases
+        full = MatrixFactorisation(self.ratings, adjust='baseline')
+        self.assertTrue(np.allclose(np.clip(full.U.dot(np.diag(full.eps)).dot(full.T) + global_mean +
+                                            user_biases[:, np.newaxis] + item_biases, 1, 5)[self.ratings.values > 0],
+                                    self.ratings.values[self.ratings.values > 0]))
+        self.assertTrue(np.allclose(mf.score_user(3), mf.predict().values[3]))
+        exact = mf.recommend(3, n=4)
+        mf.build_ann_index(n_lists=4, random_state=0)
+        self.assertTrue(np.allclose(mf.recommend(3, n=4, n_probe=4).values, exact.values))
+        self.assertRaises(KeyError, MatrixFactorisation, self.ratings, adjust='mean')
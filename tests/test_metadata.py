@@ -0,0 +1,45 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from metadata import FeatureMatrix, read_movies, read_users
+
+
+class TestMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.users_file = os.path.join(self.path, 'users.dat')
+        self.movies_file = os.path.join(self.path, 'movies.dat')
+        with open(self.users_file, 'w') as users_file:
+            users_file.write('1::F::1::10::48067\n2::M::56::16::70072\n')
+        with open(self.movies_file, 'w', encoding='latin-1') as movies_file:
+            movies_file.write("1::Toy Story (1995)::Animation|Children's|Comedy\n"
+                              "2::Cit\xe9 des enfants perdus, La (1995)::Adventure|Sci-Fi\n"
+                              "3::Untitled::Drama\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_read_users(self):
+        users = read_users(self.users_file)
+        self.assertEqual(users.shape, (2, 8))
+        self.assertEqual(list(users.ids), [1, 2])
+        row = users.matrix[1].toarray()[0]
+        self.assertEqual(sorted(np.asarray(users.names)[row > 0]), ['age=56', 'gender=M', 'occupation=16', 'region=7'])
+
+    def test_read_movies(self):
+        movies = read_movies(self.movies_file)
+        self.assertIn('decade=1990', movies.names)
+        self.assertEqual(list(movies.matrix.getnnz(axis=1)), [4, 3, 1])
+
+    def test_align_and_save(self):
+        movies = read_movies(self.movies_file)
+        aligned = movies.align([3, 99, 1])
+        self.assertEqual(list(aligned.getnnz(axis=1)), [1, 0, 4])
+
+        movies.save(os.path.join(self.path, 'movies'))
+        loaded = FeatureMatrix.load(os.path.join(self.path, 'movies'))
+        self.assertEqual(loaded.names, movies.names)
+        self.assertEqual((loaded.matrix != movies.matrix).nnz, 0)
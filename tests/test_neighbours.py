@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+import scipy.sparse as sp
+from neighbours import NeighbourGraph, select_top_k, top_k_neighbours
+
+
+class TestNeighbours(unittest.TestCase):
+
+    def test_select_top_k(self):
+        block = np.asarray([[1., 0.2, 0.9, 0.5],
+                            [0.3, 1., 0.1, 0.7]])
+        indices, weights = select_top_k(block, 2)
+        self.assertTrue(np.all(indices == [[2, 3], [3, 0]]))
+        self.assertTrue(np.all(weights == [[0.9, 0.5], [0.7, 0.3]]))
+
+    def test_select_top_k_row_offset(self):
+        block = np.asarray([[0.9, 0.2, 1.]])
+        indices, weights = select_top_k(block, 1, row_offset=2)
+        self.assertTrue(np.all(indices == [[0]]))
+
+    def test_top_k_neighbours_blocks(self):
+        similarity = np.random.RandomState(0).rand(7, 7)
+        graph = top_k_neighbours(similarity, 3, block_size=2)
+        self.assertEqual(graph.shape, (7, 3))
+        for row in range(7):
+            others = np.delete(similarity[row], row)
+            self.assertTrue(np.allclose(graph.weights[row], np.sort(others)[::-1][:3]))
+            self.assertNotIn(row, graph.indices[row])
+
+    def test_top_k_neighbours_sparse(self):
+        similarity = sp.csr_matrix(np.asarray([[1., 0.5, 0.], [0.5, 1., 0.], [0., 0., 1.]]))
+        graph = top_k_neighbours(similarity, 5)
+        self.assertEqual(graph.k, 2)
+        self.assertTrue(np.all(graph.to_sparse().toarray() == [[0., 0.5, 0.], [0.5, 0., 0.], [0., 0., 0.]]))
+
+    def test_to_sparse_leaves_graph_unchanged(self):
+        graph = NeighbourGraph(np.asarray([[1, 2], [0, 2], [0, 1]]), np.asarray([[0.5, 0.], [0., 0.], [0.25, 0.125]]))
+        graph.to_sparse()
+        self.assertTrue(np.all(graph.weights == [[0.5, 0.], [0., 0.], [0.25, 0.125]]))
+        self.assertTrue(np.all(graph.indices == [[1, 2], [0, 2], [0, 1]]))
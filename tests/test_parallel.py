@@ -0,0 +1,50 @@
+import unittest
+import os
+import numpy as np
+import scipy.sparse as sp
+from latent_factors import LatentFactorModel
+from parallel import WorkerPool, partition
+from ratings import RatingsMatrix
+from similarity import SimilarityEngine
+
+
+def _scaled_sum(shared, start, end, scale):
+    return scale * shared['values'][start:end].sum() + shared['ratings'].nnz
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.ratings_values = random.randint(1, 6, size=(30, 20)) * (random.rand(30, 20) < 0.4)
+        self.ratings = RatingsMatrix(sp.csr_matrix(self.ratings_values))
+
+    def test_partition(self):
+        self.assertEqual(partition(10, 3), [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(partition(2, 4), [(0, 1), (1, 2)])
+        self.assertEqual(partition(0, 4), [])
+
+    def test_worker_pool(self):
+        shared = {'values': np.arange(10.), 'ratings': self.ratings}
+        tasks = [(start, end, 2.) for start, end in partition(10, 4)]
+        with WorkerPool(1, shared) as pool:
+            inline = list(pool.map(_scaled_sum, tasks))
+            self.assertIsNone(pool.path)
+        with WorkerPool(2, shared) as pool:
+            self.assertEqual(list(pool.map(_scaled_sum, tasks)), inline)
+            path = pool.path
+        self.assertEqual(inline[0], 2 * 1. + self.ratings.nnz)
+        self.assertFalse(os.path.exists(path))
+
+    def test_top_k(self):
+        serial = SimilarityEngine(self.ratings.csr, method='pearson').top_k(4)
+        engine = SimilarityEngine(self.ratings.csr, method='pearson', memory_budget=4 * 8 * 30 * 5, n_jobs=2)
+        parallel = engine.top_k(4)
+        self.assertTrue(np.array_equal(parallel.indices, serial.indices))
+        self.assertTrue(np.allclose(parallel.weights, serial.weights))
+
+    def test_als(self):
+        serial = LatentFactorModel(self.ratings, n_factors=3, random_state=0).fit(n_epochs=2)
+        parallel = LatentFactorModel(self.ratings, n_factors=3, random_state=0, n_jobs=2).fit(n_epochs=2)
+        self.assertTrue(np.allclose(parallel.user_factors, serial.user_factors))
+        self.assertTrue(np.allclose(parallel.item_biases, serial.item_biases))
@@ -0,0 +1,103 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from baseline_predictors import BaselinePredictor
+from collaborative_filtering import CollaborativeFiltering
+from latent_factors import LatentFactorModel
+from matrix_factorisation import MatrixFactorisation
+from persistence import load_arrays, load_model, read_manifest, save_arrays
+from ratings import RatingsMatrix
+
+
+class TestPersistence(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        ratings_values = random.randint(1, 6, size=(40, 25)) * (random.rand(40, 25) < 0.4)
+        user_ids = np.asarray(['u{0}'.format(user) for user in range(40)], dtype=object)
+        self.ratings = RatingsMatrix(sp.csr_matrix(ratings_values), user_ids=user_ids,
+                                     timestamps=random.randint(0, 1000, size=np.count_nonzero(ratings_values)))
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_same_scores(self, model, loaded, **options):
+        for user in (0, 17, 39):
+            self.assertTrue(np.allclose(model.score_user(user, **options), loaded.score_user(user, **options)))
+
+    def test_save_arrays(self):
+        save_arrays(self.path, {'values': np.arange(4), 'ids': np.asarray([1, 'a'], dtype=object), 'none': None},
+                    {'setting': 2})
+        arrays, manifest = load_arrays(self.path)
+        self.assertIsInstance(arrays['values'], np.memmap)
+        self.assertEqual(list(arrays['ids']), [1, 'a'])
+        self.assertNotIn('none', arrays)
+        self.assertEqual(manifest['setting'], 2)
+
+        # A pickled array is never loaded, so a crafted directory can not run code
+        np.save(os.path.join(self.path, 'values.npy'), np.asarray([{'a': 1}], dtype=object), allow_pickle=True)
+        self.assertRaises(ValueError, load_arrays, self.path)
+
+        manifest['version'] = 0
+        with open(os.path.join(self.path, 'manifest.json'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        self.assertRaises(ValueError, load_arrays, self.path)
+
+    def test_ratings(self):
+        self.ratings.save(self.path)
+        loaded = RatingsMatrix.load(self.path)
+        self.assertEqual((loaded.csr != self.ratings.csr).nnz, 0)
+        self.assertEqual(list(loaded.user_ids), list(self.ratings.user_ids))
+        self.assertTrue(np.array_equal(loaded.timestamps, self.ratings.timestamps))
+        self.assertFalse(loaded.csr.data.flags.writeable)
+
+    def test_baseline_predictor(self):
+        model = BaselinePredictor(self.ratings, dtype=np.float32)
+        model.save(self.path)
+        loaded = load_model(self.path)
+        self.assertIsInstance(loaded, BaselinePredictor)
+        self.assertEqual(loaded.dtype, np.float32)
+        self.assert_same_scores(model, loaded)
+
+    def test_collaborative_filtering(self):
+        model = CollaborativeFiltering(self.ratings)
+        model.build_user_neighbours(k=5)
+        model.build_item_index(k=5)
+        model.save(self.path)
+        loaded = load_model(self.path)
+        self.assertEqual(loaded.user_neighbours_options, model.user_neighbours_options)
+        self.assertTrue(np.array_equal(loaded.user_neighbours.indices, model.user_neighbours.indices))
+        self.assert_same_scores(model, loaded, k=5)
+        self.assert_same_scores(model, loaded, method='item_item', adjust='mean', k=5)
+        for artifact in ('user_neighbours', 'item_index'):
+            self.assertIn('indices', read_manifest(os.path.join(self.path, artifact))['arrays'])
+
+        loaded.add_ratings(['u0', 'new'], [3, 3], [5, 4], timestamps=[1, 2])
+        model.add_ratings(['u0', 'new'], [3, 3], [5, 4], timestamps=[1, 2])
+        self.assert_same_scores(model, loaded, k=5)
+
+    def test_matrix_factorisation(self):
+        model = MatrixFactorisation(self.ratings, rank=4, random_state=0)
+        model.build_ann_index(k=4, n_lists=3, random_state=0)
+        model.save(self.path)
+        loaded = load_model(self.path)
+        self.assertIsInstance(loaded.T, np.memmap)
+        self.assertTrue(np.array_equal(loaded.predict(k=3).values, model.predict(k=3).values))
+        self.assertTrue(np.array_equal(loaded.recommend('u3', n=5, k=4).index, model.recommend('u3', n=5, k=4).index))
+
+    def test_latent_factor_model(self):
+        model = LatentFactorModel(self.ratings, n_factors=3, random_state=0).fit(n_epochs=3)
+        model.save(self.path)
+        loaded = load_model(self.path, mmap_mode=None)
+        self.assertEqual(loaded.history, model.history)
+        self.assert_same_scores(model, loaded)
+        loaded.fit(n_epochs=1)
+
+    def test_unknown_model(self):
+        save_arrays(self.path, {}, {'model': 'Unknown'})
+        self.assertRaises(KeyError, load_model, self.path)
@@ -0,0 +1,66 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+import profiling
+from collaborative_filtering import CollaborativeFiltering
+from matrix_factorisation import MatrixFactorisation
+from profiling import Profiler, stage
+from ratings import RatingsMatrix
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        ratings_values = random.randint(1, 6, size=(30, 20)) * (random.rand(30, 20) < 0.4)
+        self.ratings = RatingsMatrix(sp.csr_matrix(ratings_values))
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_disabled(self):
+        self.assertIsNone(profiling._active)
+        with stage('anything') as current:
+            current.record(values=np.zeros(3))
+        CollaborativeFiltering(self.ratings).predict_user_user(k=3)
+
+    def test_stages(self):
+        with Profiler() as profiler:
+            CollaborativeFiltering(self.ratings).predict_user_user(k=3)
+            with stage('outer') as current:
+                values = np.ones((100, 100))
+                current.record(values=values)
+        self.assertIsNone(profiling._active)
+        names = [record['name'] for record in profiler.records]
+        for name in ('CollaborativeFiltering.adjust_ratings', 'CollaborativeFiltering.knn',
+                     'CollaborativeFiltering.dot_product', 'CollaborativeFiltering.normalise',
+                     'CollaborativeFiltering.adjust_predictions', 'clamp'):
+            self.assertIn(name, names)
+        records = dict((record['name'], record) for record in profiler.records)
+        self.assertEqual(records['CollaborativeFiltering.predict_user_user']['depth'], 0)
+        self.assertEqual(records['CollaborativeFiltering.dot_product']['depth'], 1)
+        self.assertEqual(records['CollaborativeFiltering.dot_product']['shapes'], {'predictions': [30, 20]})
+        self.assertGreaterEqual(records['outer']['peak_bytes'], values.nbytes)
+        self.assertGreaterEqual(records['CollaborativeFiltering.predict_user_user']['peak_bytes'],
+                                records['CollaborativeFiltering.dot_product']['peak_bytes'])
+        self.assertEqual(profiler.summary().loc['CollaborativeFiltering.predict_user_user', 'calls'], 1)
+
+    def test_export(self):
+        with Profiler(trace_memory=False) as profiler:
+            MatrixFactorisation(self.ratings, rank=3, random_state=0).predict()
+        self.assertIn('MatrixFactorisation.svd', profiler.summary().index)
+
+        profiler.to_json(os.path.join(self.path, 'stages.json'))
+        with open(os.path.join(self.path, 'stages.json')) as stages_file:
+            self.assertEqual(len(json.load(stages_file)['records']), len(profiler.records))
+
+        profiler.to_chrome_trace(os.path.join(self.path, 'trace.json'))
+        with open(os.path.join(self.path, 'trace.json')) as trace_file:
+            events = json.load(trace_file)['traceEvents']
+        self.assertEqual(set(event['ph'] for event in events), {'X'})
+        self.assertIn('MatrixFactorisation.predict', [event['name'] for event in events])
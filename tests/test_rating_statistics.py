@@ -0,0 +1,62 @@
+import unittest
+import pandas as pd
+import numpy as np
+from baseline_predictors import BaselinePredictor
+from collaborative_filtering import CollaborativeFiltering
+from rating_statistics import fit_biases, get_biases, get_statistics
+from ratings import as_ratings_matrix
+
+
+class TestRatingsStatistics(unittest.TestCase):
+
+    def setUp(self):
+        ratings_values = np.asarray([[2, 0, 4, 3, 0],
+                                     [0, 3, 0, 3, 0],
+                                     [4, 0, 0, 0, 5],
+                                     [0, 0, 0, 0, 0],
+                                     [5, 0, 4, 3, 1]])
+        self.ratings = as_ratings_matrix(pd.DataFrame(ratings_values))
+
+    def test_statistics(self):
+        statistics = get_statistics(self.ratings)
+        self.assertTrue(np.all(statistics.user_counts == [3, 2, 2, 0, 4]))
+        self.assertTrue(np.all(statistics.user_means == [3., 3., 4.5, 0., 3.25]))
+        self.assertTrue(np.all(statistics.user_std_devs == [np.sqrt(2./3.), 0., 0.5, 0., np.sqrt(2.1875)]))
+        self.assertTrue(np.all(statistics.item_means == [11./3., 3., 4., 3., 3.]))
+        self.assertAlmostEqual(statistics.global_mean, 37./11.)
+        self.assertTrue(np.allclose(statistics.item_biases, statistics.item_means - 37./11.))
+        self.assertEqual(statistics.user_biases[3], 0.)
+
+    def test_shared_between_models(self):
+        statistics = get_statistics(self.ratings)
+        BaselinePredictor(self.ratings).predict_item_user_based()
+        CollaborativeFiltering(self.ratings)
+        self.assertIs(get_statistics(self.ratings), statistics)
+
+    def test_invalidated_on_change(self):
+        statistics = get_statistics(self.ratings)
+        self.ratings.csr.data[0] = 5
+        self.ratings.changed()
+        self.assertIsNot(get_statistics(self.ratings), statistics)
+        self.assertEqual(get_statistics(self.ratings).user_means[0], 4.)
+
+    def test_fit_biases(self):
+        global_mean, user_biases, item_biases = fit_biases(self.ratings, reg_users=2., reg_items=3., n_iter=200)
+        rows, cols = self.ratings.user_rows(), self.ratings.csr.indices
+        design = np.zeros((len(rows), 10))
+        design[np.arange(len(rows)), rows] = 1
+        design[np.arange(len(rows)), 5 + cols] = 1
+        penalty = np.diag([2.] * 5 + [3.] * 5)
+        residuals = self.ratings.csr.data - 37. / 11.
+        expected = np.linalg.solve(design.T.dot(design) + penalty, design.T.dot(residuals))
+        self.assertAlmostEqual(global_mean, 37. / 11.)
+        self.assertTrue(np.allclose(user_biases, expected[:5]))
+        self.assertTrue(np.allclose(item_biases, expected[5:]))
+        self.assertEqual(user_biases[3], 0.)
+
+    def test_biases_shared_and_invalidated(self):
+        biases = get_biases(self.ratings)
+        self.assertIs(BaselinePredictor(self.ratings).biases, biases)
+        self.assertIsNot(get_biases(self.ratings, reg_users=1.), biases)
+        self.ratings.add_ratings([3], [1], [5])
+        self.assertGreater(get_biases(self.ratings)[1][3], 0.)
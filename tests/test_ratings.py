@@ -0,0 +1,79 @@
+import unittest
+import pandas as pd
+import numpy as np
+from ratings import RatingsMatrix, as_ratings_matrix
+
+
+class TestRatingsMatrix(unittest.TestCase):
+
+    def test_from_dataframe(self):
+        ratings_values = np.asarray([[2, 0, 4],
+                                     [0, 3, 0]])
+        ratings = RatingsMatrix.from_dataframe(pd.DataFrame(ratings_values, index=[10, 20], columns=[1, 2, 3]))
+        self.assertEqual(ratings.shape, (2, 3))
+        self.assertEqual(ratings.nnz, 3)
+        self.assertTrue(np.all(ratings.user_ids == [10, 20]))
+        self.assertTrue(np.all(ratings.to_dataframe().values == ratings_values))
+
+    def test_from_coo(self):
+        ratings = RatingsMatrix.from_coo([7, 3, 7], [100, 5, 5], [4, 1, 2], dtype='int8')
+        self.assertEqual(ratings.shape, (2, 2))
+        self.assertEqual(ratings.csr.dtype, np.int8)
+        self.assertTrue(np.all(ratings.user_ids == [3, 7]))
+        self.assertTrue(np.all(ratings.item_ids == [5, 100]))
+        self.assertTrue(np.all(ratings.to_dataframe().values == [[1, 0], [2, 4]]))
+
+    def test_from_coo_empty(self):
+        ratings = RatingsMatrix.from_coo([], [], [])
+        self.assertEqual(ratings.shape, (0, 0))
+        self.assertEqual(ratings.nnz, 0)
+
+    def test_index_lookup(self):
+        ratings = RatingsMatrix.from_coo([7, 3], [100, 5], [4, 1])
+        self.assertEqual(ratings.user_index(7), 1)
+        self.assertTrue(np.all(ratings.item_index([100, 5]) == [1, 0]))
+        self.assertRaises(KeyError, ratings.user_index, [8])
+
+    def test_statistics(self):
+        ratings_values = np.asarray([[2, 0, 4, 3, 0],
+                                     [0, 3, 0, 3, 0],
+                                     [4, 0, 0, 0, 5],
+                                     [0, 0, 0, 0, 0],
+                                     [5, 0, 4, 3, 1]])
+        ratings = as_ratings_matrix(pd.DataFrame(ratings_values))
+        self.assertTrue(np.all(ratings.user_means() == [3., 3., 4.5, 0., 3.25]))
+        self.assertTrue(np.all(ratings.user_std_devs() == [np.sqrt(2./3.), 0., 0.5, 0., np.sqrt(2.1875)]))
+        self.assertTrue(np.all(ratings.item_means() == [11./3., 3., 4., 3., 3.]))
+
+    def test_with_data_keeps_zeros(self):
+        ratings = RatingsMatrix.from_coo([0, 0, 1], [0, 1, 1], [1, 3, 2])
+        adjusted = ratings.with_data(np.zeros(3))
+        self.assertEqual(adjusted.nnz, 3)
+        self.assertEqual(adjusted.shape, ratings.shape)
+
+    def test_add_ratings(self):
+        ratings = RatingsMatrix.from_coo([3, 7], [5, 100], [1, 4], dtype='int8')
+        rows, cols = ratings.add_ratings([7, 9, 3, 3], [5, 100, 5, 8], [2, 3, 5, 4])
+        self.assertEqual(ratings.version, 1)
+        self.assertTrue(np.all(ratings.user_ids == [3, 7, 9]))
+        self.assertTrue(np.all(ratings.item_ids == [5, 100, 8]))
+        self.assertEqual(ratings.csr.dtype, np.int8)
+        self.assertTrue(np.all(ratings.to_dataframe().values == [[5, 0, 4], [2, 4, 0], [0, 3, 0]]))
+        self.assertEqual(sorted(zip(rows, cols)), [(0, 0), (0, 2), (1, 0), (2, 1)])
+
+    def test_add_ratings_empty(self):
+        ratings = RatingsMatrix.from_coo([3, 7], [5, 100], [1, 4], timestamps=[10, 20])
+        rows, cols = ratings.add_ratings([], [], [], timestamps=[])
+        self.assertEqual((len(rows), len(cols)), (0, 0))
+        self.assertTrue(np.all(ratings.user_ids == [3, 7]))
+        self.assertTrue(np.all(ratings.to_dataframe().values == [[1, 0], [0, 4]]))
+        self.assertTrue(np.all(ratings.timestamps == [10, 20]))
+
+    def test_add_ratings_updates_statistics(self):
+        ratings = RatingsMatrix.from_coo([0, 0, 1, 2], [0, 1, 1, 2], [1, 3, 2, 5])
+        ratings.user_means()
+        ratings.add_ratings([0, 1, 3, 3], [0, 2, 1, 4], [4, 5, 2, 1])
+        refit = RatingsMatrix(ratings.csr.copy())
+        self.assertTrue(np.allclose(ratings.user_means(), refit.user_means()))
+        self.assertTrue(np.allclose(ratings.user_std_devs(), refit.user_std_devs()))
+        self.assertTrue(np.allclose(ratings.item_means(), refit.item_means()))
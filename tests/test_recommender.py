@@ -0,0 +1,19 @@
+import unittest
+import numpy as np
+from recommender import top_n
+
+
+class TestRecommender(unittest.TestCase):
+
+    def test_top_n(self):
+        scores = np.asarray([0.5, 3., 1., 2., 4.])
+        self.assertEqual(list(top_n(scores, 3)), [4, 1, 3])
+
+    def test_top_n_exclude(self):
+        scores = np.asarray([0.5, 3., 1., 2., 4.])
+        self.assertEqual(list(top_n(scores, 3, exclude=[4, 3])), [1, 2, 0])
+
+    def test_top_n_more_than_available(self):
+        scores = np.asarray([0.5, 3., 1.])
+        self.assertEqual(list(top_n(scores, 5, exclude=[1])), [2, 0])
+        self.assertEqual(len(top_n(scores, 0)), 0)
@@ -0,0 +1,111 @@
+import unittest
+import asyncio
+import json
+import numpy as np
+import scipy.sparse as sp
+from content_based import ContentBasedPredictor
+from latent_factors import LatentFactorModel
+from metadata import FeatureMatrix
+from ratings import RatingsMatrix
+from service import RecommendationService
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        ratings_values = random.randint(1, 6, size=(30, 20)) * (random.rand(30, 20) < 0.4)
+        self.ratings = RatingsMatrix(sp.csr_matrix(ratings_values), user_ids=np.arange(100, 130),
+                                     item_ids=np.arange(20))
+        self.model = LatentFactorModel(self.ratings, n_factors=3, random_state=0).fit(n_epochs=3)
+        self.service = RecommendationService(self.model, batch_wait=0.01)
+        self.batch_sizes = []
+        score_users = self.model.score_users
+
+        def counting_score_users(users, **options):
+            self.batch_sizes.append(len(users))
+            return score_users(users, **options)
+        self.model.score_users = counting_score_users
+
+    def run_service(self, coroutine_function):
+        async def run():
+            await self.service.start(port=0)
+            try:
+                return await coroutine_function()
+            finally:
+                await self.service.close()
+        return asyncio.run(run())
+
+    def test_batching(self):
+        async def requests():
+            return await asyncio.gather(*[self.service.recommend(user_id, n=5) for user_id in (100, 107, 100, 129)])
+        results = self.run_service(requests)
+        self.assertEqual(self.batch_sizes, [3])
+        expected = self.model.recommend(107, n=5)
+        self.assertEqual(results[1][0], list(expected.index))
+        self.assertTrue(np.allclose(results[1][1], expected.values))
+
+    def test_cache_invalidation(self):
+        async def requests():
+            first = await self.service.recommend(100, n=5)
+            await self.service.recommend(100, n=5)
+            await self.service.recommend(101, n=5)
+            self.assertEqual(self.service.counters['cache_hits'], 1)
+            await self.service.add_ratings([100], [first[0][0]], [1])
+            self.assertEqual([key[0] for key in self.service.cache], [101])
+            second = await self.service.recommend(100, n=5)
+            self.assertNotIn(first[0][0], second[0])
+            await self.service.add_ratings([101], ['new'], [5])
+            self.assertEqual(len(self.service.cache), 0)
+        self.run_service(requests)
+        self.assertEqual(self.batch_sizes, [1, 1, 1])
+
+    def test_http(self):
+        async def requests():
+            port = self.service.server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            responses = []
+            body = json.dumps({'user_ids': [103], 'item_ids': [2], 'ratings': [4]})
+            for request in ('GET /score?user=103&items=2,5 HTTP/1.1\r\n\r\n',
+                            'GET /recommend?user=999 HTTP/1.1\r\n\r\n',
+                            'POST /ratings HTTP/1.1\r\nContent-Length: {0}\r\n\r\n{1}'.format(len(body), body),
+                            'GET /health HTTP/1.1\r\nConnection: close\r\n\r\n'):
+                writer.write(request.encode('latin-1'))
+                status = int((await reader.readline()).split()[1])
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1')
+                    if not line.strip():
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                payload = json.loads((await reader.readexactly(int(headers['content-length']))).decode('utf-8'))
+                responses.append((status, payload))
+            self.assertEqual(await reader.read(), b'')
+            writer.close()
+            return responses
+        expected = self.model.score(103, [2, 5]).values
+        responses = self.run_service(requests)
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(responses[0][1]['items'], [2, 5])
+        self.assertTrue(np.allclose(responses[0][1]['scores'], expected))
+        self.assertEqual(responses[1][0], 404)
+        self.assertEqual(responses[2], (200, {'added': 1}))
+        self.assertEqual(responses[3][1]['updates'], 1)
+
+    def test_cold_start_user(self):
+        user_features = FeatureMatrix.from_lists(np.arange(100, 131), [['group=' + 'ab'[user % 2]]
+                                                                       for user in range(100, 131)])
+        item_features = FeatureMatrix.from_lists(np.arange(20), [['genre=' + 'xy'[item % 2]] for item in range(20)])
+        model = ContentBasedPredictor(self.ratings, user_features=user_features, item_features=item_features)
+        self.service = RecommendationService(model, batch_wait=0.01)
+
+        async def requests():
+            return await asyncio.gather(self.service.recommend(130, n=5), self.service.score(130, [2, 5]),
+                                        self.service.recommend(101, n=5))
+        new_user, scores, known_user = self.run_service(requests)
+        expected = model.score_new_user(130)
+        self.assertEqual(new_user[0], list(model.recommend(130, n=5).index))
+        self.assertTrue(np.allclose(new_user[1], expected[new_user[0]]))
+        self.assertTrue(np.allclose(scores, expected[[2, 5]]))
+        self.assertEqual(known_user[0], list(model.recommend(101, n=5).index))
@@ -0,0 +1,117 @@
+import unittest
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+from neighbours import top_k_neighbours
+from similarity import CO_RATED_SHRINKAGE, SimilarityEngine, top_k_similarity, update_top_k
+
+
+class TestSimilarityEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.ratings_values = np.random.RandomState(1).randint(0, 6, (9, 7)).astype(float)
+        self.matrix = sp.csr_matrix(self.ratings_values)
+
+    def test_full_cosine(self):
+        similarity = SimilarityEngine(self.matrix, method='cosine').full()
+        norms = np.sqrt((self.ratings_values ** 2).sum(axis=1))
+        true_simil = self.ratings_values.dot(self.ratings_values.T) / np.outer(norms, norms)
+        self.assertTrue(np.allclose(similarity, true_simil))
+
+    def co_rated_cosine(self, centred):
+        # The cosine of every pair of rows over the columns where both are known
+        known = self.ratings_values > 0
+        true_simil = np.zeros((9, 9))
+        for u in range(9):
+            for v in range(9):
+                both = known[u] & known[v]
+                denom = np.sqrt((centred[u, both] ** 2).sum() * (centred[v, both] ** 2).sum())
+                true_simil[u, v] = (centred[u, both] * centred[v, both]).sum() / denom if denom > 0 else 0
+        return true_simil
+
+    def test_full_pearson(self):
+        similarity = SimilarityEngine(self.matrix, method='pearson', shrinkage=0.).full()
+        known = self.ratings_values > 0
+        means = self.ratings_values.sum(axis=1) / known.sum(axis=1)
+        self.assertTrue(np.allclose(similarity, self.co_rated_cosine(self.ratings_values - means[:, np.newaxis])))
+
+        # The unknown values are not treated as zeros
+        self.assertFalse(np.allclose(similarity, pd.DataFrame(self.ratings_values).transpose().corr().values))
+
+    def test_full_adjusted_cosine(self):
+        similarity = SimilarityEngine(self.matrix, method='adjusted', shrinkage=0.).full()
+        known = self.ratings_values > 0
+        means = self.ratings_values.sum(axis=0) / known.sum(axis=0)
+        self.assertTrue(np.allclose(similarity, self.co_rated_cosine(self.ratings_values - means)))
+
+    def test_shrinkage(self):
+        known = (self.ratings_values > 0).astype(float)
+        counts = known.dot(known.T)
+        for method in ('cosine', 'pearson', 'adjusted'):
+            similarity = SimilarityEngine(self.matrix, method=method, shrinkage=0.).full()
+            shrunk = SimilarityEngine(self.matrix, method=method, shrinkage=3.).full()
+            self.assertTrue(np.allclose(shrunk, similarity * counts / (counts + 3.)))
+
+    def test_co_rated_default_shrinkage(self):
+        # User 1 shares a single item with user 0, user 2 agrees with user 0 over five items and user 3 disagrees
+        matrix = sp.csr_matrix(np.array([[5, 1, 4, 2, 5, 0],
+                                         [5, 0, 0, 0, 0, 1],
+                                         [4, 2, 5, 1, 4, 0],
+                                         [1, 5, 2, 4, 1, 3]]))
+        for method in ('pearson', 'adjusted'):
+            unshrunk = SimilarityEngine(matrix, method=method, shrinkage=0.)
+            self.assertAlmostEqual(abs(unshrunk.full()[0, 1]), 1.)
+            engine = SimilarityEngine(matrix, method=method)
+            self.assertEqual(engine.shrinkage, CO_RATED_SHRINKAGE)
+            self.assertLess(abs(engine.full()[0, 1]), engine.full()[0, 2])
+            self.assertEqual(engine.top_k(1).indices[0, 0], 2)
+        self.assertEqual(SimilarityEngine(matrix).shrinkage, 0.)
+
+    def test_block_size_respects_budget(self):
+        engine = SimilarityEngine(self.matrix, memory_budget=4 * 8 * 9 * 2)
+        self.assertEqual(engine.block_size, 2)
+        blocks = list(engine.blocks())
+        self.assertEqual(len(blocks), 5)
+        self.assertEqual(blocks[-1][2].shape, (1, 9))
+
+    def test_top_k_matches_full_selection(self):
+        for method in ('cosine', 'pearson', 'adjusted'):
+            engine = SimilarityEngine(self.matrix, method=method)
+            true_graph = top_k_neighbours(engine.full(), 3)
+            graph = top_k_similarity(self.matrix, 3, method=method, memory_budget=1)
+            self.assertTrue(np.allclose(graph.weights, true_graph.weights))
+            self.assertTrue(np.allclose(graph.to_sparse().toarray(), true_graph.to_sparse().toarray()))
+
+    def test_unknown_method(self):
+        self.assertRaises(KeyError, SimilarityEngine, self.matrix, 'manhattan')
+
+    def test_update_top_k_matches_rebuild(self):
+        random = np.random.RandomState(2)
+        matrix = sp.random(40, 12, density=0.4, random_state=random, format='csr')
+        graph = top_k_similarity(matrix, 5)
+        matrix = sp.vstack((matrix, sp.random(3, 12, density=0.5, random_state=random))).tolil()
+        matrix[[4, 17]] = random.rand(2, 12) * (random.rand(2, 12) < 0.5)
+        engine = SimilarityEngine(matrix.tocsr(), memory_budget=4 * 8 * 43 * 7)
+        updated = update_top_k(engine, graph, [4, 17, 40, 41, 42], 5)
+        rebuilt = engine.top_k(5)
+        self.assertTrue(np.array_equal(updated.indices, rebuilt.indices))
+        self.assertTrue(np.allclose(updated.weights, rebuilt.weights))
+
+        # Pearson centres each row on its own mean, so appended columns only change the rows that rate them
+        original = sp.random(40, 12, density=0.4, random_state=random, format='csr')
+        graph = top_k_similarity(original, 5, method='pearson', shrinkage=2.)
+        extended = sp.hstack((original, sp.random(40, 2, density=0.2, random_state=random))).tocsr()
+        engine = SimilarityEngine(extended, method='pearson', shrinkage=2.)
+        changed = np.flatnonzero(np.diff(extended[:, 12:].tocsr().indptr))
+        updated = update_top_k(engine, graph, changed, 5)
+        rebuilt = engine.top_k(5)
+        self.assertTrue(np.array_equal(updated.indices, rebuilt.indices))
+        self.assertTrue(np.allclose(updated.weights, rebuilt.weights))
+
+    def test_single_precision(self):
+        engine = SimilarityEngine(self.matrix, method='pearson', dtype=np.float32, weight_dtype=np.float16)
+        self.assertEqual(engine.full().dtype, np.float32)
+        self.assertTrue(np.allclose(engine.full(), SimilarityEngine(self.matrix, method='pearson').full(), atol=1e-6))
+        graph = engine.top_k(3)
+        self.assertEqual(graph.weights.dtype, np.float16)
+        self.assertEqual(graph.to_sparse().dtype, np.float32)